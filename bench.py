@@ -0,0 +1,545 @@
+"""
+Benchmark harness comparing the interpreter pool with process and thread baselines.
+
+Launches up.py headless, waits for its pool to be ready and drives fixed request
+and task mixes against the /bench/ endpoints: CPU-bound pure Python, I/O-bound
+and large payloads. The request mixes also run against hypercorn with worker
+processes and with a single process of threads, and the task workloads on plain
+thread, process and interpreter pools. Throughput, latency percentiles, peak RSS
+and startup time of every run are written to a JSON file.
+
+    python bench.py --profile sqlite --out bench.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.interpreter import InterpreterPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from rich.logging import RichHandler
+
+from parimitham.tracing import percentile, read_spans
+from parimitham.workloads import cpu_work, io_work, make_payload, payload_work
+
+logging.basicConfig(level=logging.INFO, format="[bench] %(message)s", handlers=[RichHandler()])
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+
+PERCENTILES = (50, 95, 99)
+
+# Seconds to wait for a server to answer /health/, and for the tasks of a mix to finish
+STARTUP_TIMEOUT = 120.0
+TASKS_TIMEOUT = 300.0
+
+
+@dataclass(frozen=True)
+class Mix:
+    """A fixed request mix, ``workload`` naming the function the executor baselines run"""
+
+    name: str
+    path: str
+    workload: str
+    # Each request enqueues a task rather than doing the work itself
+    enqueues: bool = False
+    # Alias of the cache each request reads the work through, its hit rate is recorded
+    cache: Optional[str] = None
+
+
+MIXES = {
+    "cpu": Mix("cpu", "/bench/cpu/?n={cpu_n}", "cpu"),
+    "io": Mix("io", "/bench/io/?ms={io_ms}", "io"),
+    "task-cpu": Mix("task-cpu", "/bench/task/cpu/?n={cpu_n}", "cpu", enqueues=True),
+    "task-io": Mix("task-io", "/bench/task/io/?ms={io_ms}", "io", enqueues=True),
+    "task-payload": Mix("task-payload", "/bench/task/payload/?size={payload_size}", "payload", enqueues=True),
+    "cache-shared": Mix("cache-shared", "/bench/cache/shared/?keys={cache_keys}&n={cpu_n}", "cpu", cache="shared"),
+    "cache-local": Mix("cache-local", "/bench/cache/local/?keys={cache_keys}&n={cpu_n}", "cpu", cache="local"),
+}
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    summary = {f"p{p}": percentile(latencies, p) for p in PERCENTILES}
+    summary["max"] = latencies[-1]
+    return summary
+
+
+def tree_rss(pid: int) -> Optional[int]:
+    """Resident memory in bytes of a process and its descendants, None where /proc is missing"""
+    try:
+        children: dict[int, list[int]] = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    stat = Path(f"/proc/{entry}/stat").read_text()
+                except OSError:
+                    continue
+                # The command name may hold spaces, the fields after it do not
+                ppid = int(stat.rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+        total, pending = 0, [pid]
+        while pending:
+            current = pending.pop()
+            pending += children.get(current, [])
+            try:
+                status = Path(f"/proc/{current}/status").read_text()
+            except OSError:
+                continue
+            match = re.search(r"^VmRSS:\s+(\d+) kB", status, re.MULTILINE)
+            if match:
+                total += int(match.group(1)) * 1024
+        return total
+    except OSError:
+        return None
+
+
+class RssSampler:
+    """Samples the resident memory of a process tree in the background, keeping the peak"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def http_get(host: str, port: int, path: str, timeout: float = 30.0) -> tuple[int, bytes]:
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def drive(host: str, port: int, path: str, requests: int, concurrency: int) -> dict:
+    """Send ``requests`` GET requests from ``concurrency`` keep-alive clients, as fast as they are answered"""
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def client() -> None:
+        nonlocal errors
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        try:
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                start = time.perf_counter()
+                try:
+                    connection.request("GET", path)
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection(host, port, timeout=60)
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if ok:
+                        latencies.append(elapsed)
+                    else:
+                        errors += 1
+        finally:
+            connection.close()
+
+    started_at = time.perf_counter()
+    clients = [threading.Thread(target=client, name=f"client-{i}") for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "latency_seconds": latency_summary(latencies),
+    }
+
+
+def finished_tasks(host: str, port: int) -> float:
+    """Total of the tasks_finished_total counters of /metrics"""
+    _, body = http_get(host, port, "/metrics")
+    return sum(
+        float(line.rsplit(" ", 1)[1]) for line in body.decode().splitlines() if line.startswith("tasks_finished_total")
+    )
+
+
+def cache_counters(host: str, port: int, alias: str) -> dict[str, float]:
+    """
+    The cache_lookups_total counters of /metrics for a cache, by hit or miss,
+    and the sum and count of its cache_operation_duration_seconds, by get or set
+    """
+    _, body = http_get(host, port, "/metrics")
+    counters = dict.fromkeys(("hit", "miss", "get_sum", "get_count", "set_sum", "set_count"), 0.0)
+    for line in body.decode().splitlines():
+        if f'cache="{alias}"' not in line:
+            continue
+        value = float(line.rsplit(" ", 1)[1])
+        if line.startswith("cache_lookups_total{"):
+            counters["hit" if 'result="hit"' in line else "miss"] += value
+        for suffix in ("sum", "count"):
+            if line.startswith(f"cache_operation_duration_seconds_{suffix}{{"):
+                op = "get" if 'op="get"' in line else "set"
+                counters[f"{op}_{suffix}"] += value
+    return counters
+
+
+def task_latencies(trace_file: Path) -> dict:
+    """Queue wait, run time and end-to-end latency of the traced tasks"""
+    queued: dict[str, tuple[int, int]] = {}
+    ran: dict[str, tuple[int, int]] = {}
+    for span in read_spans(trace_file):
+        attributes = span["attributes"]
+        if attributes.get("kind") == "queue":
+            queued[attributes["result_id"]] = (span["startTimeUnixNano"], span["endTimeUnixNano"])
+        elif attributes.get("kind") == "task":
+            ran[attributes["result_id"]] = (span["startTimeUnixNano"], span["endTimeUnixNano"])
+    both = queued.keys() & ran.keys()
+    return {
+        "queue_wait_seconds": latency_summary([(end - start) / 1e9 for start, end in queued.values()]),
+        "run_seconds": latency_summary([(end - start) / 1e9 for start, end in ran.values()]),
+        "end_to_end_seconds": latency_summary([(ran[i][1] - queued[i][0]) / 1e9 for i in both]),
+    }
+
+
+class Server:
+    """A server process started headless, ready once /health/ answers 200"""
+
+    def __init__(self, name: str, command: list[str], env: dict, host: str, port: int, log_path: Path):
+        self.name = name
+        self.command = command
+        self.env = env
+        self.host = host
+        self.port = port
+        self.log_path = log_path
+        self.process: Optional[subprocess.Popen] = None
+        self.startup_seconds: Optional[float] = None
+
+    def __enter__(self) -> "Server":
+        logger.info("Starting %s: %s", self.name, shlex.join(self.command))
+        self._log = self.log_path.open("w")
+        started_at = time.perf_counter()
+        self.process = subprocess.Popen(
+            self.command, env=self.env, cwd=BASE_DIR, stdout=self._log, stderr=subprocess.STDOUT
+        )
+        while time.perf_counter() - started_at < STARTUP_TIMEOUT:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.process.returncode}, see {self.log_path}")
+            try:
+                if http_get(self.host, self.port, "/health/", timeout=2)[0] == 200:
+                    self.startup_seconds = time.perf_counter() - started_at
+                    logger.info("%s ready in %.2fs", self.name, self.startup_seconds)
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError(f"{self.name} not ready after {STARTUP_TIMEOUT}s, see {self.log_path}")
+
+    def __exit__(self, *exc_info) -> None:
+        # Ctrl+C, the graceful shutdown of both up.py and hypercorn
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+
+def run_server_mixes(server: Server, mixes: list[Mix], options, trace_file: Optional[Path] = None) -> list[dict]:
+    results = []
+    with server:
+        for mix in mixes:
+            path = mix.path.format(
+                cpu_n=options.cpu_n,
+                io_ms=options.io_ms,
+                payload_size=options.payload_size,
+                cache_keys=options.cache_keys,
+            )
+            logger.info(
+                "%s: %s, %d requests from %d clients", server.name, mix.name, options.requests, options.concurrency
+            )
+            finished_before = finished_tasks(server.host, server.port) if mix.enqueues else 0
+            counters_before = cache_counters(server.host, server.port, mix.cache) if mix.cache else {}
+            if trace_file:
+                trace_file.write_text("")
+            with RssSampler(server.process.pid) as rss:
+                started_at = time.perf_counter()
+                result = {
+                    "runtime": server.name,
+                    "mix": mix.name,
+                    "startup_seconds": server.startup_seconds,
+                    "http": drive(server.host, server.port, path, options.requests, options.concurrency),
+                }
+                if mix.enqueues:
+                    result["tasks"] = wait_for_tasks(server, finished_before, options.requests, started_at)
+            result["peak_rss_bytes"] = rss.peak
+            if mix.cache:
+                # The counters of the last requests are pushed about a second after them
+                time.sleep(1.5)
+                counters = cache_counters(server.host, server.port, mix.cache)
+                delta = {name: counters[name] - counters_before[name] for name in counters}
+                hits, misses = delta["hit"], delta["miss"]
+                result["cache"] = {
+                    "hits": int(hits),
+                    "misses": int(misses),
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                }
+                # Mean seconds per call, what a round trip to the shared cache costs against a local one
+                for op in ("get", "set"):
+                    count = delta[f"{op}_count"]
+                    result["cache"][f"{op}_seconds"] = delta[f"{op}_sum"] / count if count else 0.0
+            if mix.enqueues and trace_file:
+                # The spans of the last tasks are pushed about a second after they finish
+                time.sleep(1.5)
+                result["tasks"].update(task_latencies(trace_file))
+            results.append(result)
+    return results
+
+
+def wait_for_tasks(server: Server, finished_before: float, expected: int, started_at: float) -> dict:
+    finished = 0.0
+    while time.perf_counter() - started_at < TASKS_TIMEOUT:
+        finished = finished_tasks(server.host, server.port) - finished_before
+        if finished >= expected:
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started_at
+    return {"finished": int(finished), "seconds": elapsed, "throughput": finished / elapsed}
+
+
+def workload(mix: Mix, options) -> tuple[Callable, tuple]:
+    if mix.workload == "cpu":
+        return cpu_work, (options.cpu_n,)
+    if mix.workload == "io":
+        return io_work, (options.io_ms,)
+    return payload_work, (make_payload(options.payload_size),)
+
+
+def run_executor(name: str, factory: Callable[[int], Executor], mix: Mix, options) -> dict:
+    """Run the workload of a mix ``options.requests`` times on an executor of ``options.task_workers``"""
+    func, args = workload(mix, options)
+    latencies: list[float] = []
+    with RssSampler(os.getpid()) as rss:
+        started_at = time.perf_counter()
+        executor = factory(options.task_workers)
+        # Startup: every worker of the pool started and ran a call
+        for future in [executor.submit(io_work, 10) for _ in range(options.task_workers)]:
+            future.result()
+        startup_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        futures = []
+        for _ in range(options.requests):
+            submitted_at = time.perf_counter()
+            future = executor.submit(func, *args)
+            future.add_done_callback(lambda _, at=submitted_at: latencies.append(time.perf_counter() - at))
+            futures.append(future)
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started_at
+        executor.shutdown()
+    return {
+        "runtime": name,
+        "mix": mix.name,
+        "startup_seconds": startup_seconds,
+        "peak_rss_bytes": rss.peak,
+        "tasks": {
+            "finished": len(futures),
+            "seconds": elapsed,
+            "throughput": len(futures) / elapsed,
+            "end_to_end_seconds": latency_summary(latencies),
+        },
+    }
+
+
+EXECUTORS = {
+    "threads": ThreadPoolExecutor,
+    "processes": ProcessPoolExecutor,
+    "interpreters": InterpreterPoolExecutor,
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(options) -> dict:
+    mixes = [MIXES[name] for name in options.mixes]
+    host, port = options.bind.rsplit(":", 1)
+    port = int(port)
+    workdir = Path(tempfile.mkdtemp(prefix="parimitham-bench-"))
+    env = {**os.environ, "BENCHMARK_ENDPOINTS": "true", "TASK_LOG_EVERY": "1000000"}
+    if options.profile == "sqlite":
+        env.update(DB_ENGINE="sqlite3", DB_NAME=str(workdir / "bench.sqlite3"))
+    logger.info("Logs and traces in %s", workdir)
+
+    results = []
+    trace_file = workdir / "traces.jsonl"
+    up = [
+        sys.executable,
+        "up.py",
+        "-w",
+        str(options.workers),
+        "-t",
+        str(options.task_workers),
+        "-b",
+        options.bind,
+        "--trace-sample",
+        "1",
+        "--trace-file",
+        str(trace_file),
+        *shlex.split(options.up_args),
+    ]
+    results += run_server_mixes(
+        Server("up.py", up, env, host, port, workdir / "up.log"), mixes, options, trace_file=trace_file
+    )
+
+    # The baselines serve the requests only, their tasks and shared cache would have no pool manager to go to
+    request_mixes = [mix for mix in mixes if not mix.enqueues and not mix.cache]
+    hypercorn = [sys.executable, "-m", "hypercorn", "-b", options.bind, "parimitham.asgi:application"]
+    if "processes" in options.baselines and request_mixes:
+        command = [*hypercorn, "-w", str(options.workers)]
+        results += run_server_mixes(
+            Server("hypercorn-processes", command, env, host, port, workdir / "processes.log"), request_mixes, options
+        )
+    if "threads" in options.baselines and request_mixes:
+        # A single process, the requests running on the thread pool of its event loop
+        command = [*hypercorn, "-w", "1"]
+        results += run_server_mixes(
+            Server("hypercorn-threads", command, env, host, port, workdir / "threads.log"), request_mixes, options
+        )
+    if "executors" in options.baselines:
+        for name, factory in EXECUTORS.items():
+            for mix in dict((mix.workload, mix) for mix in mixes if not mix.cache).values():
+                logger.info("%s executor: %s workload, %d calls", name, mix.workload, options.requests)
+                results.append(run_executor(f"executor-{name}", factory, mix, options))
+
+    return {
+        "meta": {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "options": vars(options),
+        },
+        "results": results,
+    }
+
+
+def print_summary(report: dict) -> None:
+    for result in report["results"]:
+        http = result.get("http", {})
+        tasks = result.get("tasks", {})
+        latency = http.get("latency_seconds") or tasks.get("end_to_end_seconds") or {}
+        rss = result.get("peak_rss_bytes")
+        logger.info(
+            "%-22s %-13s %8.1f req/s %8.1f tasks/s  p50 %7.1fms  p99 %7.1fms  rss %s  startup %.2fs",
+            result["runtime"],
+            result["mix"],
+            http.get("throughput", 0.0),
+            tasks.get("throughput", 0.0),
+            latency.get("p50", 0.0) * 1000,
+            latency.get("p99", 0.0) * 1000,
+            f"{rss / 2**20:.0f}MiB" if rss else "n/a",
+            result["startup_seconds"] or 0.0,
+        )
+        if "cache" in result:
+            cache = result["cache"]
+            logger.info(
+                "%-22s %-13s hit rate %.1f%%, get %.3fms, set %.3fms",
+                result["runtime"],
+                result["mix"],
+                cache["hit_rate"] * 100,
+                cache["get_seconds"] * 1000,
+                cache["set_seconds"] * 1000,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the interpreter pool against process and thread baselines")
+    parser.add_argument(
+        "--profile",
+        choices=["sqlite", "postgres"],
+        default="sqlite",
+        help="sqlite runs without a database server, postgres uses the DB_* environment variables",
+    )
+    parser.add_argument("-w", "--workers", help="Web workers, and hypercorn worker processes", default=2, type=int)
+    parser.add_argument("-t", "--task-workers", help="Task workers, and executor workers", default=2, type=int)
+    parser.add_argument("-b", "--bind", help="Bind address of the servers", default="127.0.0.1:9011")
+    parser.add_argument("--up-args", help="Extra arguments of up.py", default="--payload-slots 32")
+    parser.add_argument(
+        "--mixes",
+        help="Comma separated mixes to run",
+        default=",".join(MIXES),
+        type=lambda value: [name for name in value.split(",") if name],
+    )
+    parser.add_argument(
+        "--baselines",
+        help="Comma separated baselines to run: processes, threads, executors, or none",
+        default="processes,threads,executors",
+        type=lambda value: [name for name in value.split(",") if name and name != "none"],
+    )
+    parser.add_argument("-n", "--requests", help="Requests per mix, and calls per executor run", default=200, type=int)
+    parser.add_argument("-c", "--concurrency", help="Concurrent HTTP clients", default=8, type=int)
+    parser.add_argument("--cpu-n", help="The CPU workload counts the primes below this", default=20_000, type=int)
+    parser.add_argument("--io-ms", help="Milliseconds the I/O workload waits", default=50.0, type=float)
+    parser.add_argument("--payload-size", help="Bytes of the payload workload", default=256 * 1024, type=int)
+    parser.add_argument("--cache-keys", help="Distinct keys read by the cache mixes", default=1000, type=int)
+    parser.add_argument("-o", "--out", help="JSON file the results are written to", default="bench.json")
+    args = parser.parse_args()
+
+    unknown = set(args.mixes) - MIXES.keys()
+    if unknown:
+        parser.error(f"Unknown mixes: {', '.join(sorted(unknown))}")
+
+    report = main(args)
+    Path(args.out).write_text(json.dumps(report, indent=2))
+    print_summary(report)
+    logger.info("Results written to %s", args.out)
@@ -0,0 +1,12 @@
+from locust import HttpUser, constant, task
+
+
+class BurstUser(HttpUser):
+    """Enqueue as fast as possible to measure the cross-interpreter handoff"""
+
+    wait_time = constant(0)
+    host = "http://127.0.0.1:9001"
+
+    @task
+    def dhello(self):
+        self.client.get("/dhello/")
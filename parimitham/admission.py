@@ -0,0 +1,132 @@
+"""
+Admission control of the web workers, in front of Django.
+
+The requests in flight are counted per path prefix of HTTP_CONCURRENCY_LIMITS,
+and a request over the limit of its prefix is rejected with a 503 and a
+``Retry-After`` header without reaching Django, rather than waiting for a
+thread behind slow requests. The health check is answered here too, so it
+never queues behind them either.
+"""
+
+import json
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from parimitham.metrics import inc
+from parimitham.readiness import health_status
+
+HEALTH_PATHS = ("/health/", "/health")
+
+# Seconds a rejected client is asked to wait before retrying
+RETRY_AFTER = 5
+
+REJECTED = {"message": "Too many requests in flight, try again later"}
+REJECTED_HEADERS = (("retry-after", str(RETRY_AFTER)),)
+
+
+class ConcurrencyLimits:
+    """Requests in flight per path prefix, the longest matching prefix applying"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+        self.in_flight = dict.fromkeys(limits, 0)
+        # Requests of the same worker may run on the event loop and on threads
+        self._lock = threading.Lock()
+
+    def _match(self, path: str) -> Optional[Tuple[str, int]]:
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return prefix, limit
+        return None
+
+    @contextmanager
+    def admit(self, path: str) -> Iterator[bool]:
+        """Whether the request is admitted, counting it as in flight until the block exits"""
+        match = self._match(path)
+        if match is None:
+            yield True
+            return
+        prefix, limit = match
+        with self._lock:
+            admitted = self.in_flight[prefix] < limit
+            if admitted:
+                self.in_flight[prefix] += 1
+        if not admitted:
+            inc("http_requests_rejected_total", path=prefix)
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self.in_flight[prefix] -= 1
+
+
+def _json_response(body: dict, extra_headers: Tuple[Tuple[str, str], ...]) -> Tuple[bytes, List[Tuple[str, str]]]:
+    content = json.dumps(body).encode()
+    headers = [("content-type", "application/json"), ("content-length", str(len(content))), *extra_headers]
+    return content, headers
+
+
+class ASGIAdmissionControl:
+    """Wraps the ASGI application of a web worker, answering on the event loop"""
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = ConcurrencyLimits(limits)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path in HEALTH_PATHS:
+            status, body = health_status()
+            inc("http_requests_total", method=scope["method"], view="health", status=str(status))
+            return await self._respond(send, status, body)
+        with self.limits.admit(path) as admitted:
+            if not admitted:
+                return await self._respond(send, HTTPStatus.SERVICE_UNAVAILABLE, REJECTED, REJECTED_HEADERS)
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _respond(send, status: int, body: dict, extra_headers=()) -> None:
+        content, headers = _json_response(body, extra_headers)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": int(status),
+                "headers": [(name.encode(), value.encode()) for name, value in headers],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+
+
+class WSGIAdmissionControl:
+    """
+    Wraps the WSGI application of a web worker. The request only counts as in
+    flight until the application returns, which Django does once the response
+    is rendered, streaming responses aside.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = ConcurrencyLimits(limits)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path in HEALTH_PATHS:
+            status, body = health_status()
+            inc("http_requests_total", method=environ["REQUEST_METHOD"], view="health", status=str(status))
+            return self._respond(start_response, status, body)
+        with self.limits.admit(path) as admitted:
+            if not admitted:
+                return self._respond(start_response, HTTPStatus.SERVICE_UNAVAILABLE, REJECTED, REJECTED_HEADERS)
+            return self.app(environ, start_response)
+
+    @staticmethod
+    def _respond(start_response, status: int, body: dict, extra_headers=()) -> List[bytes]:
+        content, headers = _json_response(body, extra_headers)
+        start_response(f"{int(status)} {HTTPStatus(status).phrase}", headers)
+        return [content]
@@ -0,0 +1,11 @@
+import os
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+from parimitham.admission import ASGIAdmissionControl
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "parimitham.settings")
+
+# Sets Django up, which the settings read below need
+application = ASGIAdmissionControl(get_asgi_application(), settings.HTTP_CONCURRENCY_LIMITS)
@@ -0,0 +1,172 @@
+"""
+Cache shared by all the interpreters.
+
+Every interpreter runs its own Django, so a ``LocMemCache`` ends up as one
+cache per interpreter, each missing the keys the others already computed. The
+entries of the ``SharedCache`` backend live once per process instead, in a
+cache store in the main interpreter reached over the ``cache_queue``. Values
+are pickled by the calling interpreter, so the store only holds opaque bytes
+and can account for their size.
+"""
+
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from queue_bridge import QueueService
+
+logger = logging.getLogger(__name__)
+
+CACHE_QUEUE_NAME = "cache_queue"
+
+# Rough per-entry overhead used for the byte budget on top of the key and value
+ENTRY_OVERHEAD = 128
+
+# Seconds between two sweeps of the expired entries
+SWEEP_INTERVAL = 60.0
+
+
+class CacheStore(QueueService):
+    """
+    Bounded in-memory cache.
+
+    Entries are kept in least recently used order, the least recently used
+    ones are evicted once ``max_entries`` or ``max_bytes`` is exceeded.
+    Expiry times are absolute, as given by the Django backend, expired
+    entries are dropped when read and by a sweep every SWEEP_INTERVAL seconds.
+    """
+
+    name = "cache-store"
+
+    def __init__(self, queue, max_entries: int = 10_000, max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(queue)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (pickled value, expiry time or None for never)
+        self.entries: OrderedDict[str, tuple[bytes, Optional[float]]] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def timeout(self) -> Optional[float]:
+        return self._next_sweep - time.monotonic()
+
+    def on_timeout(self) -> None:
+        now = time.time()
+        for key, (_, expires_at) in list(self.entries.items()):
+            if expires_at is not None and expires_at <= now:
+                self._drop(key)
+                self.expired += 1
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    @staticmethod
+    def _size(key: str, value: bytes) -> int:
+        return ENTRY_OVERHEAD + len(key) + len(value)
+
+    def _drop(self, key: str) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.total_bytes -= self._size(key, entry[0])
+        return True
+
+    def _live(self, key: str) -> Optional[tuple[bytes, Optional[float]]]:
+        """The entry of the key unless it expired, marked as the most recently used"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            self._drop(key)
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: bytes, expires_at: Optional[float]) -> None:
+        self._drop(key)
+        size = self._size(key, value)
+        # Already expired, e.g. a timeout of 0, or too large to ever fit
+        if (expires_at is not None and expires_at <= time.time()) or size > self.max_bytes:
+            return
+        self.entries[key] = (value, expires_at)
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._drop(oldest)
+            self.evicted += 1
+
+    def on_get(self, key: str) -> Optional[bytes]:
+        entry = self._live(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def on_get_many(self, keys: list[str]) -> dict[str, bytes]:
+        values = {}
+        for key in keys:
+            value = self.on_get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def on_has_key(self, key: str) -> bool:
+        return self._live(key) is not None
+
+    def on_set(self, key: str, value: bytes, expires_at: Optional[float]) -> None:
+        self._store(key, value, expires_at)
+
+    def on_set_many(self, items: dict[str, bytes], expires_at: Optional[float]) -> None:
+        for key, value in items.items():
+            self._store(key, value, expires_at)
+
+    def on_add(self, key: str, value: bytes, expires_at: Optional[float]) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._store(key, value, expires_at)
+        return True
+
+    def on_touch(self, key: str, expires_at: Optional[float]) -> bool:
+        entry = self._live(key)
+        if entry is None:
+            return False
+        self._store(key, entry[0], expires_at)
+        return True
+
+    def on_incr(self, key: str, delta: int) -> Optional[int]:
+        """The incremented value, None when the key is missing"""
+        entry = self._live(key)
+        if entry is None:
+            return None
+        value = pickle.loads(entry[0]) + delta
+        self._store(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), entry[1])
+        return value
+
+    def on_delete(self, key: str) -> bool:
+        return self._drop(key)
+
+    def on_delete_many(self, keys: list[str]) -> None:
+        for key in keys:
+            self._drop(key)
+
+    def on_clear(self) -> None:
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def on_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
@@ -0,0 +1,83 @@
+"""
+Control channel of the worker interpreters.
+
+The pool manager creates a control queue per worker, served in the worker
+interpreter by a single thread blocking on it between messages. The messages
+follow the ``QueueService`` protocol, so they are sent with notify_queue() and
+request_queue():
+
+- ``stop``: stop taking work, finish the work in flight and exit
+- ``drain``: like ``stop``, but a task worker first runs the tasks left on its queues,
+  a ``stop`` received while draining cuts it short
+- ``reload``: like ``stop``, then the pool manager starts the worker again in a fresh interpreter
+- ``stats``: reply with the stats of the worker, with those of its database connection pool if any
+"""
+
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+from parimitham.pooling import pool_stats
+from queue_bridge import QueueService
+
+STOP = "stop"
+DRAIN = "drain"
+RELOAD = "reload"
+STATS = "stats"
+
+
+class WorkerControl(QueueService):
+    """
+    Serves the control queue of a worker, calling ``stop`` and ``drain`` at most
+    once, except that a stop cuts a drain short. The worker calls stop() once it
+    exited, which ends the thread.
+    """
+
+    name = "worker-control"
+    daemon = False
+
+    def __init__(
+        self,
+        queue,
+        stop: Callable[[], None],
+        drain: Optional[Callable[[], None]] = None,
+        stats: Optional[Callable[[], dict]] = None,
+    ):
+        super().__init__(queue)
+        self._stop = stop
+        self._drain = drain or stop
+        self._stats = stats
+        self._stopping = threading.Lock()
+        self.started_at = time.monotonic()
+        # The op the worker exits on, None when it stopped on its own
+        self.exit_reason: Optional[str] = None
+
+    def _once(self, reason: str, callback: Callable[[], None], after: Optional[str] = None) -> None:
+        with self._stopping:
+            if self.exit_reason not in (None, after):
+                return
+            self.exit_reason = reason
+        callback()
+
+    def on_stop(self) -> None:
+        self._once(STOP, self._stop, after=DRAIN)
+
+    def on_drain(self) -> None:
+        self._once(DRAIN, self._drain)
+
+    def on_reload(self) -> None:
+        self._once(RELOAD, self._stop)
+
+    def on_stats(self) -> dict:
+        stats = {
+            "uptime": time.monotonic() - self.started_at,
+            # Per interpreter, each one has its own allocator
+            "allocated_blocks": sys.getallocatedblocks(),
+        }
+        db_pool = pool_stats()
+        if db_pool:
+            stats["db_pool"] = db_pool
+        if self._stats:
+            stats.update(self._stats())
+        return stats
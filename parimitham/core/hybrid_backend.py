@@ -0,0 +1,27 @@
+from django.tasks import TaskResult
+from django.tasks.exceptions import TaskResultDoesNotExist
+from django_tasks_db.models import DBTaskResult
+
+from parimitham.core.interpreter_queue_backend import InterpreterQueueBackend
+
+
+class HybridBackend(InterpreterQueueBackend):
+    """
+    Interpreter queue backend whose task records are also written to the
+    database, in batches, by the write-behind writer of the pool manager.
+
+    Tasks are dispatched and looked up through the interpreter queues as usual.
+    Results evicted from the result store, or from before a restart, are read
+    back from the database.
+    """
+
+    def get_result(self, result_id: str) -> TaskResult:
+        try:
+            return super().get_result(result_id)
+        except TaskResultDoesNotExist:
+            pass
+
+        try:
+            return DBTaskResult.objects.get(id=result_id, backend_name=self.alias).task_result
+        except (DBTaskResult.DoesNotExist, ValueError):
+            raise TaskResultDoesNotExist(result_id) from None
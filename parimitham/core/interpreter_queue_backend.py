@@ -1,37 +1,174 @@
 import logging
-from typing import TypeVar
+import pickle
+import threading
+import time
+from concurrent.interpreters import QueueFull
+from dataclasses import replace
+from typing import Callable, Optional, TypeVar
 from uuid import uuid7
 
-from django.tasks import Task, TaskResult, TaskResultStatus
+from django.tasks import Task, TaskResult, TaskResultStatus, task_backends
 from django.tasks.backends.base import BaseTaskBackend
+from django.tasks.base import TaskError
+from django.tasks.exceptions import TaskException, TaskResultDoesNotExist
+from django.utils import timezone
 from typing_extensions import ParamSpec
 
-from queue_bridge import get_shareable_queue
+from parimitham.lazy_thread import LazyThread
+from parimitham.metrics import inc, observe
+from parimitham.payloads import PayloadRef, free_payloads, pack_payloads, persistable_arguments
+from parimitham.result_store import (
+    READY,
+    ResultRecord,
+    discard_result,
+    fetch_result,
+    report_results,
+    result_update,
+)
+from parimitham.result_waiter import get_result_waiter
+from parimitham.retries import RetryPolicy
+from parimitham.routing import aput_tasks, get_lane, put_tasks, put_tasks_with_room
+from parimitham.scheduler import schedule_tasks
+from parimitham.task_registry import LogSampler, resolve_task, task_ref
+from parimitham.tracing import task_trace
 
 logger = logging.getLogger("__name__")
 
 T = TypeVar("T")
 P = ParamSpec("P")
 
+# What to do when the interpreter queue of a task is full
+OVERFLOW_BLOCK = "block"  # Wait up to overflow_timeout seconds for room, then reject
+OVERFLOW_REJECT = "reject"  # Raise TaskQueueFull straight away
+OVERFLOW_SPILL = "spill"  # Enqueue the task on the spill_backend database backend instead
+
+
+class TaskQueueFull(TaskException):
+    """The interpreter queue of the task is full."""
+
+
+class EnqueueBatcher:
+    """
+    Coalesces the enqueues of one interpreter into a single queue item.
+
+    A batch is flushed once it holds ``batch_size`` tasks or ``batch_window``
+    seconds after its first task, whichever comes first. Each task comes with
+    the seconds to wait for room on a full lane and what to do with the task
+    if there is still none, the caller having already returned by then.
+    """
+
+    def __init__(self, batch_size: int, batch_window: float):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        # (shareable task, result store update, seconds to wait for room, called when its lane stayed full)
+        self._entries: list[tuple[tuple, tuple, float, Callable[[], None]]] = []
+        self._flusher = LazyThread(
+            "enqueue-batcher", self._lock, lambda: time.sleep(self.batch_window), self._take, self._flush
+        )
+
+    def add(
+        self,
+        shareable_task: tuple,
+        update: tuple,
+        timeout: float,
+        on_full: Callable[[], None],
+        put_inline: bool = True,
+    ) -> None:
+        """
+        Add a task to the batch. When it fills the batch, the batch is put by
+        the caller, or by a short-lived thread if not ``put_inline``.
+        """
+        entries = None
+        with self._lock:
+            self._entries.append((shareable_task, update, timeout, on_full))
+            if len(self._entries) >= self.batch_size:
+                entries = self._swap()
+            else:
+                self._flusher.start()
+        if entries and put_inline:
+            self._put(entries)
+        elif entries:
+            threading.Thread(target=self._put, args=(entries,), name="enqueue-batcher").start()
+
+    def _swap(self) -> list[tuple]:
+        entries, self._entries = self._entries, []
+        return entries
+
+    def _take(self, _) -> Optional[list[tuple]]:
+        return self._swap() if self._entries else None
+
+    def _flush(self, entries: list[tuple]) -> None:
+        self._put(entries)
+
+    def _put(self, entries: list[tuple]) -> None:
+        # Register the tasks before they can be picked up so the store never sees RUNNING first
+        report_results([update for _, update, _, _ in entries])
+        # The backends sharing the batcher normally share their overflow settings too
+        timeout = max(timeout for _, _, timeout, _ in entries)
+        full = {shareable_task[0] for shareable_task in put_tasks_with_room([entry[0] for entry in entries], timeout)}
+        for shareable_task, _, _, on_full in entries:
+            if shareable_task[0] in full:
+                on_full()
+        logger.debug("Flushed a batch of %d tasks, %d of them on full lanes", len(entries), len(full))
+
+
+_batcher: Optional[EnqueueBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(batch_size: int, batch_window: float) -> EnqueueBatcher:
+    """Get the enqueue batcher of this interpreter, shared by all the backend instances"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EnqueueBatcher(batch_size, batch_window)
+        return _batcher
+
 
 class InterpreterQueueBackend(BaseTaskBackend):
     supports_async_task = True
     supports_get_result = True
     supports_defer = True
+    supports_priority = True
 
-    def _task_to_queue(
+    def __init__(self, alias, params):
+        super().__init__(alias, params)
+        self.batch_size = int(self.options.get("batch_size", 1))
+        self.batch_window = float(self.options.get("batch_window", 0.005))
+        self.concurrency = max(1, int(self.options.get("concurrency", 1)))
+        self.overflow = self.options.get("overflow", OVERFLOW_BLOCK)
+        self.overflow_timeout = float(self.options.get("overflow_timeout", 5.0))
+        self.spill_backend = self.options.get("spill_backend", "spill")
+        # Arguments of at least this many bytes go through the payload arena, 0 to keep them inline
+        self.payload_threshold = int(self.options.get("payload_threshold", 0))
+        # Per task INFO logs are only written for one in log_every tasks
+        self.log_every = int(self.options.get("log_every", 1))
+        self._log_sampler = LogSampler(self.log_every)
+        # {"default": {...}, "tasks": {"module.path": {...}}} with the RetryPolicy fields
+        retry = self.options.get("retry", {})
+        self.retry_policy = RetryPolicy(**retry.get("default", {}))
+        self.task_retry_policies = {
+            module_path: replace(self.retry_policy, **policy) for module_path, policy in retry.get("tasks", {}).items()
+        }
+
+    def _prepare(
         self,
         task: Task,
         args: P.args,  # type:ignore[valid-type]
         kwargs: P.kwargs,  # type:ignore[valid-type]
-    ) -> TaskResult:
+    ) -> tuple[TaskResult, tuple, tuple, list[PayloadRef]]:
+        """
+        Build the result, the result store update and the queue item of a task,
+        and move its large arguments into the payload arena
+        """
         result = TaskResult(
             id=str(uuid7()),
             task=task,
             args=args,
             kwargs=kwargs,
             status=TaskResultStatus.READY,
-            enqueued_at=None,
+            enqueued_at=timezone.now(),
             started_at=None,
             finished_at=None,
             backend=self.alias,
@@ -39,18 +176,251 @@ class InterpreterQueueBackend(BaseTaskBackend):
             errors=[],
             worker_ids=[],
         )
-        shareable_task = (task.module_path, args, kwargs)
-        worker_queue = get_shareable_queue("worker_queue")
-        worker_queue.put(shareable_task)
-        logger.info("Task enqueued: %s", result.id)
+        refs = []
+        if self.payload_threshold:
+            args, kwargs, refs = pack_payloads(args, kwargs, self.payload_threshold)
+        update = result_update(
+            result.id,
+            task.module_path,
+            READY,
+            args=args,
+            kwargs=kwargs,
+            enqueued_at=result.enqueued_at,
+            queue_name=task.queue_name,
+            priority=task.priority,
+            run_after=task.run_after,
+        )
+        # Without kwargs, a task with plain arguments is shared between interpreters without pickling
+        shareable_task = (
+            result.id,
+            task_ref(task.module_path),
+            args,
+            kwargs or None,
+            task.queue_name,
+            task.priority,
+            0,
+            # The time a deferred task waits for its run_after is not queue wait
+            task_trace() if task.run_after is None else None,
+        )
+        return result, update, shareable_task, refs
+
+    def get_retry_policy(self, module_path: str) -> RetryPolicy:
+        return self.task_retry_policies.get(module_path, self.retry_policy)
+
+    def _deferred(self, task: Task) -> bool:
+        return task.run_after is not None and task.run_after > timezone.now()
+
+    def _defer(self, task: Task, result: TaskResult, update: tuple, shareable_task: tuple, start: float) -> TaskResult:
+        """Hand the task to the scheduler, which puts it on its lane once ``run_after`` is due"""
+        report_results([update])
+        schedule_tasks([shareable_task], task.run_after.timestamp())
+        inc("tasks_deferred_total", queue=task.queue_name)
+        return self._enqueued(task, result, start)
+
+    def _lane_full(self, task: Task) -> bool:
+        # A batch is put later on, a queue already full is rejected or spilled before the caller returns
+        return self.overflow != OVERFLOW_BLOCK and get_lane(task.queue_name, task.priority).full()
+
+    def _put_timeout(self, block: bool = True) -> float:
+        """Seconds to wait for room on a full lane"""
+        return self.overflow_timeout if block and self.overflow == OVERFLOW_BLOCK else 0
+
+    def _batch(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+        result: TaskResult,
+        update: tuple,
+        shareable_task: tuple,
+        refs: list[PayloadRef],
+        put_inline: bool = True,
+    ) -> None:
+        def on_full():
+            discard_result(result.id)
+            free_payloads(refs)
+            try:
+                self._overflow(task, args, kwargs)
+            except TaskQueueFull:
+                # Counted and logged, the caller already returned
+                pass
+
+        get_batcher(self.batch_size, self.batch_window).add(
+            shareable_task, update, self._put_timeout(), on_full, put_inline=put_inline
+        )
+
+    def _enqueued(self, task: Task, result: TaskResult, start: float) -> TaskResult:
+        inc("tasks_enqueued_total", queue=task.queue_name)
+        observe("task_enqueue_duration_seconds", time.perf_counter() - start, queue=task.queue_name)
+        if self._log_sampler() or logger.isEnabledFor(logging.DEBUG):
+            logger.info("Task enqueued: %s", result.id)
         return result
 
+    def _task_to_queue(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+        block: bool = True,
+    ) -> TaskResult:
+        start = time.perf_counter()
+        deferred = self._deferred(task)
+        batched = self.batch_size > 1 and block
+        if batched and not deferred and self._lane_full(task):
+            return self._overflow(task, args, kwargs)
+        result, update, shareable_task, refs = self._prepare(task, args, kwargs)
+        if deferred:
+            return self._defer(task, result, update, shareable_task, start)
+
+        if batched:
+            self._batch(task, args, kwargs, result, update, shareable_task, refs)
+        else:
+            # Register the task before it can be picked up so the store never sees RUNNING first
+            report_results([update])
+            try:
+                put_tasks([shareable_task], timeout=self._put_timeout(block))
+            except QueueFull:
+                discard_result(result.id)
+                free_payloads(refs)
+                return self._overflow(task, args, kwargs)
+        return self._enqueued(task, result, start)
+
+    async def _atask_to_queue(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+    ) -> TaskResult:
+        start = time.perf_counter()
+        deferred = self._deferred(task)
+        if self.batch_size > 1 and not deferred and self._lane_full(task):
+            return await self._aoverflow(task, args, kwargs)
+        result, update, shareable_task, refs = self._prepare(task, args, kwargs)
+        if deferred:
+            return self._defer(task, result, update, shareable_task, start)
+
+        if self.batch_size > 1:
+            # A full batch is put from a thread rather than from the event loop
+            self._batch(task, args, kwargs, result, update, shareable_task, refs, put_inline=False)
+        else:
+            report_results([update])
+            try:
+                await aput_tasks([shareable_task], timeout=self._put_timeout())
+            except QueueFull:
+                discard_result(result.id)
+                free_payloads(refs)
+                return await self._aoverflow(task, args, kwargs)
+        return self._enqueued(task, result, start)
+
+    def _overflow(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+    ) -> TaskResult:
+        if self.overflow == OVERFLOW_SPILL:
+            inc("tasks_spilled_total", queue=task.queue_name)
+            logger.warning("Queue %s is full, spilling task to the %s backend", task.queue_name, self.spill_backend)
+            return task_backends[self.spill_backend].enqueue(task.using(backend=self.spill_backend), args, kwargs)
+
+        inc("tasks_rejected_total", queue=task.queue_name)
+        logger.warning("Queue %s is full, rejecting task %s", task.queue_name, task.module_path)
+        raise TaskQueueFull(f"Queue '{task.queue_name}' is full")
+
+    async def _aoverflow(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+    ) -> TaskResult:
+        if self.overflow == OVERFLOW_SPILL:
+            inc("tasks_spilled_total", queue=task.queue_name)
+            logger.warning("Queue %s is full, spilling task to the %s backend", task.queue_name, self.spill_backend)
+            return await task_backends[self.spill_backend].aenqueue(
+                task.using(backend=self.spill_backend), args, kwargs
+            )
+        return self._overflow(task, args, kwargs)
+
     def enqueue(
         self,
         task: Task,
         args: P.args,  # type:ignore[valid-type]
         kwargs: P.kwargs,  # type:ignore[valid-type]
-    ) -> None:
+    ) -> TaskResult:
+        self.validate_task(task)
+
+        return self._task_to_queue(task, args, kwargs)
+
+    def enqueue_nowait(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+    ) -> TaskResult:
+        """Enqueue without batching nor waiting for room, a full queue spills the task or rejects it straight away"""
+        self.validate_task(task)
+
+        return self._task_to_queue(task, args, kwargs, block=False)
+
+    async def aenqueue(
+        self,
+        task: Task,
+        args: P.args,  # type:ignore[valid-type]
+        kwargs: P.kwargs,  # type:ignore[valid-type]
+    ) -> TaskResult:
+        """Enqueue from the event loop, without waiting on a thread nor blocking on a full queue"""
         self.validate_task(task)
 
-        self._task_to_queue(task, args, kwargs)
+        return await self._atask_to_queue(task, args, kwargs)
+
+    def get_result(self, result_id: str) -> TaskResult:
+        record = fetch_result(result_id)
+        if record is None:
+            if self.overflow == OVERFLOW_SPILL:
+                return task_backends[self.spill_backend].get_result(result_id)
+            raise TaskResultDoesNotExist(result_id)
+        return self._to_task_result(record)
+
+    def wait_for_result(self, result_id: str, timeout: Optional[float] = None) -> TaskResult:
+        """
+        Block until the task finished, SUCCESSFUL or FAILED, and return its
+        result. Raises TimeoutError after ``timeout`` seconds.
+        """
+        record = get_result_waiter().wait(result_id, timeout)
+        if record is None:
+            raise TaskResultDoesNotExist(result_id)
+        return self._to_task_result(record)
+
+    async def await_result(self, result_id: str, timeout: Optional[float] = None) -> TaskResult:
+        """Like wait_for_result(), from the event loop"""
+        record = await get_result_waiter().await_result(result_id, timeout)
+        if record is None:
+            raise TaskResultDoesNotExist(result_id)
+        return self._to_task_result(record)
+
+    def _to_task_result(self, record: ResultRecord) -> TaskResult:
+        args, kwargs = pickle.loads(record.payload) if record.payload else ((), {})
+        # The result store keeps the arena references, to free their slots should the worker die, but the
+        # slots are reused once the task returns, so the arguments stored there only read as their length
+        args, kwargs = persistable_arguments(args, kwargs)
+        task = resolve_task(task_ref(record.module_path))
+        result = TaskResult(
+            id=record.id,
+            task=task.using(run_after=record.run_after) if record.run_after else task,
+            args=args,
+            kwargs=kwargs,
+            status=TaskResultStatus[record.status],
+            enqueued_at=record.enqueued_at,
+            started_at=record.started_at,
+            finished_at=record.finished_at,
+            backend=self.alias,
+            last_attempted_at=record.last_attempted_at,
+            errors=[
+                TaskError(exception_class_path=exception_class_path, traceback=traceback)
+                for exception_class_path, traceback in record.errors
+            ],
+            worker_ids=record.worker_ids,
+        )
+        if record.return_value:
+            object.__setattr__(result, "_return_value", pickle.loads(record.return_value))
+        return result
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from parimitham.dead_letters import read_dead_letters, request_action
+
+
+class Command(BaseCommand):
+    help = "List, show, replay or purge the tasks of the dead-letter queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action",
+            choices=["list", "show", "replay", "purge"],
+            help="list the dead letters, show one with its traceback, or ask the running pool to replay or purge them",
+        )
+        parser.add_argument("ids", nargs="*", help="Task result ids")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Replay or purge every dead letter",
+        )
+        parser.add_argument(
+            "--file",
+            default=settings.DEAD_LETTER_FILE,
+            help="The dead-letter file (default: %(default)r)",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["file"])
+        action, ids = options["action"], options["ids"]
+
+        if action == "list":
+            for entry in read_dead_letters(path):
+                self.stdout.write(
+                    f"{entry['id']}  {entry['task_path']}  attempts={entry['attempts']}  "
+                    f"{entry['exception_class_path']}  {entry['failed_at']}"
+                )
+            return
+
+        if action == "show":
+            entries = {entry["id"]: entry for entry in read_dead_letters(path)}
+            for result_id in ids:
+                entry = entries.get(result_id)
+                if entry is None:
+                    raise CommandError(f"No dead letter {result_id}")
+                for name in ("id", "task_path", "queue_name", "priority", "attempts", "failed_at", "args", "kwargs"):
+                    self.stdout.write(f"{name}: {entry[name]}")
+                self.stdout.write(entry["traceback"])
+            return
+
+        if options["all"]:
+            ids = ["*"]
+        elif not ids:
+            raise CommandError(f"Give the ids of the dead letters to {action}, or --all")
+        request_action(path, action, ids)
+        self.stdout.write(f"Requested {action} of {', '.join(ids)}, applied by the running pool or on its next start")
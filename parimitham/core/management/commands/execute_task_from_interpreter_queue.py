@@ -1,21 +1,58 @@
+import asyncio
 import logging
 import signal
 import sys
+import threading
 import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from concurrent.interpreters import QueueEmpty
+from inspect import iscoroutinefunction
 from types import FrameType
-from typing import Any, Tuple
+from typing import Any, Callable, Optional, Tuple
 
 from django.core.management.base import BaseCommand
+from django.tasks import task_backends
 from django.utils import timezone
-from django.utils.module_loading import import_string
+from django_tasks_db.management.commands.db_worker import Worker as DBWorker
+from django_tasks_db.models import DBTaskResult
+from django_tasks_db.utils import exclusive_transaction
 
-from queue_bridge import get_shareable_queue
+from parimitham.dead_letters import dead_letter
+from parimitham.metrics import inc, observe
+from parimitham.payloads import free_payloads, unpack_payloads
+from parimitham.result_store import FAILED, READY, RUNNING, SUCCESSFUL, report_result
+from parimitham.retries import NO_RETRY, RetryPolicy
+from parimitham.routing import ATTEMPT_INDEX, TRACE_INDEX, Subscription, parse_queue_group, put_tasks
+from parimitham.scheduler import can_schedule, schedule_tasks
+from parimitham.task_registry import LogSampler, TaskRef, resolve_task, task_path
+from parimitham.tracing import TraceContext, record_task_spans, requeued_trace
 
 logger = logging.getLogger(__name__)
 
+# (result_id, task_ref, args, kwargs or None, queue_name, priority, attempts, trace or None),
+# task_ref indexing the task table
+ShareableTask = Tuple[str, TaskRef, tuple, Optional[dict], str, int, int, Optional[TraceContext]]
+
+
+def unbatch(item: tuple | list) -> list[tuple]:
+    """Web workers put either a single task tuple or a list of them on the queue"""
+    return item if isinstance(item, list) else [item]
+
 
 class InterpreterWorker:
+    """
+    Runs the tasks put on the interpreter queues of ``queue_names``.
+
+    ``group`` names the worker group whose doorbell wakes the worker up, and
+    ``queue_weights`` how often each queue gets a turn within a priority band.
+
+    With ``concurrency`` above 1, up to that many tasks are in flight at once:
+    sync tasks run on a thread pool and ``async def`` tasks on an event loop
+    owned by the worker. Async tasks always go through the event loop, even
+    with a concurrency of 1.
+    """
+
     def __init__(
         self,
         *,
@@ -26,17 +63,51 @@ class InterpreterWorker:
         startup_delay: bool,
         max_tasks: int | None,
         worker_id: str,
+        batch_size: int = 1,
+        concurrency: int = 1,
+        group: Optional[str] = None,
+        queue_weights: Optional[dict[str, int]] = None,
+        spill_worker: Optional[DBWorker] = None,
+        log_every: int = 1,
+        retry_policy: Optional[Callable[[str], RetryPolicy]] = None,
+        max_blocks: Optional[int] = None,
     ):
         self.queue_names = queue_names
+        self.group = group or ",".join(queue_names)
+        self.queue_weights = queue_weights or {}
         self.interval = interval
         self.batch = batch
+        self.batch_size = batch_size
         self.backend_name = backend_name
         self.startup_delay = startup_delay
         self.max_tasks = max_tasks
+        # Stop once the interpreter holds that many memory blocks, sys.getallocatedblocks()
+        # counts the blocks of this interpreter only since each one has its own allocator
+        self.max_blocks = max_blocks
         self.worker_id = worker_id
+        self.concurrency = concurrency
+        # Runs the tasks spilled to the database while the queues were full
+        self.spill_worker = spill_worker
+        # Per task INFO logs are only written for one in log_every tasks
+        self._log_sampler = LogSampler(log_every)
+        # Retry policy of a task, by module path
+        self.retry_policy = retry_policy or (lambda module_path: NO_RETRY)
         self.running = True
-        self.running_task = False
+        # Set to interrupt the wait for the next task, e.g. on stop or drain
+        self.wake = threading.Event()
+        self.draining = False
         self._run_tasks = 0
+        # One slot per task in flight, the run loop only dequeues when a slot is free
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._in_flight_lock = threading.Lock()
+        self._in_flight = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+
+    @property
+    def running_task(self) -> bool:
+        return self._in_flight > 0
 
     def shutdown(self, signum: int, frame: FrameType | None) -> None:
         if not self.running:
@@ -48,56 +119,295 @@ class InterpreterWorker:
             "Received %s - shutting down gracefully... (press Ctrl+C again to force)", signal.strsignal(signum)
         )
         self.running = False
+        self.wake.set()
 
         if not self.running_task:
             sys.exit(0)
 
+    def stop(self) -> None:
+        """Stop taking tasks, the run loop returns once the tasks in flight finished"""
+        self.running = False
+        self.wake.set()
+
+    def drain(self) -> None:
+        """Run the tasks left on the queues without waiting for new ones, then stop"""
+        self.draining = True
+        self.wake.set()
+
+    def stats(self) -> dict:
+        return {"in_flight": self._in_flight, "run_tasks": self._run_tasks, "draining": self.draining}
+
     def run(self, timeout: float = 1.0) -> None:
-        self.running = True
-        logger.info("Starting task worker with timeout: %s", timeout)
+        logger.info("Starting task worker with timeout: %s, concurrency: %d", timeout, self.concurrency)
 
-        worker_queue = get_shareable_queue("worker_queue")
-        logger.info("Using worker queue: %s", worker_queue)
+        subscription = Subscription(
+            self.group, [(queue_name, self.queue_weights.get(queue_name, 1)) for queue_name in self.queue_names]
+        )
+        logger.info("Using queues: %s", ", ".join(subscription.order))
+        # Without spilled tasks to look for, wait for the doorbell until woken up
+        timeout = timeout if self.spill_worker else None
 
-        while self.running:
-            try:
-                shareable_task = worker_queue.get(timeout=timeout)
+        try:
+            while self.running:
+                if self.should_recycle():
+                    break
+                try:
+                    if self.draining:
+                        shareable_tasks = self.take_tasks(subscription)
+                        if not shareable_tasks:
+                            logger.info("Queues drained, stopping")
+                            break
+                    else:
+                        shareable_tasks = self.next_tasks(subscription, timeout)
 
-                if shareable_task is None:
+                    for index, shareable_task in enumerate(shareable_tasks):
+                        if not self.running:
+                            # Hand the drained tasks we did not get to back to the other workers
+                            put_tasks(shareable_tasks[index:])
+                            break
+                        self.submit_task(shareable_task)
+
+                except QueueEmpty:
+                    if self.spill_worker:
+                        self.run_spilled_tasks()
                     continue
+                except (OSError, RuntimeError):
+                    time.sleep(self.interval)
+        finally:
+            self.wait_for_tasks()
 
-                self.run_task(shareable_task)
+    def should_recycle(self) -> bool:
+        """Whether the worker ran its ``max_tasks`` or reached its ``max_blocks``, to be started afresh"""
+        if self.max_tasks and self._run_tasks >= self.max_tasks:
+            logger.info("Ran %d tasks, stopping to be recycled", self._run_tasks)
+            return True
+        if self.max_blocks and sys.getallocatedblocks() >= self.max_blocks:
+            logger.info("Holding %d memory blocks, stopping to be recycled", sys.getallocatedblocks())
+            return True
+        return False
 
-            except QueueEmpty:
-                continue
-            except (OSError, RuntimeError):
-                time.sleep(self.interval)
+    def next_tasks(self, subscription: Subscription, timeout: float) -> list[tuple]:
+        """
+        Wait for the next task. In batch mode, also drain whatever else is
+        already waiting, up to ``batch_size`` tasks, in the same wakeup.
+        """
+        subscription.wait(timeout=timeout, wake=self.wake)
+        return self.take_tasks(subscription)
+
+    def take_tasks(self, subscription: Subscription) -> list[tuple]:
+        """Take the tasks waiting on the lanes, up to ``batch_size`` in batch mode, without blocking"""
+        shareable_tasks = []
+        while not shareable_tasks or (self.batch and len(shareable_tasks) < self.batch_size):
+            item = subscription.take()
+            if item is None:
+                # Another group sharing a queue got there first
+                break
+            shareable_tasks.extend(unbatch(item))
+        return [shareable_task for shareable_task in shareable_tasks if shareable_task is not None]
+
+    def run_spilled_tasks(self) -> int:
+        """Run the tasks spilled to the database, only called while the queues are empty"""
+        ran = 0
+        while self.running:
+            tasks = DBTaskResult.objects.ready().filter(
+                backend_name=self.spill_worker.backend_name, queue_name__in=self.queue_names
+            )
+            with exclusive_transaction(tasks.db):
+                db_task_result = tasks.get_locked()
+                if db_task_result is not None:
+                    db_task_result.claim(self.worker_id)
 
-    def run_task(self, shareable_task: Tuple[str, tuple, dict]) -> Any:
+            if db_task_result is None:
+                break
+            self.spill_worker.run_task(db_task_result)
+            ran += 1
+
+        if ran:
+            logger.info("Ran %d spilled task(s)", ran)
+        return ran
+
+    def submit_task(self, shareable_task: ShareableTask) -> None:
+        """Run the task inline, on the thread pool or on the event loop once a slot is free"""
+        dequeued_at = time.time_ns()
+        self._slots.acquire()
+        with self._in_flight_lock:
+            self._in_flight += 1
         try:
-            self.running_task = True
-            module_path, args, kwargs = shareable_task
+            task_func = resolve_task(shareable_task[1]).func
+        except Exception:
+            task_func = None
+
+        if iscoroutinefunction(task_func):
+            future = asyncio.run_coroutine_threadsafe(self.arun_task(shareable_task, dequeued_at), self._get_loop())
+        elif self.concurrency > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="task-runner")
+            future = self._executor.submit(self.run_task, shareable_task, dequeued_at)
+        else:
+            try:
+                self.run_task(shareable_task, dequeued_at)
+            finally:
+                self._task_done()
+            return
+        future.add_done_callback(self._task_done)
+
+    def _task_done(self, future: Future | None = None) -> None:
+        with self._in_flight_lock:
+            self._in_flight -= 1
+            self._run_tasks += 1
+        self._slots.release()
 
-            logger.info("Executing task from queue: %s", shareable_task)
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=self._loop.run_forever, name="task-event-loop")
+            self._loop_thread.start()
+        return self._loop
 
-            task_func = import_string(module_path).func
+    def wait_for_tasks(self) -> None:
+        """Wait for the tasks in flight to finish, then stop the thread pool and the event loop"""
+        logger.info("Waiting for %d task(s) in flight", self._in_flight)
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+        for _ in range(self.concurrency):
+            self._slots.release()
 
-            start_time = timezone.now()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = None
+
+    def _task_started(self, shareable_task: ShareableTask) -> Tuple[Callable, Any]:
+        result_id, ref = shareable_task[:2]
+        module_path = task_path(ref)
+
+        if self._log_sampler() or logger.isEnabledFor(logging.DEBUG):
+            logger.info("Executing task %s: %s", result_id, module_path)
+
+        task_func = resolve_task(ref).func
+
+        start_time = timezone.now()
+        report_result(
+            result_id,
+            module_path,
+            RUNNING,
+            started_at=start_time,
+            last_attempted_at=start_time,
+            worker_id=self.worker_id,
+        )
+        return task_func, start_time
+
+    def _task_succeeded(self, shareable_task: ShareableTask, start_time: Any, result: Any) -> None:
+        result_id, ref, _, _, queue_name = shareable_task[:5]
+        module_path = task_path(ref)
+        end_time = timezone.now()
+        duration = (end_time - start_time).total_seconds()
+        report_result(result_id, module_path, SUCCESSFUL, finished_at=end_time, return_value=result)
+        inc("tasks_finished_total", queue=queue_name, task=module_path, status=SUCCESSFUL)
+        observe("task_duration_seconds", duration, queue=queue_name)
+
+        logger.debug("Task %s completed successfully in %ss", module_path, duration)
+
+    def _task_failed(self, shareable_task: ShareableTask, e: Exception, start_time: Any = None) -> bool:
+        """Retry the task later if its retry policy allows, else fail it. Returns whether it is retried."""
+        result_id, ref, _, _, queue_name = shareable_task[:5]
+        module_path = task_path(ref)
+        attempts = shareable_task[ATTEMPT_INDEX] + 1
+        policy = self.retry_policy(module_path)
+        end_time = timezone.now()
+        error = (f"{type(e).__module__}.{type(e).__qualname__}", "".join(traceback.format_exception(e)))
+        if start_time is not None:
+            observe("task_duration_seconds", (end_time - start_time).total_seconds(), queue=queue_name)
+
+        if policy.should_retry(attempts) and can_schedule():
+            delay = policy.delay(attempts)
+            logger.warning(
+                "Task %s failed (attempt %d of %d), retrying in %.2fs: %s",
+                module_path,
+                attempts,
+                policy.max_attempts,
+                delay,
+                e,
+            )
+            report_result(result_id, module_path, READY, error=error)
+            due_at = time.time() + delay
+            schedule_tasks(
+                [(*shareable_task[:ATTEMPT_INDEX], attempts, requeued_trace(shareable_task[TRACE_INDEX], due_at))],
+                due_at,
+            )
+            inc("tasks_retried_total", queue=queue_name, task=module_path)
+            return True
+
+        logger.error("Task execution failed for %s: %s", module_path, e, exc_info=True)
+        report_result(result_id, module_path, FAILED, finished_at=end_time, error=error)
+        dead_letter(shareable_task, module_path, attempts, *error)
+        inc("tasks_finished_total", queue=queue_name, task=module_path, status=FAILED)
+        return False
+
+    def _trace_task(
+        self, shareable_task: ShareableTask, dequeued_at: Optional[int], started_at: Optional[int], status: str
+    ) -> None:
+        trace = shareable_task[TRACE_INDEX]
+        if trace is None or dequeued_at is None:
+            return
+        result_id, ref, _, _, queue_name = shareable_task[:5]
+        record_task_spans(trace, result_id, task_path(ref), queue_name, dequeued_at, started_at, time.time_ns(), status)
+
+    def run_task(self, shareable_task: ShareableTask, dequeued_at: Optional[int] = None) -> Any:
+        start_time = started_at = None
+        refs = []
+        retrying = False
+        status = FAILED
+        try:
+            # Views of the payload arena slots, only valid until the task returns
+            args, kwargs, refs = unpack_payloads(shareable_task[2], shareable_task[3] or {})
+            task_func, start_time = self._task_started(shareable_task)
+            started_at = time.time_ns()
 
             result = task_func(*args, **kwargs)
 
-            end_time = timezone.now()
-            duration = (end_time - start_time).total_seconds()
+            self._task_succeeded(shareable_task, start_time, result)
+            status = SUCCESSFUL
+            return result
 
-            logger.info("Task %s completed successfully in %ss", module_path, duration)
+        except Exception as e:
+            retrying = self._task_failed(shareable_task, e, start_time)
+            status = READY if retrying else FAILED
+        finally:
+            # A retried task keeps its payload slots until its last attempt
+            if not retrying:
+                free_payloads(refs)
+            self._trace_task(shareable_task, dequeued_at, started_at, status)
 
+    async def arun_task(self, shareable_task: ShareableTask, dequeued_at: Optional[int] = None) -> Any:
+        start_time = started_at = None
+        refs = []
+        retrying = False
+        status = FAILED
+        try:
+            # Views of the payload arena slots, only valid until the task returns
+            args, kwargs, refs = unpack_payloads(shareable_task[2], shareable_task[3] or {})
+            task_func, start_time = self._task_started(shareable_task)
+            started_at = time.time_ns()
+
+            result = await task_func(*args, **kwargs)
+
+            self._task_succeeded(shareable_task, start_time, result)
+            status = SUCCESSFUL
             return result
 
         except Exception as e:
-            logger.error("Task execution failed for %s: %s", module_path, e, exc_info=True)
+            retrying = self._task_failed(shareable_task, e, start_time)
+            status = READY if retrying else FAILED
         finally:
-            self.running_task = False
-            self._run_tasks += 1
+            # A retried task keeps its payload slots until its last attempt
+            if not retrying:
+                free_payloads(refs)
+            self._trace_task(shareable_task, dequeued_at, started_at, status)
 
 
 class Command(BaseCommand):
@@ -109,7 +419,7 @@ class Command(BaseCommand):
             nargs="?",
             default="default",
             type=str,
-            help="The queues to process. Separate multiple with a comma. To process all queues, use '*' (default: %(default)r)",
+            help="The queues to process. Separate multiple with a comma, and give each an optional :WEIGHT, e.g. fast:3,default:1 (default: %(default)r)",
         )
         parser.add_argument(
             "--interval",
@@ -118,6 +428,20 @@ class Command(BaseCommand):
             type=float,
             help="The interval (in seconds) to wait, when there are no tasks in the queue, before checking for tasks again (default: %(default)r)",
         )
+        parser.add_argument(
+            "--batch-size",
+            nargs="?",
+            default=1,
+            type=int,
+            help="The number of tasks to take from the queue per wakeup (default: %(default)r)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            nargs="?",
+            default=1,
+            type=int,
+            help="The number of tasks the worker runs at once (default: %(default)r)",
+        )
         parser.add_argument(
             "--backend",
             nargs="?",
@@ -141,13 +465,19 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        group = parse_queue_group(options["queue_name"])
         worker = InterpreterWorker(
-            queue_names=options["queue_name"].split(","),
+            queue_names=group.queue_names,
+            queue_weights=dict(group.weights),
+            group=group.name,
             interval=options["interval"],
-            batch=options["batch"],
+            batch=options["batch_size"] > 1,
+            batch_size=options["batch_size"],
+            concurrency=options["concurrency"],
             backend_name=options["backend_name"],
             startup_delay=options["startup_delay"],
             max_tasks=options["max_tasks"],
             worker_id=options["worker_id"],
+            retry_policy=getattr(task_backends[options["backend_name"]], "get_retry_policy", None),
         )
         worker.run()
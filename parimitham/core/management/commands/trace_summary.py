@@ -0,0 +1,60 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from parimitham.tracing import percentile, read_spans
+
+PERCENTILES = (50, 95, 99)
+
+# Span kind -> (section title, attribute the spans are grouped by)
+SECTIONS = {
+    "queue": ("Queue wait", "queue"),
+    "task": ("Run time", "task"),
+    "http": ("Request duration", "view"),
+}
+
+
+class Command(BaseCommand):
+    help = "Summarize the traced queue wait, run time and request duration as p50/p95/p99"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            default=settings.TRACE_FILE,
+            help="The trace file (default: %(default)r)",
+        )
+        parser.add_argument(
+            "--trace",
+            help="Only the spans of this trace id",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["file"])
+        if not path.exists():
+            raise CommandError(f"No trace file {path}, start up.py with --trace-sample")
+
+        # kind -> group -> durations in seconds
+        durations: dict[str, dict[str, list[float]]] = {kind: {} for kind in SECTIONS}
+        for span in read_spans(path):
+            if options["trace"] and span["traceId"] != options["trace"]:
+                continue
+            attributes = span["attributes"]
+            kind = attributes.get("kind")
+            if kind not in SECTIONS:
+                continue
+            group = str(attributes.get(SECTIONS[kind][1], ""))
+            seconds = (span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e9
+            durations[kind].setdefault(group, []).append(seconds)
+
+        for kind, (title, attribute) in SECTIONS.items():
+            if not durations[kind]:
+                continue
+            self.stdout.write(f"{title} by {attribute}")
+            self.stdout.write(f"  {'':40} {'count':>8} " + " ".join(f"{f'p{p}':>10}" for p in PERCENTILES))
+            for group, values in sorted(durations[kind].items()):
+                values.sort()
+                self.stdout.write(
+                    f"  {group[:40]:40} {len(values):>8} "
+                    + " ".join(f"{percentile(values, p) * 1000:>8.2f}ms" for p in PERCENTILES)
+                )
@@ -0,0 +1,107 @@
+import time
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from parimitham.metrics import inc, observe
+from parimitham.tracing import end_trace, record_span, span, start_trace, tracing_enabled
+
+
+def _record(request, response, duration: float) -> None:
+    view = _view_name(request)
+    inc("http_requests_total", method=request.method, view=view, status=str(response.status_code))
+    observe("http_request_duration_seconds", duration, view=view)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Count the requests and time them, per view so the label values stay
+    bounded. Runs natively under both WSGI and ASGI.
+    """
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            start = time.perf_counter()
+            response = await get_response(request)
+            _record(request, response, time.perf_counter() - start)
+            return response
+
+    else:
+
+        def middleware(request):
+            start = time.perf_counter()
+            response = get_response(request)
+            _record(request, response, time.perf_counter() - start)
+            return response
+
+    return middleware
+
+
+def _view_name(request) -> str:
+    match = request.resolver_match
+    return (match.url_name or match.view_name) if match else "unmatched"
+
+
+def _record_span(request, response, trace: tuple, start_ns: int) -> None:
+    view = _view_name(request)
+    trace_id, span_id = trace
+    record_span(
+        span(
+            f"{request.method} {view}",
+            trace_id,
+            start_ns,
+            time.time_ns(),
+            span_id=span_id,
+            kind="http",
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+    )
+
+
+@sync_and_async_middleware
+def tracing_middleware(get_response):
+    """
+    Trace a sample of TRACE_SAMPLE_RATE of the requests, and those with a
+    ``traceparent`` header, so the tasks they enqueue carry their trace id.
+    Only runs under the pool manager started with tracing on.
+    """
+    sample_rate = settings.TRACE_SAMPLE_RATE
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if not tracing_enabled():
+                return await get_response(request)
+            trace = start_trace(sample_rate, request.headers.get("traceparent"))
+            if trace is None:
+                return await get_response(request)
+            start_ns = time.time_ns()
+            try:
+                response = await get_response(request)
+            finally:
+                end_trace()
+            _record_span(request, response, trace, start_ns)
+            return response
+
+    else:
+
+        def middleware(request):
+            if not tracing_enabled():
+                return get_response(request)
+            trace = start_trace(sample_rate, request.headers.get("traceparent"))
+            if trace is None:
+                return get_response(request)
+            start_ns = time.time_ns()
+            try:
+                response = get_response(request)
+            finally:
+                end_trace()
+            _record_span(request, response, trace, start_ns)
+            return response
+
+    return middleware
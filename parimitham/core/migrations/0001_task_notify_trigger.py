@@ -0,0 +1,49 @@
+from django.db import migrations
+
+FUNCTION = "parimitham_notify_task"
+
+
+def create_trigger(apps, schema_editor):
+    """Notify the queue name of every task becoming READY, Postgres only"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # Imports psycopg, only needed on Postgres
+    from parimitham.core.pg_worker import TASK_NOTIFY_CHANNEL
+
+    table = schema_editor.quote_name(apps.get_model("django_tasks_db", "DBTaskResult")._meta.db_table)
+    schema_editor.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION {FUNCTION}() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{TASK_NOTIFY_CHANNEL}', NEW.queue_name);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {FUNCTION} ON {table}")
+    # Also fires for the tasks released by a stopping worker
+    schema_editor.execute(
+        f"""
+        CREATE TRIGGER {FUNCTION} AFTER INSERT OR UPDATE OF status ON {table}
+        FOR EACH ROW WHEN (NEW.status = 'READY') EXECUTE FUNCTION {FUNCTION}()
+        """
+    )
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("django_tasks_db", "DBTaskResult")._meta.db_table)
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {FUNCTION} ON {table}")
+    schema_editor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION}()")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_tasks_db", "__latest__"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -0,0 +1,185 @@
+"""
+Postgres worker of the ``django_tasks_db`` backend.
+
+The database task table notifies the ``TASK_NOTIFY_CHANNEL`` channel, with the
+queue name as payload, whenever a row becomes READY (see the migration of this
+app). Rather than polling every second, the worker listens on a connection of
+its own and sleeps until a task of its queues is enqueued, the earliest
+``run_after`` of its deferred tasks is due, or ``idle_interval`` passes in case
+a notification was missed. It then claims up to ``claim_batch`` tasks in a
+single ``SELECT ... FOR UPDATE SKIP LOCKED`` transaction and runs them.
+"""
+
+import logging
+import os
+import select
+import time
+from typing import Optional
+
+import psycopg
+from django.db import DatabaseError, connections
+from django.db.models import Min
+from django.tasks import TaskResultStatus
+from django.utils import timezone
+from django_tasks_db.management.commands.db_worker import Worker
+from django_tasks_db.models import DBTaskResult, get_date_max
+from django_tasks_db.utils import exclusive_transaction
+
+logger = logging.getLogger(__name__)
+
+TASK_NOTIFY_CHANNEL = "django_tasks"
+
+# Backoff bounds in seconds between two attempts to reconnect the LISTEN connection
+MIN_RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+class PostgresWorker(Worker):
+    """A ``db_worker`` woken up by LISTEN/NOTIFY, claiming its tasks in batches"""
+
+    def __init__(self, *, claim_batch: int = 10, idle_interval: float = 30.0, **kwargs):
+        super().__init__(**kwargs)
+        self.claim_batch = claim_batch
+        self.idle_interval = idle_interval
+        self._listen: Optional[psycopg.Connection] = None
+        # Written to by stop() to interrupt the wait for a notification
+        self._wake_read, self._wake_write = os.pipe()
+
+    def stop(self) -> None:
+        """Stop taking tasks, the run loop returns once the batch in flight finished"""
+        self.running = False
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            # The run loop already returned and closed the pipe
+            pass
+
+    def _ready_tasks(self):
+        tasks = DBTaskResult.objects.ready().filter(backend_name=self.backend_name)
+        if not self.process_all_queues:
+            tasks = tasks.filter(queue_name__in=self.queue_names)
+        return tasks
+
+    def _connect(self) -> None:
+        connection = connections[self._ready_tasks().db]
+        connection.ensure_connection()
+        self._listen = psycopg.connect(**connection.get_connection_params(), autocommit=True)
+        self._listen.execute(f"LISTEN {TASK_NOTIFY_CHANNEL}")
+
+    def _close(self) -> None:
+        if self._listen is not None:
+            self._listen.close()
+            self._listen = None
+
+    def run(self) -> None:
+        logger.info(
+            "Starting Postgres worker worker_id=%s queues=%s claim_batch=%d",
+            self.worker_id,
+            ",".join(self.queue_names),
+            self.claim_batch,
+        )
+        try:
+            self._connect()
+            while self.running:
+                ran = self.run_batch()
+                if self.max_tasks is not None and self._run_tasks >= self.max_tasks:
+                    logger.info("Run maximum tasks (%d) - exiting gracefully.", self._run_tasks)
+                    return
+                if self.batch and not ran:
+                    logger.info("No more tasks to run for worker_id=%s - exiting gracefully.", self.worker_id)
+                    return
+                # A full batch may have left more tasks behind
+                if self.running and ran < self.claim_batch:
+                    self.wait()
+        finally:
+            self._close()
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+
+    def claim(self) -> list[DBTaskResult]:
+        """Claim up to ``claim_batch`` ready tasks, skipping those another worker is claiming"""
+        tasks = self._ready_tasks()
+        with exclusive_transaction(tasks.db):
+            db_task_results = list(tasks.select_for_update(skip_locked=True)[: self.claim_batch])
+            for db_task_result in db_task_results:
+                db_task_result.claim(self.worker_id)
+        return db_task_results
+
+    def run_batch(self) -> int:
+        db_task_results = self.claim()
+        for index, db_task_result in enumerate(db_task_results):
+            if not self.running:
+                # Hand the claimed tasks we did not get to back to the other workers
+                self.release(db_task_results[index:])
+                break
+            self.run_task(db_task_result)
+        return len(db_task_results)
+
+    def release(self, db_task_results: list[DBTaskResult]) -> None:
+        """Undo claim(), the worker id it appended included"""
+        for db_task_result in db_task_results:
+            db_task_result.status = TaskResultStatus.READY
+            db_task_result.started_at = None
+            db_task_result.worker_ids = db_task_result.worker_ids[:-1]
+        DBTaskResult.objects.bulk_update(db_task_results, ["status", "started_at", "worker_ids"])
+        logger.info("Released %d claimed task(s)", len(db_task_results))
+
+    def _next_run_after(self) -> Optional[float]:
+        """Seconds until the earliest deferred task of the queues is due"""
+        tasks = DBTaskResult.objects.filter(
+            backend_name=self.backend_name, status=TaskResultStatus.READY, run_after__lt=get_date_max()
+        )
+        if not self.process_all_queues:
+            tasks = tasks.filter(queue_name__in=self.queue_names)
+        run_after = tasks.aggregate(run_after=Min("run_after"))["run_after"]
+        if run_after is None:
+            return None
+        return max(0.0, (run_after - timezone.now()).total_seconds())
+
+    def wait(self) -> None:
+        """Sleep until a task of the queues is enqueued or due, stop() is called or ``idle_interval`` passes"""
+        timeout = self.idle_interval
+        next_run_after = self._next_run_after()
+        if next_run_after is not None:
+            timeout = min(timeout, next_run_after)
+        deadline = time.monotonic() + timeout
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                readable, _, _ = select.select([self._listen.fileno(), self._wake_read], [], [], remaining)
+                if self._wake_read in readable:
+                    os.read(self._wake_read, 1)
+                    return
+                if readable and self._notified():
+                    return
+            except psycopg.OperationalError:
+                logger.exception("Lost the LISTEN connection, reconnecting")
+                self._reconnect()
+                return
+
+    def _reconnect(self) -> None:
+        """Connect again, backing off while the database is down, until connected or stop() is called"""
+        self._close()
+        delay = MIN_RECONNECT_DELAY
+        while self.running:
+            readable, _, _ = select.select([self._wake_read], [], [], delay)
+            if readable:
+                os.read(self._wake_read, 1)
+                return
+            try:
+                self._connect()
+                logger.info("Reconnected the LISTEN connection")
+                return
+            except (psycopg.Error, DatabaseError) as e:
+                self._close()
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                logger.warning("Cannot reconnect the LISTEN connection, trying again in %ss: %s", delay, e)
+
+    def _notified(self) -> bool:
+        """Consume the pending notifications, whether one is for the queues of the worker"""
+        return any(
+            self.process_all_queues or notify.payload in self.queue_names
+            for notify in list(self._listen.notifies(timeout=0))
+        )
@@ -0,0 +1,93 @@
+import pickle
+import threading
+from typing import Any, Optional
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from parimitham.cache_store import CACHE_QUEUE_NAME, CacheStore
+from queue_bridge import get_shareable_queue, request_queue
+
+
+class SharedCache(BaseCache):
+    """
+    Cache backend whose entries live once per process, in the cache store of
+    the pool manager, each call being a round trip over the ``cache_queue``.
+    Outside of the pool manager, e.g. in a management command, the entries
+    live in a store of the interpreter instead, like a LocMemCache.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._max_bytes = int(options.get("MAX_BYTES", 64 * 1024 * 1024))
+        # Seconds to wait for a reply of the cache store
+        self._request_timeout = float(options.get("REQUEST_TIMEOUT", 5.0))
+        self._local: Optional[CacheStore] = None
+        self._local_lock = threading.Lock()
+
+    def _call(self, op: str, *args: Any) -> Any:
+        queue = get_shareable_queue(CACHE_QUEUE_NAME)
+        if queue is not None:
+            return request_queue(queue, op, *args, timeout=self._request_timeout)
+        with self._local_lock:
+            if self._local is None:
+                self._local = CacheStore(None, max_entries=self._max_entries, max_bytes=self._max_bytes)
+            return getattr(self._local, f"on_{op}")(*args)
+
+    def _dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._call("add", key, self._dumps(value), self.get_backend_timeout(timeout))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._call("get", key)
+        return default if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._call("set", key, self._dumps(value), self.get_backend_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._call("touch", key, self.get_backend_timeout(timeout))
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._call("incr", key, delta)
+        if value is None:
+            raise ValueError(f"Key '{key}' not found")
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._call("delete", key)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._call("has_key", key)
+
+    def get_many(self, keys, version=None):
+        # A single round trip for all the keys
+        made_keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        values = self._call("get_many", list(made_keys))
+        return {made_keys[key]: pickle.loads(value) for key, value in values.items()}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = {self.make_and_validate_key(key, version=version): self._dumps(value) for key, value in data.items()}
+        self._call("set_many", items, self.get_backend_timeout(timeout))
+        return []
+
+    def delete_many(self, keys, version=None):
+        self._call("delete_many", [self.make_and_validate_key(key, version=version) for key in keys])
+
+    def clear(self):
+        self._call("clear")
+
+    def stats(self) -> dict:
+        """Entries, bytes, hits, misses, evictions and expirations of the store"""
+        return self._call("stats")
@@ -3,6 +3,8 @@ import time
 
 from django.tasks import task
 
+from parimitham.workloads import cpu_work, io_work, payload_work
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,3 +18,21 @@ def cpu_intensive_work(sleep_time: int) -> None:
     Mock CPU-intensive work.
     """
     time.sleep(sleep_time)
+
+
+# Tasks of the benchmark endpoints, see bench.py
+
+
+@task()
+def cpu_bound_task(n: int) -> int:
+    return cpu_work(n)
+
+
+@task()
+def io_bound_task(ms: float) -> None:
+    io_work(ms)
+
+
+@task()
+def payload_task(payload: bytes) -> int:
+    return payload_work(payload)
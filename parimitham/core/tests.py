@@ -0,0 +1,425 @@
+import os
+import pickle
+import time
+from concurrent.interpreters import QueueFull, create_queue
+from queue import SimpleQueue
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.db import connection, connections
+from django.tasks import TaskResultStatus
+from django.test import SimpleTestCase, TransactionTestCase
+from django_tasks_db.models import DBTaskResult
+
+from parimitham.core.pg_worker import PostgresWorker
+from parimitham.core.tasks import cpu_bound_task
+from parimitham.result_store import FAILED, READY, RECORD_OVERHEAD, RUNNING, SUCCESSFUL, ResultStore, result_update
+from parimitham.routing import (
+    PRIORITY_BANDS,
+    QueueGroup,
+    Subscription,
+    UnknownQueue,
+    bell_name,
+    lane_name,
+    parse_queue_group,
+    weighted_order,
+)
+from parimitham.scheduler import FULL_LANE_DELAY, RELEASE_BATCH, PeriodicTask, TaskScheduler
+
+WORKER_ID = "test-worker"
+
+
+@skipUnless(
+    connection.vendor == "postgresql" and settings.ENABLE_DB_BACKED_TASK,
+    "Needs Postgres and ENABLE_DB_BACKED_TASK",
+)
+class PostgresWorkerTests(TransactionTestCase):
+    """
+    Runs outside of a transaction, the notifications of the trigger are only
+    sent on commit and SKIP LOCKED needs a lock held by another connection.
+    """
+
+    def worker(self, **kwargs) -> PostgresWorker:
+        worker = PostgresWorker(
+            queue_names=["default"],
+            interval=0,
+            batch=False,
+            backend_name="default",
+            startup_delay=False,
+            max_tasks=None,
+            worker_id=WORKER_ID,
+            **kwargs,
+        )
+
+        def close():
+            worker._close()
+            os.close(worker._wake_read)
+            os.close(worker._wake_write)
+
+        self.addCleanup(close)
+        return worker
+
+    def enqueue(self, count: int) -> list[str]:
+        return [cpu_bound_task.enqueue(10).id for _ in range(count)]
+
+    def test_claim_batch(self):
+        self.enqueue(3)
+        claimed = self.worker(claim_batch=2).claim()
+        self.assertEqual(len(claimed), 2)
+        for db_task_result in DBTaskResult.objects.filter(id__in=[task.id for task in claimed]):
+            self.assertEqual(db_task_result.status, TaskResultStatus.RUNNING)
+            self.assertEqual(db_task_result.worker_ids, [WORKER_ID])
+        self.assertEqual(DBTaskResult.objects.filter(status=TaskResultStatus.READY).count(), 1)
+
+    def test_claim_skips_locked(self):
+        locked_id, ready_id = self.enqueue(2)
+        other = connections.create_connection("default")
+        self.addCleanup(other.close)
+        other.set_autocommit(False)
+        with other.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {DBTaskResult._meta.db_table} WHERE id = %s FOR UPDATE", [locked_id])
+        try:
+            claimed = self.worker(claim_batch=10).claim()
+        finally:
+            other.rollback()
+        self.assertEqual([str(task.id) for task in claimed], [str(ready_id)])
+        self.assertEqual(DBTaskResult.objects.get(id=locked_id).status, TaskResultStatus.READY)
+
+    def test_release(self):
+        self.enqueue(2)
+        worker = self.worker(claim_batch=2)
+        worker.release(worker.claim())
+        for db_task_result in DBTaskResult.objects.all():
+            self.assertEqual(db_task_result.status, TaskResultStatus.READY)
+            self.assertIsNone(db_task_result.started_at)
+            self.assertEqual(db_task_result.worker_ids, [])
+
+    def test_notify_wakes_up(self):
+        worker = self.worker(idle_interval=10.0)
+        worker._connect()
+        self.enqueue(1)
+        started = time.monotonic()
+        worker.wait()
+        self.assertLess(time.monotonic() - started, 5.0)
+
+    def test_idle_interval(self):
+        worker = self.worker(idle_interval=0.2)
+        worker._connect()
+        started = time.monotonic()
+        worker.wait()
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_reconnect_stops(self):
+        worker = self.worker()
+        worker.stop()
+        started = time.monotonic()
+        worker._reconnect()
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertIsNone(worker._listen)
+
+
+class ResultStoreTests(SimpleTestCase):
+    """Calls the handlers of the store directly, with a clock of its own for the expiry"""
+
+    def setUp(self):
+        patcher = mock.patch("parimitham.result_store.time")
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.monotonic.return_value = 1000.0
+
+    def advance(self, seconds: float) -> None:
+        self.clock.monotonic.return_value += seconds
+
+    def update(self, store: ResultStore, result_id: str, status: str, **fields) -> None:
+        store.on_update(*result_update(result_id, "parimitham.core.tasks.cpu_bound_task", status, **fields))
+
+    def test_transitions(self):
+        store = ResultStore(None)
+        for status in (READY, RUNNING, READY, RUNNING, FAILED, READY, RUNNING, SUCCESSFUL):
+            self.update(store, "a", status)
+            self.assertEqual(store.on_get("a").status, status)
+
+    def test_first_update_running(self):
+        store = ResultStore(None)
+        self.update(store, "a", RUNNING, worker_id="worker-1")
+        self.assertEqual(store.on_get("a").status, RUNNING)
+        self.assertEqual(store.on_in_flight("worker-1")[0].id, "a")
+
+    def test_invalid_transition_ignored(self):
+        store = ResultStore(None)
+        self.update(store, "a", READY)
+        self.update(store, "a", RUNNING)
+        self.update(store, "a", SUCCESSFUL, return_value=1)
+        with self.assertLogs("parimitham.result_store", "WARNING"):
+            self.update(store, "a", RUNNING)
+        with self.assertLogs("parimitham.result_store", "WARNING"):
+            self.update(store, "a", SUCCESSFUL, return_value=2)
+        record = store.on_get("a")
+        self.assertEqual(record.status, SUCCESSFUL)
+        self.assertEqual(pickle.loads(record.return_value), 1)
+
+    def test_ttl(self):
+        store = ResultStore(None, ttl=10)
+        self.update(store, "a", READY)
+        self.advance(6)
+        # A lookup pushes the expiry forward
+        self.assertIsNotNone(store.on_get("a"))
+        self.advance(6)
+        self.assertIsNotNone(store.on_get("a"))
+        self.advance(11)
+        self.assertIsNone(store.on_get("a"))
+        self.assertEqual(store.evicted, 1)
+        self.assertEqual(store.total_bytes, 0)
+
+    def test_max_entries_evicts_least_recently_used(self):
+        store = ResultStore(None, max_entries=2)
+        self.update(store, "a", READY)
+        self.update(store, "b", READY)
+        store.on_get("a")
+        self.update(store, "c", READY)
+        self.assertEqual(list(store.records), ["a", "c"])
+        self.assertEqual(store.evicted, 1)
+
+    def test_max_bytes(self):
+        store = ResultStore(None, max_bytes=2 * RECORD_OVERHEAD + 4096)
+        self.update(store, "a", READY, args=(b"x" * 2048,))
+        self.update(store, "b", READY, args=(b"x" * 1024,))
+        self.assertEqual(list(store.records), ["a", "b"])
+        self.update(store, "b", RUNNING)
+        self.update(store, "b", SUCCESSFUL, return_value=b"x" * 2048)
+        self.assertEqual(list(store.records), ["b"])
+        self.assertEqual(store.total_bytes, store.records["b"].size)
+
+    def test_watch_until_finished(self):
+        store = ResultStore(None)
+        reply_queue = SimpleQueue()
+        self.update(store, "a", READY)
+        store.on_watch("a", reply_queue, 1)
+        self.update(store, "a", RUNNING)
+        self.assertTrue(reply_queue.empty())
+        self.update(store, "a", SUCCESSFUL, return_value=1)
+        token, record = reply_queue.get_nowait()
+        self.assertEqual((token, record.status), (1, SUCCESSFUL))
+        self.assertEqual(store.watchers, {})
+
+    def test_watch_finished(self):
+        store = ResultStore(None)
+        reply_queue = SimpleQueue()
+        self.update(store, "a", RUNNING)
+        self.update(store, "a", FAILED, error=("ValueError", "Traceback"))
+        store.on_watch("a", reply_queue, 1)
+        token, record = reply_queue.get_nowait()
+        self.assertEqual((token, record.status, record.errors), (1, FAILED, [("ValueError", "Traceback")]))
+        self.assertEqual(store.watchers, {})
+
+    def test_watch_before_registered(self):
+        store = ResultStore(None)
+        reply_queue = SimpleQueue()
+        store.on_watch("a", reply_queue, 1)
+        self.assertEqual(store.on_stats()["watched"], 1)
+        self.update(store, "a", READY)
+        self.update(store, "a", RUNNING)
+        self.update(store, "a", SUCCESSFUL, return_value=None)
+        self.assertEqual(reply_queue.get_nowait()[0], 1)
+
+    def test_unwatch(self):
+        store = ResultStore(None)
+        reply_queue = SimpleQueue()
+        store.on_watch("a", reply_queue, 1)
+        store.on_watch("a", reply_queue, 2)
+        store.on_unwatch("a", 1)
+        self.assertEqual(store.on_stats()["watched"], 1)
+        store.on_unwatch("a", 2)
+        self.assertEqual(store.watchers, {})
+
+    def test_discard_replies_none(self):
+        store = ResultStore(None)
+        reply_queue = SimpleQueue()
+        self.update(store, "a", READY, args=(1,))
+        store.on_watch("a", reply_queue, 1)
+        store.on_discard("a")
+        self.assertEqual(reply_queue.get_nowait(), (1, None))
+        self.assertIsNone(store.on_get("a"))
+        self.assertEqual(store.total_bytes, 0)
+
+
+class QueueGroupTests(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_queue_group("fast:3, default=2"),
+            QueueGroup(name="fast:3, default", weights=(("fast", 3), ("default", 1)), workers=2),
+        )
+
+    def test_parse_defaults(self):
+        group = parse_queue_group("default")
+        self.assertEqual((group.weights, group.workers, group.max_workers), ((("default", 1),), 1, 0))
+        self.assertFalse(group.elastic)
+
+    def test_parse_range(self):
+        group = parse_queue_group("default=2-8")
+        self.assertEqual((group.workers, group.max_workers), (2, 8))
+        self.assertTrue(group.elastic)
+
+    def test_parse_invalid(self):
+        for spec in ("fast,,default=2", "fast:0=2", "fast:-1=2", "fast=0", "fast=0-4", "fast=4-2", "fast:x=2"):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                parse_queue_group(spec)
+
+    def test_parse_invalid_names_spec(self):
+        with self.assertRaisesMessage(ValueError, "'fast=4-2'"):
+            parse_queue_group("fast=4-2")
+
+    def test_weighted_order(self):
+        self.assertEqual(weighted_order([("fast", 3), ("default", 1)]), ["fast", "fast", "default", "fast"])
+        self.assertEqual(weighted_order([("a", 1), ("b", 1)]), ["a", "b"])
+        self.assertEqual(weighted_order([("a", 2), ("b", 1), ("c", 1)]), ["a", "b", "c", "a"])
+
+
+class SubscriptionTests(SimpleTestCase):
+    """Runs against lanes of its own rather than those shared by the pool manager"""
+
+    def setUp(self):
+        self.queues = {bell_name("test"): create_queue()}
+        for queue_name in ("fast", "default"):
+            for band in PRIORITY_BANDS:
+                self.queues[lane_name(queue_name, band)] = create_queue()
+        patcher = mock.patch("parimitham.routing.get_shareable_queue", self.queues.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.subscription = Subscription("test", [("fast", 3), ("default", 1)])
+
+    def put(self, queue_name: str, band: str, *items: str) -> None:
+        for item in items:
+            self.queues[lane_name(queue_name, band)].put(item)
+
+    def take_all(self) -> list:
+        items = []
+        while (item := self.subscription.take()) is not None:
+            items.append(item)
+        return items
+
+    def test_bands_in_priority_order(self):
+        self.put("fast", "low", "fast-low")
+        self.put("default", "normal", "default-normal")
+        self.put("fast", "normal", "fast-normal")
+        self.put("default", "high", "default-high")
+        self.assertEqual(self.take_all(), ["default-high", "fast-normal", "default-normal", "fast-low"])
+
+    def test_weights_within_band(self):
+        self.put("fast", "normal", *(f"fast-{i}" for i in range(4)))
+        self.put("default", "normal", *(f"default-{i}" for i in range(4)))
+        self.assertEqual([self.subscription.take() for _ in range(4)], ["fast-0", "fast-1", "default-0", "fast-2"])
+
+    def test_empty_lanes_skipped(self):
+        self.put("default", "low", "default-0", "default-1")
+        self.assertEqual(self.take_all(), ["default-0", "default-1"])
+        self.assertEqual(self.subscription.depth(), 0)
+
+
+class TaskSchedulerTests(SimpleTestCase):
+    """Calls the handlers of the scheduler directly, with a clock of its own and put_tasks() patched"""
+
+    def setUp(self):
+        for target, name in (("time", "clock"), ("put_tasks", "put_tasks"), ("resolve_task", "resolve_task")):
+            patcher = mock.patch(f"parimitham.scheduler.{target}")
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.clock.time.return_value = 1000.0
+
+    def advance(self, seconds: float) -> None:
+        self.clock.time.return_value += seconds
+
+    def shareable_task(self, result_id: str, queue_name: str = "default", priority: int = 0) -> tuple:
+        return (result_id, "parimitham.core.tasks.cpu_bound_task", (10,), None, queue_name, priority, 0, None)
+
+    def released(self) -> list[list[tuple]]:
+        return [put_call.args[0] for put_call in self.put_tasks.call_args_list]
+
+    def test_release_when_due(self):
+        scheduler = TaskScheduler(None)
+        self.assertIsNone(scheduler.timeout())
+        later, sooner = self.shareable_task("later"), self.shareable_task("sooner")
+        scheduler.on_schedule(1010.0, [later])
+        scheduler.on_schedule(1005.0, [sooner])
+        self.assertEqual(scheduler.timeout(), 5.0)
+
+        self.advance(5)
+        scheduler.on_timeout()
+        self.assertEqual(self.released(), [[sooner]])
+        self.assertEqual(self.put_tasks.call_args.kwargs, {"timeout": 0})
+        self.assertEqual(scheduler.timeout(), 5.0)
+
+        self.advance(5)
+        scheduler.on_timeout()
+        self.assertEqual(self.released(), [[sooner], [later]])
+        self.assertIsNone(scheduler.timeout())
+        self.assertEqual(scheduler.on_stats(), {"scheduled": 0, "released": 2})
+
+    def test_release_by_lane_in_batches(self):
+        scheduler = TaskScheduler(None)
+        tasks = [self.shareable_task(f"task-{i}") for i in range(RELEASE_BATCH * 2 + 1)]
+        fast, high = self.shareable_task("fast", queue_name="fast"), self.shareable_task("high", priority=10)
+        scheduler.on_schedule(1000.0, [*tasks, fast, high])
+        scheduler.on_timeout()
+        self.assertEqual(
+            self.released(),
+            [
+                tasks[:RELEASE_BATCH],
+                tasks[RELEASE_BATCH : RELEASE_BATCH * 2],
+                tasks[RELEASE_BATCH * 2 :],
+                [fast],
+                [high],
+            ],
+        )
+        self.assertEqual(scheduler.released, len(tasks) + 2)
+
+    def test_full_lane_delay(self):
+        scheduler = TaskScheduler(None)
+        tasks = [self.shareable_task(f"task-{i}") for i in range(RELEASE_BATCH + 8)]
+        scheduler.on_schedule(1000.0, tasks)
+        self.put_tasks.side_effect = [None, QueueFull]
+        with self.assertLogs("parimitham.scheduler", "WARNING"):
+            scheduler.on_timeout()
+        self.assertEqual(scheduler.released, RELEASE_BATCH)
+        self.assertEqual(scheduler.timeout(), FULL_LANE_DELAY)
+
+        self.put_tasks.side_effect = None
+        self.put_tasks.reset_mock()
+        self.advance(FULL_LANE_DELAY)
+        scheduler.on_timeout()
+        self.assertEqual(self.released(), [tasks[RELEASE_BATCH:]])
+        self.assertEqual(scheduler.released, len(tasks))
+
+    def test_unknown_queue_dropped(self):
+        scheduler = TaskScheduler(None)
+        scheduler.on_schedule(1000.0, [self.shareable_task("removed", queue_name="removed")])
+        self.put_tasks.side_effect = UnknownQueue
+        with self.assertLogs("parimitham.scheduler", "ERROR"):
+            scheduler.on_timeout()
+        self.assertEqual(scheduler.on_stats(), {"scheduled": 0, "released": 0})
+
+    def test_periodic(self):
+        scheduler = TaskScheduler(None, [PeriodicTask("tick", "parimitham.core.tasks.cpu_bound_task", 60, args=(10,))])
+        self.assertEqual(scheduler.timeout(), 60.0)
+        self.advance(60)
+        scheduler.on_timeout()
+        task = self.resolve_task.return_value
+        task.get_backend.return_value.enqueue_nowait.assert_called_once_with(task, (10,), {})
+        # The next run is due one interval after the last one was
+        self.advance(1)
+        self.assertEqual(scheduler.timeout(), 59.0)
+
+    def test_periodic_skips_missed_runs(self):
+        scheduler = TaskScheduler(None, [PeriodicTask("tick", "parimitham.core.tasks.cpu_bound_task", 60)])
+        self.advance(200)
+        scheduler.on_timeout()
+        self.assertEqual(self.resolve_task.return_value.get_backend.return_value.enqueue_nowait.call_count, 1)
+        self.assertEqual(scheduler.timeout(), 60.0)
+
+    def test_periodic_rescheduled_after_failure(self):
+        scheduler = TaskScheduler(None, [PeriodicTask("tick", "parimitham.core.tasks.cpu_bound_task", 60)])
+        self.resolve_task.side_effect = ImportError
+        self.advance(60)
+        with self.assertLogs("parimitham.scheduler", "ERROR"):
+            scheduler.on_timeout()
+        self.assertEqual(scheduler.timeout(), 60.0)
@@ -1,9 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import delayed_hello, health_check_view, hello
+from .views import (
+    bench_cache,
+    bench_cpu,
+    bench_io,
+    bench_task,
+    delayed_hello,
+    health_check_view,
+    hello,
+    metrics_view,
+    offloaded_hello,
+)
 
 urlpatterns = [
     path("hello/", hello, name="hello"),
     path("dhello/", delayed_hello, name="delayed_hello"),
+    path("ohello/", offloaded_hello, name="offloaded_hello"),
     path("health/", health_check_view, name="health"),
+    path("metrics", metrics_view, name="metrics"),
 ]
+
+if settings.BENCHMARK_ENDPOINTS:
+    urlpatterns += [
+        path("bench/cpu/", bench_cpu, name="bench_cpu"),
+        path("bench/io/", bench_io, name="bench_io"),
+        path("bench/task/<str:kind>/", bench_task, name="bench_task"),
+        path("bench/cache/<str:alias>/", bench_cache, name="bench_cache"),
+    ]
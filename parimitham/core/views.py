@@ -1,28 +1,160 @@
+import asyncio
+import math
 import random
+import time
+from datetime import timedelta
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.tasks import TaskResultStatus, task_backends
+from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 
-from .tasks import cpu_intensive_work, cpu_intensive_work_task
+from parimitham.metrics import inc, observe, render_metrics
+from parimitham.readiness import health_status
+from parimitham.workloads import cpu_work, io_work, make_payload
+
+from .interpreter_queue_backend import TaskQueueFull
+from .tasks import cpu_bound_task, cpu_intensive_work, cpu_intensive_work_task, io_bound_task, payload_task
+
+# Upper bound in seconds of the ?delay= of delayed_hello
+MAX_DELAY = 24 * 60 * 60
 
 
 @require_http_methods(["GET"])
-def hello(request):
+async def hello(request):
     sleep_time = random.randrange(6, 9)
-    cpu_intensive_work(sleep_time)
+    # Off the event loop, like the thread a WSGI request runs in
+    await asyncio.to_thread(cpu_intensive_work, sleep_time)
     return JsonResponse({"message": "Hello World from Django App"})
 
 
 @require_http_methods(["GET"])
-def delayed_hello(request):
+async def delayed_hello(request):
     sleep_time = random.randrange(6, 9)
+    task = cpu_intensive_work_task
+    if delay := request.GET.get("delay"):
+        try:
+            seconds = float(delay)
+        except ValueError:
+            seconds = math.nan
+        if not (math.isfinite(seconds) and 0 <= seconds <= MAX_DELAY):
+            return HttpResponseBadRequest(f"delay must be a number of seconds from 0 to {MAX_DELAY}")
+        # Deferred: held by the scheduler of the pool manager until run_after
+        task = task.using(run_after=timezone.now() + timedelta(seconds=seconds))
 
-    cpu_intensive_work_task.enqueue(sleep_time)
+    try:
+        await task.aenqueue(sleep_time)
+    except TaskQueueFull:
+        return _queue_full()
     return JsonResponse({"message": "Hello World from Django App"})
 
 
 @require_http_methods(["GET"])
-def health_check_view(request):
-    """Health check endpoint"""
-    if request.method == "GET":
-        return JsonResponse({"status": "ok"})
+async def offloaded_hello(request):
+    """
+    The work of hello run by a task worker, out of the GIL of this web worker,
+    answering once the task finished or TASK_AWAIT_TIMEOUT seconds passed
+    """
+    sleep_time = random.randrange(6, 9)
+    try:
+        result = await cpu_intensive_work_task.aenqueue(sleep_time)
+    except TaskQueueFull:
+        return _queue_full()
+
+    backend = task_backends[result.backend]
+    if not hasattr(backend, "await_result"):
+        # Spilled to or enqueued on the database backend, only the interpreter queues reply
+        return JsonResponse({"id": result.id, "status": result.status}, status=202)
+    try:
+        result = await backend.await_result(result.id, timeout=settings.TASK_AWAIT_TIMEOUT)
+    except TimeoutError:
+        return JsonResponse({"id": result.id, "message": "The task is still running"}, status=504)
+    if result.status == TaskResultStatus.FAILED:
+        error = result.errors[-1].exception_class_path if result.errors else None
+        return JsonResponse({"id": result.id, "error": error}, status=500)
+    return JsonResponse({"message": "Hello World from Django App", "id": result.id})
+
+
+def _queue_full() -> JsonResponse:
+    response = JsonResponse({"message": "Too many tasks queued, try again later"}, status=503)
+    response["Retry-After"] = "5"
+    return response
+
+
+@require_http_methods(["GET"])
+async def bench_cpu(request):
+    """CPU-bound pure Python request, see bench.py"""
+    primes = await asyncio.to_thread(cpu_work, int(request.GET.get("n", 20_000)))
+    return JsonResponse({"primes": primes})
+
+
+@require_http_methods(["GET"])
+async def bench_io(request):
+    """I/O-bound request blocking a thread, see bench.py"""
+    await asyncio.to_thread(io_work, float(request.GET.get("ms", 50)))
+    return JsonResponse({"message": "ok"})
+
+
+def _read_through(alias: str, key: str, n: int) -> tuple[bool, int]:
+    cache = caches[alias]
+    start = time.perf_counter()
+    primes = cache.get(key)
+    observe("cache_operation_duration_seconds", time.perf_counter() - start, cache=alias, op="get")
+    if primes is not None:
+        return True, primes
+    primes = cpu_work(n)
+    start = time.perf_counter()
+    cache.set(key, primes)
+    observe("cache_operation_duration_seconds", time.perf_counter() - start, cache=alias, op="set")
+    return False, primes
+
+
+@require_http_methods(["GET"])
+async def bench_cache(request, alias: str):
+    """Read-through of the CPU-bound work on the shared or the per-interpreter cache, see bench.py"""
+    if alias not in settings.CACHES:
+        return JsonResponse({"message": f"Unknown cache {alias}"}, status=404)
+    key = f"bench:{random.randrange(int(request.GET.get('keys', 1000)))}"
+    # A round trip to the cache store blocks, like a database query would
+    hit, primes = await asyncio.to_thread(_read_through, alias, key, int(request.GET.get("n", 20_000)))
+    inc("cache_lookups_total", cache=alias, result="hit" if hit else "miss")
+    return JsonResponse({"hit": hit, "primes": primes})
+
+
+@require_http_methods(["GET"])
+async def bench_task(request, kind: str):
+    """Enqueue a cpu, io or payload benchmark task, see bench.py"""
+    if kind == "cpu":
+        task, args = cpu_bound_task, (int(request.GET.get("n", 20_000)),)
+    elif kind == "io":
+        task, args = io_bound_task, (float(request.GET.get("ms", 50)),)
+    elif kind == "payload":
+        task, args = payload_task, (make_payload(int(request.GET.get("size", 256 * 1024))),)
+    else:
+        return JsonResponse({"message": f"Unknown task kind {kind}"}, status=404)
+
+    try:
+        result = await task.aenqueue(*args)
+    except TaskQueueFull:
+        return _queue_full()
+    return JsonResponse({"id": result.id})
+
+
+@require_http_methods(["GET"])
+async def health_check_view(request):
+    """
+    Health check endpoint, unhealthy until every worker of the pool is warm.
+    Under ASGI, the admission control answers it before Django, see admission.py.
+    """
+    status, body = health_status()
+    return JsonResponse(body, status=status)
+
+
+@require_http_methods(["GET"])
+async def metrics_view(request):
+    """Metrics of every interpreter in the Prometheus text format"""
+    # Waits on a round trip to the main interpreter
+    text = await asyncio.to_thread(render_metrics)
+    return HttpResponse(text, content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,236 @@
+"""
+Write-behind persistence of the interpreter queue tasks.
+
+The writer runs in the main interpreter next to the result store and gets a
+snapshot of every task record after each status transition. Snapshots are
+coalesced per task and upserted into the ``django_tasks_db`` table in
+batches, off the request and task paths. On startup, tasks the previous run
+left READY or RUNNING are replayed on the interpreter queues.
+"""
+
+import logging
+import pickle
+import queue
+import threading
+import time
+from typing import Optional
+
+from django.tasks import TaskResultStatus
+from django.utils import timezone
+from django.utils.json import normalize_json
+from django_tasks_db.models import DBTaskResult, get_date_max
+
+from parimitham.payloads import PayloadLost, has_lost_payload, persistable
+from parimitham.result_store import READY, ResultRecord, report_results, result_update
+from parimitham.routing import has_lanes, put_tasks
+from parimitham.scheduler import schedule_tasks
+from parimitham.task_registry import task_ref
+
+logger = logging.getLogger(__name__)
+
+UPDATE_FIELDS = [
+    "status",
+    "started_at",
+    "finished_at",
+    "worker_ids",
+    "return_value",
+    "exception_class_path",
+    "traceback",
+]
+
+
+def _json_or_none(value: bytes):
+    if not value:
+        return None
+    try:
+        return normalize_json(pickle.loads(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_db_task_result(record: ResultRecord, backend_name: str) -> DBTaskResult:
+    args, kwargs = pickle.loads(record.payload) if record.payload else ((), {})
+    args = [persistable(value) for value in args]
+    kwargs = {name: persistable(value) for name, value in kwargs.items()}
+    exception_class_path, traceback = record.errors[-1] if record.errors else ("", "")
+    return DBTaskResult(
+        id=record.id,
+        status=record.status,
+        enqueued_at=record.enqueued_at,
+        started_at=record.started_at,
+        finished_at=record.finished_at,
+        args_kwargs=normalize_json({"args": args, "kwargs": kwargs}),
+        priority=record.priority,
+        task_path=record.module_path,
+        worker_ids=record.worker_ids,
+        queue_name=record.queue_name,
+        backend_name=backend_name,
+        # bulk_create skips the pre_save signal setting this default
+        run_after=record.run_after or get_date_max(),
+        return_value=_json_or_none(record.return_value),
+        exception_class_path=exception_class_path,
+        traceback=traceback,
+    )
+
+
+class WriteBehindWriter:
+    """
+    Persists the result store records in batches of up to ``batch_size``
+    tasks, flushed at least every ``interval`` seconds while there are changes.
+    """
+
+    def __init__(self, backend_name: str, batch_size: int = 500, interval: float = 0.5):
+        self.backend_name = backend_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.written = 0
+        self.failed = 0
+        self._changes: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    def record_changed(self, record: ResultRecord) -> None:
+        self._changes.put(record)
+
+    def record_discarded(self, result_id: str) -> None:
+        self._changes.put(result_id)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush the pending changes and stop"""
+        self._changes.put(None)
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            change = self._changes.get()
+            records: dict[str, ResultRecord] = {}
+            discarded: set[str] = set()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if change is None:
+                    stopping = True
+                    break
+                if isinstance(change, ResultRecord):
+                    # Only the latest state of a task is written
+                    records[change.id] = change
+                    discarded.discard(change.id)
+                else:
+                    records.pop(change, None)
+                    discarded.add(change)
+                if len(records) >= self.batch_size:
+                    break
+                try:
+                    change = self._changes.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self.write(list(records.values()), discarded)
+
+    def _to_db_task_results(self, records: list[ResultRecord]) -> list[DBTaskResult]:
+        """The records as rows, leaving out those which cannot be, e.g. with arguments JSON cannot encode"""
+        db_task_results = []
+        for record in records:
+            try:
+                db_task_results.append(to_db_task_result(record, self.backend_name))
+            except Exception:
+                self.failed += 1
+                logger.exception("Cannot persist task %s (%s)", record.id, record.module_path)
+        return db_task_results
+
+    def write(self, records: list[ResultRecord], discarded: set[str]) -> None:
+        db_task_results = self._to_db_task_results(records)
+        try:
+            if db_task_results:
+                DBTaskResult.objects.bulk_create(
+                    db_task_results,
+                    update_conflicts=True,
+                    unique_fields=["id"],
+                    update_fields=UPDATE_FIELDS,
+                )
+            if discarded:
+                DBTaskResult.objects.filter(id__in=discarded).delete()
+            self.written += len(db_task_results)
+            logger.debug("Persisted %d task record(s)", len(db_task_results))
+        except Exception:
+            self.failed += len(db_task_results)
+            logger.exception("Failed to persist %d task record(s)", len(db_task_results))
+
+
+def replay_unfinished_tasks(backend_name: str, batch_size: int = 500) -> int:
+    """
+    Put the tasks a previous run left READY or RUNNING back on the interpreter
+    queues. A task that was RUNNING when the process died runs again, and a
+    deferred task still waiting for its ``run_after`` goes back to the scheduler.
+    """
+    replayed = deferred = 0
+    now = timezone.now()
+    unfinished = DBTaskResult.objects.filter(
+        backend_name=backend_name, status__in=[TaskResultStatus.READY, TaskResultStatus.RUNNING]
+    ).order_by("enqueued_at")
+
+    shareable_tasks, deferred_tasks, updates, lost = [], [], [], []
+    # queue name -> tasks left in the database, their queue having no lanes in this run
+    unserved: dict[str, int] = {}
+
+    def flush():
+        report_results(updates)
+        put_tasks(shareable_tasks)
+        for shareable_task, run_after in deferred_tasks:
+            schedule_tasks([shareable_task], run_after.timestamp())
+        return len(shareable_tasks), len(deferred_tasks)
+
+    for db_result in unfinished.iterator(chunk_size=batch_size):
+        args, kwargs = tuple(db_result.args_kwargs["args"]), db_result.args_kwargs["kwargs"]
+        result_id = str(db_result.id)
+        if has_lost_payload(args, kwargs):
+            lost.append(db_result.id)
+            continue
+        if not has_lanes(db_result.queue_name):
+            unserved[db_result.queue_name] = unserved.get(db_result.queue_name, 0) + 1
+            continue
+        ref = task_ref(db_result.task_path)
+        shareable_task = (result_id, ref, args, kwargs or None, db_result.queue_name, db_result.priority, 0, None)
+        run_after = db_result.run_after if db_result.run_after != get_date_max() else None
+        if run_after and run_after > now:
+            deferred_tasks.append((shareable_task, run_after))
+        else:
+            shareable_tasks.append(shareable_task)
+        updates.append(
+            result_update(
+                result_id,
+                db_result.task_path,
+                READY,
+                args=args,
+                kwargs=kwargs,
+                enqueued_at=db_result.enqueued_at,
+                queue_name=db_result.queue_name,
+                priority=db_result.priority,
+                run_after=run_after,
+            )
+        )
+        if len(updates) >= batch_size:
+            put, scheduled = flush()
+            replayed, deferred = replayed + put, deferred + scheduled
+            shareable_tasks, deferred_tasks, updates = [], [], []
+
+    if updates:
+        put, scheduled = flush()
+        replayed, deferred = replayed + put, deferred + scheduled
+
+    if lost:
+        logger.error("Cannot replay %d task(s) whose payload was in the payload arena", len(lost))
+        DBTaskResult.objects.filter(id__in=lost).update(
+            status=TaskResultStatus.FAILED,
+            finished_at=timezone.now(),
+            exception_class_path=f"{PayloadLost.__module__}.{PayloadLost.__qualname__}",
+            traceback="The payload arena of the previous run is gone",
+        )
+    for queue_name, count in unserved.items():
+        logger.error("Cannot replay %d task(s) of the queue %s, it is not served, see TASK_QUEUES", count, queue_name)
+    if replayed or deferred:
+        logger.info("Replayed %d unfinished task(s), %d of them deferred", replayed + deferred, deferred)
+    return replayed + deferred
@@ -0,0 +1,206 @@
+"""
+Dead-letter queue of the interpreter queue tasks.
+
+Tasks that exhausted their retries are appended, as JSON lines, to the
+``DEAD_LETTER_FILE`` by a service living in the main interpreter, the only
+writer of the file. The ``dead_letters`` management command lists them and
+requests replays or purges by appending to an inbox file next to it, which
+the service picks up while running, or on the next start.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from django.utils import timezone
+from django.utils.json import normalize_json
+
+from parimitham.payloads import has_lost_payload, persistable
+from parimitham.result_store import READY, report_results, result_update
+from parimitham.routing import has_lanes, put_tasks_with_room
+from parimitham.scheduler import FULL_LANE_DELAY, schedule_tasks
+from parimitham.task_registry import task_ref
+from queue_bridge import QueueService, get_shareable_queue, notify
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_QUEUE_NAME = "dead_letter_queue"
+
+# Seconds between two checks of the inbox
+INBOX_INTERVAL = 2.0
+
+
+def inbox_path(path: Path) -> Path:
+    return path.with_name(path.name + ".inbox")
+
+
+def read_dead_letters(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    with path.open() as dead_letters:
+        return [json.loads(line) for line in dead_letters if line.strip()]
+
+
+def request_action(path: Path, action: str, ids: Iterable[str]) -> None:
+    """Ask the dead-letter service to ``replay`` or ``purge`` dead letters"""
+    with inbox_path(path).open("a") as inbox:
+        for result_id in ids:
+            inbox.write(f"{action} {result_id}\n")
+
+
+class DeadLetterQueue(QueueService):
+    name = "dead-letters"
+
+    def __init__(self, queue, path: Path):
+        super().__init__(queue)
+        self.path = Path(path)
+        self.added = 0
+        self._next_check = 0.0
+
+    def on_add(self, entry: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as dead_letters:
+            dead_letters.write(json.dumps(entry) + "\n")
+        self.added += 1
+        logger.error("Task %s (%s) moved to the dead-letter queue", entry["id"], entry["task_path"])
+
+    def timeout(self) -> Optional[float]:
+        return self._next_check - time.monotonic()
+
+    def on_timeout(self) -> None:
+        self._next_check = time.monotonic() + INBOX_INTERVAL
+        inbox = inbox_path(self.path)
+        processing = inbox.with_name(inbox.name + ".processing")
+        # Left over by a crash while it was applied, so it goes before the requests made since
+        if processing.exists():
+            self._apply(processing)
+        if inbox.exists():
+            os.replace(inbox, processing)
+            self._apply(processing)
+
+    def _apply(self, processing: Path) -> None:
+        try:
+            actions = {}
+            for line in processing.read_text().splitlines():
+                action, _, result_id = line.partition(" ")
+                actions[result_id] = action
+            self.process(actions)
+        except Exception:
+            # Moved aside rather than failing again on every check
+            failed = processing.with_name(f"{processing.name}.failed-{int(time.time())}")
+            os.replace(processing, failed)
+            logger.exception("Failed to apply the dead-letter requests, moved them to %s", failed)
+            return
+        processing.unlink()
+
+    def process(self, actions: dict[str, str]) -> None:
+        kept, replayed, purged = [], [], 0
+        for entry in read_dead_letters(self.path):
+            action = actions.get(entry["id"], actions.get("*"))
+            if action == "replay" and entry.get("unencodable"):
+                logger.error("Cannot replay task %s, some of its arguments were only kept as repr()", entry["id"])
+                kept.append(entry)
+            elif action == "replay" and has_lost_payload(entry["args"], entry["kwargs"]):
+                logger.error("Cannot replay task %s, its payload was in the payload arena", entry["id"])
+                kept.append(entry)
+            elif action == "replay" and not has_lanes(entry["queue_name"]):
+                logger.error("Cannot replay task %s, its queue %s is not served", entry["id"], entry["queue_name"])
+                kept.append(entry)
+            elif action == "replay":
+                replayed.append(entry)
+            elif action == "purge":
+                purged += 1
+            else:
+                kept.append(entry)
+
+        if replayed:
+            # Reported before they can be picked up, those of the full lanes are put by the scheduler later on
+            report_results(
+                [
+                    result_update(
+                        entry["id"],
+                        entry["task_path"],
+                        READY,
+                        args=tuple(entry["args"]),
+                        kwargs=entry["kwargs"],
+                        enqueued_at=timezone.now(),
+                        queue_name=entry["queue_name"],
+                        priority=entry["priority"],
+                    )
+                    for entry in replayed
+                ]
+            )
+            full = put_tasks_with_room(
+                [
+                    (
+                        entry["id"],
+                        task_ref(entry["task_path"]),
+                        tuple(entry["args"]),
+                        entry["kwargs"] or None,
+                        entry["queue_name"],
+                        entry["priority"],
+                        0,
+                        None,
+                    )
+                    for entry in replayed
+                ],
+                # Never waits for room on the service thread
+                timeout=0,
+            )
+            if full:
+                logger.warning("Lanes full, delaying %d replayed task(s) by %ss", len(full), FULL_LANE_DELAY)
+                schedule_tasks(full, time.time() + FULL_LANE_DELAY)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text("".join(json.dumps(entry) + "\n" for entry in kept))
+        os.replace(tmp, self.path)
+        logger.info(
+            "Dead-letter queue: replayed %d, purged %d, %d left",
+            len(replayed),
+            purged,
+            len(kept),
+        )
+
+    def on_stats(self) -> dict:
+        return {"added": self.added}
+
+
+def dead_letter(
+    shareable_task: tuple, module_path: str, attempts: int, exception_class_path: str, traceback: str
+) -> None:
+    """Move a task that exhausted its retries to the dead-letter queue"""
+    if get_shareable_queue(DEAD_LETTER_QUEUE_NAME) is None:
+        return
+    result_id, _, args, kwargs, queue_name, priority = shareable_task[:6]
+    # Called from the failure handling of the task worker, which must carry on either way
+    try:
+        unencodable = []
+        entry = {
+            "id": result_id,
+            "task_path": module_path,
+            "args": [_json_value(value, unencodable) for value in args],
+            "kwargs": {name: _json_value(value, unencodable) for name, value in (kwargs or {}).items()},
+            "queue_name": queue_name,
+            "priority": priority,
+            "attempts": attempts,
+            "exception_class_path": exception_class_path,
+            "traceback": traceback,
+            "failed_at": timezone.now().isoformat(),
+        }
+        if unencodable:
+            entry["unencodable"] = True
+        notify(DEAD_LETTER_QUEUE_NAME, "add", entry)
+    except Exception:
+        logger.exception("Failed to move task %s to the dead-letter queue", result_id)
+
+
+def _json_value(value, unencodable: list) -> object:
+    """The value as JSON, or its repr() when JSON cannot encode it, e.g. bytes or a datetime"""
+    try:
+        return normalize_json(persistable(value))
+    except (TypeError, ValueError):
+        unencodable.append(value)
+        return repr(value)
@@ -0,0 +1,69 @@
+"""
+Background threads started on demand, living only while there is work for them.
+
+The buffers of an interpreter, e.g. its metrics, spans or batched enqueues, are
+pushed by a thread of their own. Rather than running for the whole life of the
+interpreter, that thread is started by the first piece of work and returns as
+soon as it finds nothing left to do, so an idle interpreter carries no extra
+thread and nothing has to stop one before the interpreter is closed.
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LazyThread(Generic[T]):
+    """
+    A thread looping over ``wait()``, then ``take()`` with what it returned,
+    under ``lock``, then ``handle()`` with the work taken. It returns once
+    ``take()`` returns None, which must only happen while nothing is left for
+    it, since start() only starts a new thread when none is running. The owner
+    calls start() with ``lock`` held whenever it adds work.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        lock: threading.Lock,
+        wait: Callable[[], Any],
+        take: Callable[[Any], Optional[T]],
+        handle: Callable[[T], None],
+    ):
+        self.name = name
+        self._lock = lock
+        self._wait = wait
+        self._take = take
+        self._handle = handle
+        self.running = False
+
+    def start(self) -> None:
+        """Start the thread unless it is running, with the lock held"""
+        if not self.running:
+            self.running = True
+            threading.Thread(target=self._run, name=self.name).start()
+
+    def _run(self) -> None:
+        done = False
+        try:
+            while True:
+                waited = self._wait()
+                with self._lock:
+                    work = self._take(waited)
+                    if work is None:
+                        self.running = False
+                        done = True
+                        return
+                try:
+                    self._handle(work)
+                except Exception:
+                    logger.exception("%s failed to handle its work", self.name)
+        finally:
+            # Should wait() or take() raise, the next start() starts a new thread
+            if not done:
+                with self._lock:
+                    self.running = False
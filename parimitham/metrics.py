@@ -0,0 +1,243 @@
+"""
+Metrics aggregated across the interpreters.
+
+Every interpreter records counters and histograms in its own registry, which
+only takes a lock and a dict update per observation. The deltas are pushed to
+the aggregator in the main interpreter over the ``metrics_queue`` about once
+a second, and the aggregator renders the totals in the Prometheus text format.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional, Tuple
+
+from parimitham.lazy_thread import LazyThread
+from queue_bridge import QueueService, get_shareable_queue, notify, request
+
+logger = logging.getLogger(__name__)
+
+METRICS_QUEUE_NAME = "metrics_queue"
+
+# Seconds between two pushes of an interpreter's deltas
+FLUSH_INTERVAL = 1.0
+
+# Upper bounds in seconds of the histogram buckets, +Inf is implied
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help)
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests served by the web workers"),
+    "http_request_duration_seconds": ("histogram", "Time spent serving HTTP requests"),
+    "http_requests_rejected_total": ("counter", "HTTP requests rejected over the concurrency limit of their path"),
+    "tasks_enqueued_total": ("counter", "Tasks put on the interpreter queues"),
+    "tasks_rejected_total": ("counter", "Tasks rejected because their queue was full"),
+    "tasks_deferred_total": ("counter", "Tasks enqueued with a run_after in the future"),
+    "tasks_spilled_total": ("counter", "Tasks spilled to the database because their queue was full"),
+    "task_enqueue_duration_seconds": ("histogram", "Time spent enqueueing a task"),
+    "tasks_finished_total": ("counter", "Tasks run by the task workers"),
+    "tasks_retried_total": ("counter", "Failed tasks scheduled for another attempt"),
+    "task_duration_seconds": ("histogram", "Time spent running a task"),
+    "task_queue_wait_seconds": ("histogram", "Time tasks waited on their queue before starting"),
+    "cache_lookups_total": ("counter", "Cache lookups of the benchmark endpoint, by cache and hit or miss"),
+    "cache_operation_duration_seconds": ("histogram", "Time spent in a cache get or set of the benchmark endpoint"),
+    "interpreter_startup_seconds": ("gauge", "Time spent in each startup phase of an interpreter"),
+    "worker_stop_seconds": ("histogram", "Time from a stop, drain or reload message to the worker exiting"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, Labels]
+
+
+class MetricsRegistry:
+    """The metrics recorded in one interpreter since they were last pushed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[MetricKey, float] = {}
+        # Non-cumulative bucket counts, the last one being +Inf, followed by the sum
+        self.histograms: dict[MetricKey, list[float]] = {}
+        self._flusher = LazyThread(
+            "metrics-flusher", self._lock, lambda: time.sleep(FLUSH_INTERVAL), self._take, self._push
+        )
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self._flusher.start()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            histogram[bisect_left(BUCKETS, value)] += 1
+            histogram[-1] += value
+            self._flusher.start()
+
+    def _swap(self) -> Tuple[dict, dict]:
+        counters, histograms = self.counters, self.histograms
+        self.counters, self.histograms = {}, {}
+        return counters, histograms
+
+    def _take(self, _) -> Optional[Tuple[dict, dict]]:
+        return self._swap() if self.counters or self.histograms else None
+
+    def drain(self) -> Tuple[dict, dict]:
+        with self._lock:
+            return self._swap()
+
+    def _push(self, deltas: Tuple[dict, dict]) -> None:
+        counters, histograms = deltas
+        # Not running under the pool manager, e.g. a management command, the deltas are dropped
+        if (counters or histograms) and get_shareable_queue(METRICS_QUEUE_NAME) is not None:
+            notify(METRICS_QUEUE_NAME, "push", counters, histograms)
+
+    def flush(self) -> None:
+        """Push the deltas to the aggregator"""
+        self._push(self.drain())
+
+
+_registry = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    """Increment a counter of this interpreter"""
+    _registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """Record a value in a histogram of this interpreter"""
+    _registry.observe(name, value, **labels)
+
+
+def render_metrics(timeout: Optional[float] = 2.0) -> str:
+    """Push the metrics of this interpreter and render the totals of all of them"""
+    _registry.flush()
+    return request(METRICS_QUEUE_NAME, "render", timeout=timeout)
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class StartupTimer:
+    """
+    Measures the startup phases of an interpreter. ``started_at`` is the
+    ``time.monotonic()`` of the pool manager when it submitted the worker,
+    which is comparable since all the interpreters share the process clock.
+    """
+
+    def __init__(self, name: str, started_at: Optional[float] = None):
+        self.name = name
+        self.phases: dict[str, float] = {}
+        self._last = started_at if started_at is not None else time.monotonic()
+
+    def mark(self, phase: str) -> None:
+        """End the current phase"""
+        now = time.monotonic()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def report(self) -> None:
+        if get_shareable_queue(METRICS_QUEUE_NAME) is not None:
+            notify(METRICS_QUEUE_NAME, "startup", self.name, self.phases)
+
+
+# A collector returns (name, type, help, labels, value) samples read in the main interpreter
+Collector = Callable[[], Iterable[Tuple[str, str, str, dict, float]]]
+
+
+class MetricsAggregator(QueueService):
+    """
+    Totals of the metrics pushed by every interpreter, plus the gauges read by
+    the ``collectors`` in the main interpreter when the metrics are rendered.
+    """
+
+    name = "metrics-aggregator"
+
+    def __init__(
+        self,
+        queue,
+        collectors: Iterable[Collector] = (),
+        startup_listener: Optional[Callable[[str, dict[str, float]], None]] = None,
+    ):
+        super().__init__(queue)
+        self.collectors = list(collectors)
+        self.startup_listener = startup_listener
+        self.counters: dict[MetricKey, float] = {}
+        self.histograms: dict[MetricKey, list[float]] = {}
+        # interpreter -> seconds spent in each startup phase
+        self.startup: dict[str, dict[str, float]] = {}
+
+    def on_push(self, counters: dict, histograms: dict) -> None:
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, delta in histograms.items():
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                self.histograms[key] = list(delta)
+            else:
+                for index, value in enumerate(delta):
+                    histogram[index] += value
+
+    def on_startup(self, name: str, phases: dict[str, float]) -> None:
+        self.startup[name] = phases
+        breakdown = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items())
+        logger.info("%s started in %.2fs (%s)", name, sum(phases.values()), breakdown)
+        if self.startup_listener:
+            self.startup_listener(name, phases)
+
+    def on_render(self) -> str:
+        # The main interpreter records metrics too, e.g. the result store
+        self.on_push(*_registry.drain())
+
+        families: dict[str, list[str]] = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), histogram[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_format_labels(labels, le)} {_format_value(cumulative)}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+
+        for interpreter, phases in sorted(self.startup.items()):
+            for phase, seconds in phases.items():
+                labels = (("interpreter", interpreter), ("phase", phase))
+                families.setdefault("interpreter_startup_seconds", []).append(
+                    f"interpreter_startup_seconds{_format_labels(labels)} {_format_value(seconds)}"
+                )
+
+        output = []
+        for name, lines in families.items():
+            kind, help_text = METRICS.get(name, ("untyped", ""))
+            output += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *lines]
+
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                logger.exception("Metrics collector %s failed", collector)
+                continue
+            seen = set()
+            for name, kind, help_text, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    output += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                output.append(f"{name}{_format_labels(tuple(labels.items()))} {_format_value(value)}")
+
+        return "\n".join(output) + "\n"
@@ -0,0 +1,172 @@
+"""
+Shared memory arena for large task payloads.
+
+The pool manager creates one shared memory block split into fixed size slots,
+and puts the index of every slot on the ``payload_slots`` queue, which is the
+free list. When enqueueing, large ``bytes``/``bytearray``/``memoryview``
+arguments are copied into a free slot and replaced by a ``PayloadRef``, so only
+the slot index and length travel through the task queue and the result store.
+The task worker hands the task a memoryview of the slot, without copying, and
+puts the slot back on the free list as soon as the task completes. The
+memoryview is only valid while the task runs.
+"""
+
+import logging
+import os
+from concurrent.interpreters import Queue, QueueEmpty, create_queue
+from functools import cache
+from typing import Any, Iterable, NamedTuple, Optional
+
+from queue_bridge import get_shareable_queue
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_QUEUE_NAME = "payload_slots"
+
+# Set by the pool manager for the interpreters to attach to the arena
+ARENA_NAME_ENV = "TASK_PAYLOAD_ARENA"
+SLOT_SIZE_ENV = "TASK_PAYLOAD_SLOT_SIZE"
+
+
+class PayloadRef(NamedTuple):
+    """A task argument stored in a slot of the payload arena"""
+
+    slot: int
+    length: int
+
+
+# Stands for an argument that was stored in the arena when the task is persisted, the
+# arena does not outlive the process so only the size of the payload is kept
+ARENA_MARKER = "__payload_arena__"
+
+
+class PayloadLost(Exception):
+    """The payload of a task lived in the arena of a previous run"""
+
+
+class PayloadArena:
+    def __init__(self, shm, slot_size: int, free_slots: Queue):
+        self.shm = shm
+        self.slot_size = slot_size
+        self.free_slots = free_slots
+
+    @classmethod
+    def create(cls, slots: int, slot_size: int) -> "PayloadArena":
+        """Create the arena, in the main interpreter"""
+        from multiprocessing.shared_memory import SharedMemory
+
+        arena = cls(SharedMemory(create=True, size=slots * slot_size, track=False), slot_size, create_queue())
+        for slot in range(slots):
+            arena.free_slots.put(slot)
+        return arena
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def store(self, data: bytes | bytearray | memoryview) -> Optional[PayloadRef]:
+        """Copy the data into a free slot, None when it does not fit or every slot is taken"""
+        length = memoryview(data).nbytes
+        if length > self.slot_size:
+            return None
+        try:
+            slot = self.free_slots.get_nowait()
+        except QueueEmpty:
+            return None
+        view = memoryview(data)
+        if not view.c_contiguous:
+            # e.g. a strided slice, which cast() cannot flatten
+            view = memoryview(view.tobytes())
+        offset = slot * self.slot_size
+        self.shm.buf[offset : offset + length] = view.cast("B")
+        return PayloadRef(slot, length)
+
+    def view(self, ref: PayloadRef) -> memoryview:
+        offset = ref.slot * self.slot_size
+        return self.shm.buf[offset : offset + ref.length]
+
+    def free(self, refs: list[PayloadRef]) -> None:
+        for ref in refs:
+            self.free_slots.put(ref.slot)
+
+    def close(self, unlink: bool = False) -> None:
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+@cache
+def get_arena() -> Optional[PayloadArena]:
+    """Attach to the arena created by the pool manager, None when the payload mode is off"""
+    name = os.environ.get(ARENA_NAME_ENV)
+    free_slots = get_shareable_queue(PAYLOAD_QUEUE_NAME)
+    if not name or free_slots is None:
+        return None
+    try:
+        from multiprocessing.shared_memory import SharedMemory
+
+        shm = SharedMemory(name=name, track=False)
+    except (ImportError, OSError):
+        logger.exception("Cannot attach to the payload arena %s, large payloads stay inline", name)
+        return None
+    return PayloadArena(shm, int(os.environ[SLOT_SIZE_ENV]), free_slots)
+
+
+def persistable(value: Any) -> Any:
+    """Replace an arena reference by a JSON serializable marker"""
+    return {ARENA_MARKER: value.length} if isinstance(value, PayloadRef) else value
+
+
+def persistable_arguments(args: Iterable, kwargs: dict) -> tuple[tuple, dict]:
+    """The arguments with their arena references replaced by markers"""
+    return tuple(persistable(value) for value in args), {name: persistable(value) for name, value in kwargs.items()}
+
+
+def has_lost_payload(args: Iterable, kwargs: dict) -> bool:
+    """Whether persisted arguments had a payload in the arena"""
+    return any(isinstance(value, dict) and ARENA_MARKER in value for value in [*args, *kwargs.values()])
+
+
+def _is_large(value: Any, threshold: int) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview)) and memoryview(value).nbytes >= threshold
+
+
+def pack_payloads(args: tuple, kwargs: dict, threshold: int) -> tuple[tuple, dict, list[PayloadRef]]:
+    """Move the arguments of at least ``threshold`` bytes into the arena"""
+    arena = get_arena()
+    refs: list[PayloadRef] = []
+    if arena is None:
+        return args, kwargs, refs
+
+    def pack(value):
+        if not _is_large(value, threshold):
+            return value
+        ref = arena.store(value)
+        if ref is None:
+            return value
+        refs.append(ref)
+        return ref
+
+    return tuple(pack(value) for value in args), {name: pack(value) for name, value in kwargs.items()}, refs
+
+
+def unpack_payloads(args: tuple, kwargs: dict) -> tuple[tuple, dict, list[PayloadRef]]:
+    """Replace the arena references by memoryviews of their slot"""
+    refs: list[PayloadRef] = []
+
+    def unpack(value):
+        if not isinstance(value, PayloadRef):
+            return value
+        arena = get_arena()
+        if arena is None:
+            raise PayloadLost(f"No payload arena for slot {value.slot}")
+        refs.append(value)
+        return arena.view(value)
+
+    return tuple(unpack(value) for value in args), {name: unpack(value) for name, value in kwargs.items()}, refs
+
+
+def free_payloads(refs: list[PayloadRef]) -> None:
+    """Give the slots back once the task is done with them"""
+    if refs:
+        get_arena().free(refs)
@@ -0,0 +1,60 @@
+"""
+Database connection pool of each interpreter.
+
+Every interpreter runs a Django of its own, and a psycopg connection cannot be
+handed over to another interpreter, so each one gets its own pool (Django's
+``OPTIONS["pool"]``). The pool is sized by the role of the interpreter, set by
+the worker before Django is set up: a web worker, a task worker or the pool
+manager itself, which writes the results behind and replays the tasks.
+"""
+
+from typing import Dict, Optional
+
+WEB = "web"
+TASK = "task"
+MAIN = "main"
+
+_role = MAIN
+
+
+def set_interpreter_role(role: str) -> None:
+    """Set before Django is set up, the settings size the pool by it"""
+    global _role
+    _role = role
+
+
+def interpreter_role() -> str:
+    return _role
+
+
+def pool_options(sizes: Dict[str, int], timeout: float) -> dict:
+    """The ``OPTIONS["pool"]`` of the interpreter, keeping a connection open once idle"""
+    max_size = sizes[_role]
+    return {"min_size": min(1, max_size), "max_size": max_size, "timeout": timeout}
+
+
+def pool_stats() -> Optional[dict]:
+    """Size and wait counters of the pool of this interpreter, None without a pool"""
+    from django.db import connections
+
+    pool = getattr(connections["default"], "pool", None)
+    if pool is None:
+        return None
+    stats = pool.get_stats()
+    return {
+        "size": stats.get("pool_size", 0),
+        "max_size": stats.get("pool_max", 0),
+        "available": stats.get("pool_available", 0),
+        # Threads waiting for a connection right now
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": stats.get("requests_num", 0),
+        "queued": stats.get("requests_queued", 0),
+        "wait_seconds": stats.get("requests_wait_ms", 0) / 1000,
+        # Requests which gave up after the pool timeout
+        "timeouts": stats.get("requests_errors", 0),
+    }
+
+
+def pool_connections(web_workers: int, task_workers: int, sizes: Dict[str, int]) -> int:
+    """Upper bound of the connections opened by the pools of all the interpreters"""
+    return web_workers * sizes[WEB] + task_workers * sizes[TASK] + sizes[MAIN]
@@ -0,0 +1,33 @@
+"""
+Readiness of the worker pool.
+
+The pool manager puts a single token on the ``ready_flag`` queue once every
+worker interpreter it started is warm, so any interpreter can check it with
+a ``qsize()`` instead of a round trip to the main interpreter.
+"""
+
+from concurrent.interpreters import Queue
+from typing import Tuple
+
+from parimitham.routing import queue_depths
+from queue_bridge import get_shareable_queue
+
+READY_QUEUE_NAME = "ready_flag"
+
+
+def signal_ready(queue: Queue) -> None:
+    if queue.qsize() == 0:
+        queue.put(1)
+
+
+def is_ready() -> bool:
+    queue = get_shareable_queue(READY_QUEUE_NAME)
+    # Not running under the pool manager, e.g. the development server
+    return queue is None or queue.qsize() > 0
+
+
+def health_status() -> Tuple[int, dict]:
+    """Status code and body of the health check, unhealthy until every worker of the pool is warm"""
+    if not is_ready():
+        return 503, {"status": "warming", "queues": queue_depths()}
+    return 200, {"status": "ok", "queues": queue_depths()}
@@ -0,0 +1,272 @@
+"""
+Shared task result store.
+
+The store lives once per process, in the main interpreter, and is reached by
+every subinterpreter through the ``result_queue``. Web workers register tasks
+when they are enqueued, task workers report the status transitions and the
+backend looks results up with a single round trip, without touching the
+database.
+"""
+
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Any, Optional, Protocol
+
+from parimitham.metrics import observe
+from queue_bridge import QueueService, notify, request
+
+logger = logging.getLogger(__name__)
+
+RESULT_QUEUE_NAME = "result_queue"
+
+READY = "READY"
+RUNNING = "RUNNING"
+SUCCESSFUL = "SUCCESSFUL"
+FAILED = "FAILED"
+
+# Statuses a task settles in, the watchers of a task are told about it once it reaches one
+FINISHED = {SUCCESSFUL, FAILED}
+
+# Allowed status transitions. RUNNING -> READY happens when a task is retried.
+TRANSITIONS = {
+    None: {READY, RUNNING},
+    READY: {RUNNING, FAILED},
+    RUNNING: {READY, SUCCESSFUL, FAILED},
+    SUCCESSFUL: set(),
+    FAILED: {READY},
+}
+
+# Rough per-record overhead used for the byte budget on top of the payloads
+RECORD_OVERHEAD = 512
+
+# Smoothing factor of the queue wait and run time moving averages
+EMA_ALPHA = 0.2
+
+
+@dataclass(slots=True)
+class ResultRecord:
+    id: str
+    module_path: str
+    status: Optional[str] = None
+    queue_name: str = "default"
+    priority: int = 0
+    payload: bytes = b""  # Pickled (args, kwargs)
+    return_value: bytes = b""  # Pickled return value
+    enqueued_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    last_attempted_at: Optional[datetime] = None
+    run_after: Optional[datetime] = None
+    errors: list[tuple[str, str]] = field(default_factory=list)  # (exception_class_path, traceback)
+    worker_ids: list[str] = field(default_factory=list)
+    expires_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return RECORD_OVERHEAD + len(self.payload) + len(self.return_value)
+
+    def snapshot(self) -> "ResultRecord":
+        return replace(self, errors=list(self.errors), worker_ids=list(self.worker_ids))
+
+
+class ResultListener(Protocol):
+    """Gets told about every change of the result store, e.g. to persist it"""
+
+    def record_changed(self, record: ResultRecord) -> None: ...
+
+    def record_discarded(self, result_id: str) -> None: ...
+
+
+class ResultStore(QueueService):
+    """
+    Bounded in-memory result store.
+
+    Records are kept in least recently used order. Every update or lookup
+    pushes the expiry ``ttl`` seconds forward, so the LRU order is also the
+    expiry order and both evictions are O(1) from the front of the dict.
+    """
+
+    name = "result-store"
+
+    def __init__(
+        self,
+        queue,
+        ttl: float = 3600,
+        max_entries: int = 10_000,
+        max_bytes: int = 32 * 1024 * 1024,
+        listener: Optional[ResultListener] = None,
+    ):
+        super().__init__(queue)
+        self.listener = listener
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.records: OrderedDict[str, ResultRecord] = OrderedDict()
+        # result_id -> (reply_queue, token) of the interpreters waiting for the task to finish
+        self.watchers: dict[str, list[tuple[Any, int]]] = {}
+        self.total_bytes = 0
+        self.evicted = 0
+        # Moving averages in seconds, read by the autoscaler in the main interpreter
+        self.queue_wait = 0.0
+        self.run_time = 0.0
+
+    def _touch(self, record: ResultRecord) -> None:
+        record.expires_at = time.monotonic() + self.ttl
+        self.records.move_to_end(record.id)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self.records:
+            oldest = next(iter(self.records.values()))
+            if oldest.expires_at > now and len(self.records) <= self.max_entries and self.total_bytes <= self.max_bytes:
+                break
+            self.records.popitem(last=False)
+            self.total_bytes -= oldest.size
+            self.evicted += 1
+
+    def on_update(self, result_id: str, module_path: str, status: str, fields: dict) -> None:
+        record = self.records.get(result_id)
+        if record is None:
+            record = self.records[result_id] = ResultRecord(id=result_id, module_path=module_path)
+        elif status not in TRANSITIONS[record.status]:
+            logger.warning("Ignoring transition %s -> %s for task %s", record.status, status, result_id)
+            return
+        else:
+            self.total_bytes -= record.size
+
+        record.status = status
+        for name, value in fields.items():
+            if name == "worker_id":
+                record.worker_ids.append(value)
+            elif name == "error":
+                record.errors.append(value)
+            else:
+                setattr(record, name, value)
+        self.total_bytes += record.size
+
+        if status == RUNNING and record.enqueued_at and record.started_at:
+            wait = (record.started_at - record.enqueued_at).total_seconds()
+            self.queue_wait += EMA_ALPHA * (wait - self.queue_wait)
+            observe("task_queue_wait_seconds", wait, queue=record.queue_name)
+        elif status in (SUCCESSFUL, FAILED) and record.started_at and record.finished_at:
+            run_time = (record.finished_at - record.started_at).total_seconds()
+            self.run_time += EMA_ALPHA * (run_time - self.run_time)
+
+        if self.listener:
+            self.listener.record_changed(record.snapshot())
+        if status in FINISHED and result_id in self.watchers:
+            self._reply_watchers(result_id, record.snapshot())
+
+        self._touch(record)
+        self._evict()
+
+    def on_update_many(self, updates: list[tuple]) -> None:
+        for update in updates:
+            self.on_update(*update)
+
+    def on_discard(self, result_id: str) -> None:
+        record = self.records.pop(result_id, None)
+        if record is not None:
+            self.total_bytes -= record.size
+        if self.listener:
+            self.listener.record_discarded(result_id)
+        # The task was never queued, its watchers get None
+        self._reply_watchers(result_id, None)
+
+    def _reply_watchers(self, result_id: str, record: Optional[ResultRecord]) -> None:
+        for reply_queue, token in self.watchers.pop(result_id, ()):
+            reply_queue.put((token, record))
+
+    def on_watch(self, result_id: str, reply_queue, token: int) -> None:
+        """Put ``(token, record)`` on the reply queue once the task finished, right away if it already has"""
+        record = self.records.get(result_id)
+        if record is not None and record.status in FINISHED:
+            self._touch(record)
+            reply_queue.put((token, record.snapshot()))
+            return
+        # Also when the task is not registered yet, a batched enqueue registers it later on
+        self.watchers.setdefault(result_id, []).append((reply_queue, token))
+
+    def on_unwatch(self, result_id: str, token: int) -> None:
+        """Forget a watcher that stopped waiting, e.g. after its timeout"""
+        watchers = [watcher for watcher in self.watchers.pop(result_id, ()) if watcher[1] != token]
+        if watchers:
+            self.watchers[result_id] = watchers
+
+    def on_get(self, result_id: str) -> Optional[ResultRecord]:
+        self._evict()
+        record = self.records.get(result_id)
+        if record is not None:
+            self._touch(record)
+        return record
+
+    def on_in_flight(self, worker_id: str) -> list[ResultRecord]:
+        """The tasks left RUNNING by a worker, e.g. one that died"""
+        return [
+            record.snapshot()
+            for record in self.records.values()
+            if record.status == RUNNING and record.worker_ids and record.worker_ids[-1] == worker_id
+        ]
+
+    def on_stats(self) -> dict:
+        return {
+            "entries": len(self.records),
+            "bytes": self.total_bytes,
+            "evicted": self.evicted,
+            "watched": sum(len(watchers) for watchers in self.watchers.values()),
+            "queue_wait": self.queue_wait,
+            "run_time": self.run_time,
+        }
+
+
+def result_update(result_id: str, module_path: str, status: str, **fields: Any) -> tuple:
+    """
+    Build a status transition message for the result store.
+
+    ``args``/``kwargs`` and ``return_value`` are pickled here, in the reporting
+    interpreter, so the store only ever holds opaque bytes and can account for
+    their size.
+    """
+    if "args" in fields or "kwargs" in fields:
+        fields["payload"] = pickle.dumps((fields.pop("args", ()), fields.pop("kwargs", {})))
+    if "return_value" in fields:
+        fields["return_value"] = pickle.dumps(fields["return_value"])
+    return result_id, module_path, status, fields
+
+
+def report_result(result_id: str, module_path: str, status: str, **fields: Any) -> None:
+    """Report a status transition for a task to the result store"""
+    notify(RESULT_QUEUE_NAME, "update", *result_update(result_id, module_path, status, **fields))
+
+
+def report_results(updates: list[tuple]) -> None:
+    """Report several status transitions built by result_update() in one message"""
+    notify(RESULT_QUEUE_NAME, "update_many", updates)
+
+
+def discard_result(result_id: str) -> None:
+    """Forget a task that could not be queued"""
+    notify(RESULT_QUEUE_NAME, "discard", result_id)
+
+
+def watch_result(result_id: str, reply_queue, token: int) -> None:
+    """Have ``(token, record)`` put on the reply queue once the task finished, see ResultWaiter"""
+    notify(RESULT_QUEUE_NAME, "watch", result_id, reply_queue, token)
+
+
+def unwatch_result(result_id: str, token: int) -> None:
+    notify(RESULT_QUEUE_NAME, "unwatch", result_id, token)
+
+
+def fetch_in_flight(worker_id: str, timeout: Optional[float] = 5.0) -> list[ResultRecord]:
+    """Look up the tasks left RUNNING by a worker"""
+    return request(RESULT_QUEUE_NAME, "in_flight", worker_id, timeout=timeout)
+
+
+def fetch_result(result_id: str, timeout: Optional[float] = 5.0) -> Optional[ResultRecord]:
+    """Look a task result up in the result store"""
+    return request(RESULT_QUEUE_NAME, "get", result_id, timeout=timeout)
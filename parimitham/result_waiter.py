@@ -0,0 +1,131 @@
+"""
+Waiting for tasks to finish, e.g. to answer a request with the result of the
+task it offloaded to a task worker.
+
+Each interpreter has a single reply queue. A waiter gets a token, asks the
+result store to watch its task and put ``(token, record)`` on that queue once
+the task finished, then waits on a future of its own. A reader thread hands
+the records over to their futures, so nothing polls the result store, and
+only runs while waiters are pending (see lazy_thread.py).
+"""
+
+import asyncio
+import itertools
+import threading
+from concurrent.interpreters import QueueEmpty, create_queue
+from typing import Callable, Optional
+
+from parimitham.lazy_thread import LazyThread
+from parimitham.result_store import ResultRecord, unwatch_result, watch_result
+from queue_bridge import interruptible_get
+
+
+class ResultWaiter:
+    """The reply queue of an interpreter and the waiters pending on it"""
+
+    def __init__(self):
+        self.reply_queue = create_queue()
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._pending: dict[int, Callable[[Optional[ResultRecord]], None]] = {}
+        # Set once no waiter is left, which ends the wait of the reader
+        self._idle = threading.Event()
+        self._reader = LazyThread("result-waiter", self._lock, self._read, self._take, self._resolve)
+
+    def _watch(self, result_id: str, resolve: Callable[[Optional[ResultRecord]], None]) -> int:
+        token = next(self._tokens)
+        with self._lock:
+            self._pending[token] = resolve
+            if not self._reader.running:
+                self._idle.clear()
+                self._reader.start()
+        watch_result(result_id, self.reply_queue, token)
+        return token
+
+    def _forget(self, result_id: str, token: int) -> None:
+        with self._lock:
+            pending = self._pending.pop(token, None)
+            if not self._pending:
+                self._idle.set()
+        if pending is not None:
+            # Timed out or cancelled, the record would not be read
+            unwatch_result(result_id, token)
+
+    def _read(self) -> Optional[tuple[int, Optional[ResultRecord]]]:
+        """The next ``(token, record)``, None once no waiter is left"""
+        try:
+            return interruptible_get(self.reply_queue, self._idle)
+        except QueueEmpty:
+            return None
+
+    def _take(self, reply: Optional[tuple[int, Optional[ResultRecord]]]) -> Optional[tuple]:
+        if reply is None:
+            if not self._pending:
+                return None
+            # A waiter came in meanwhile
+            self._idle.clear()
+            return (None, None)
+        token, record = reply
+        resolve = self._pending.pop(token, None)
+        if not self._pending:
+            self._idle.set()
+        # None once the waiter gave up
+        return (resolve, record)
+
+    def _resolve(self, work: tuple) -> None:
+        resolve, record = work
+        if resolve is not None:
+            resolve(record)
+
+    def wait(self, result_id: str, timeout: Optional[float] = None) -> Optional[ResultRecord]:
+        """
+        Block until the task finished and return its record, None if it was
+        discarded. Raises TimeoutError after ``timeout`` seconds.
+        """
+        done = threading.Event()
+        records = []
+
+        def resolve(record):
+            records.append(record)
+            done.set()
+
+        token = self._watch(result_id, resolve)
+        if not done.wait(timeout):
+            self._forget(result_id, token)
+            # The record may have arrived in the meantime
+            if not done.is_set():
+                raise TimeoutError(f"Task {result_id} did not finish within {timeout}s")
+        return records[0]
+
+    async def await_result(self, result_id: str, timeout: Optional[float] = None) -> Optional[ResultRecord]:
+        """Like wait(), from the event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(record):
+            loop.call_soon_threadsafe(_set_result, future, record)
+
+        token = self._watch(result_id, resolve)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (TimeoutError, asyncio.CancelledError):
+            self._forget(result_id, token)
+            raise
+
+
+def _set_result(future: asyncio.Future, record: Optional[ResultRecord]) -> None:
+    if not future.done():
+        future.set_result(record)
+
+
+_waiter: Optional[ResultWaiter] = None
+_waiter_lock = threading.Lock()
+
+
+def get_result_waiter() -> ResultWaiter:
+    """Get the result waiter of this interpreter"""
+    global _waiter
+    with _waiter_lock:
+        if _waiter is None:
+            _waiter = ResultWaiter()
+        return _waiter
@@ -0,0 +1,30 @@
+"""Retry policies of the interpreter queue tasks"""
+
+import random
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How often a failing task is attempted, and how long to wait before each
+    retry: ``backoff * 2 ** (retry - 1)`` seconds capped at ``max_backoff``,
+    with full jitter so the retries of tasks failing together spread out.
+    """
+
+    max_attempts: int = 1
+    backoff: float = 1.0
+    max_backoff: float = 300.0
+    jitter: bool = True
+
+    def should_retry(self, attempts: int) -> bool:
+        """Whether to retry after ``attempts`` failed attempts"""
+        return attempts < self.max_attempts
+
+    def delay(self, attempts: int) -> float:
+        """Seconds to wait before the retry following ``attempts`` failed attempts"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+NO_RETRY = RetryPolicy()
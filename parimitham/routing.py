@@ -0,0 +1,291 @@
+"""
+Routing of tasks over the interpreter queues.
+
+Every Django Task ``queue_name`` gets one cross-interpreter queue ("lane") per
+priority band. Task workers are started in groups, each subscribing to a
+weighted set of queue names. Every group has a doorbell queue that receives a
+token for each item put on a lane the group subscribes to, so an idle worker
+blocks on a single queue whatever the number of lanes it serves.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.interpreters import Queue, QueueEmpty, QueueFull, create_queue
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from queue_bridge import get_shareable_queue, interruptible_get, timed_get
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_BANDS = ("high", "normal", "low")
+
+# Positions of the routing fields in the task tuples put on the lanes
+QUEUE_NAME_INDEX = 4
+PRIORITY_INDEX = 5
+# Number of earlier attempts of the task
+ATTEMPT_INDEX = 6
+# Trace context of a task enqueued by a traced request, see parimitham.tracing
+TRACE_INDEX = 7
+
+BELL_TOKEN = 1
+
+# Backoff bounds in seconds of aput_tasks() while a lane is full
+MIN_PUT_DELAY = 0.001
+MAX_PUT_DELAY = 0.05
+
+
+class UnknownQueue(ValueError):
+    """No lanes were created for the queue name of a task, e.g. one since removed from TASK_QUEUES"""
+
+
+# queue name -> doorbells of the worker groups subscribed to it
+_routes: Dict[str, Tuple[str, ...]] = {}
+
+
+def priority_band(priority: int) -> str:
+    if priority > 0:
+        return "high"
+    if priority < 0:
+        return "low"
+    return "normal"
+
+
+def lane_name(queue_name: str, band: str) -> str:
+    return f"tasks:{queue_name}:{band}"
+
+
+def bell_name(group: str) -> str:
+    return f"bell:{group}"
+
+
+@dataclass(frozen=True)
+class QueueGroup:
+    """A group of task workers subscribed to the same weighted queues"""
+
+    name: str
+    weights: Tuple[Tuple[str, int], ...]
+    workers: int
+    # Upper bound for the autoscaler, the group is fixed at ``workers`` when not above it
+    max_workers: int = 0
+
+    @property
+    def queue_names(self) -> list[str]:
+        return [queue_name for queue_name, _ in self.weights]
+
+    @property
+    def elastic(self) -> bool:
+        return self.max_workers > self.workers
+
+
+def parse_queue_group(spec: str) -> QueueGroup:
+    """
+    Parse a ``QUEUES=COUNT`` worker group spec, QUEUES being comma separated
+    queue names with an optional ``:WEIGHT``, e.g. ``fast:3,default:1=2``.
+    COUNT may be a ``MIN-MAX`` range for an autoscaled group.
+    """
+    queues, _, count = spec.partition("=")
+    weights = []
+    for queue in queues.split(","):
+        queue_name, _, weight = queue.strip().partition(":")
+        if not queue_name:
+            raise ValueError(f"Empty queue name in {spec!r}")
+        weight = int(weight or 1)
+        if weight < 1:
+            raise ValueError(f"Weight of {queue_name} below 1 in {spec!r}")
+        weights.append((queue_name, weight))
+    min_workers, _, max_workers = (count or "1").partition("-")
+    workers, max_workers = int(min_workers), int(max_workers or 0)
+    if workers < 1:
+        raise ValueError(f"Worker count below 1 in {spec!r}")
+    if max_workers and max_workers < workers:
+        raise ValueError(f"Maximum worker count below the minimum in {spec!r}")
+    return QueueGroup(name=queues.strip(), weights=tuple(weights), workers=workers, max_workers=max_workers)
+
+
+def queue_depth(queues: Dict[str, Queue], queue_names: Iterable[str]) -> int:
+    """Number of items waiting on the lanes of the given queue names"""
+    return sum(queues[lane_name(queue_name, band)].qsize() for queue_name in queue_names for band in PRIORITY_BANDS)
+
+
+def build_routes(groups: Iterable[QueueGroup]) -> Dict[str, Tuple[str, ...]]:
+    routes: Dict[str, list[str]] = {}
+    for group in groups:
+        for queue_name in group.queue_names:
+            routes.setdefault(queue_name, []).append(bell_name(group.name))
+    # Groups with the same spec share a doorbell, which must only be rung once
+    return {queue_name: tuple(dict.fromkeys(bells)) for queue_name, bells in routes.items()}
+
+
+def create_routing_queues(
+    groups: Iterable[QueueGroup], queue_names: Iterable[str] = (), maxsize: int = 0
+) -> Dict[str, Queue]:
+    """
+    Create the lanes of every queue name and the doorbell of every group.
+    With a ``maxsize``, each lane holds at most that many items.
+    """
+    groups = list(groups)
+    queue_names = set(queue_names).union(*(group.queue_names for group in groups))
+    lane_options = {"maxsize": maxsize} if maxsize > 0 else {}
+    queues = {
+        lane_name(queue_name, band): create_queue(**lane_options)
+        for queue_name in queue_names
+        for band in PRIORITY_BANDS
+    }
+    queues.update({bell_name(group.name): create_queue() for group in groups})
+    return queues
+
+
+def set_routes(routes: Dict[str, Tuple[str, ...]]) -> None:
+    """Set the routes handed over by the pool manager"""
+    global _routes
+    _routes = dict(routes)
+
+
+def has_lanes(queue_name: str) -> bool:
+    return get_shareable_queue(lane_name(queue_name, "normal")) is not None
+
+
+def get_lane(queue_name: str, priority: int) -> Queue:
+    return get_shareable_queue(lane_name(queue_name, priority_band(priority)))
+
+
+def queue_depths() -> Dict[str, Dict[str, int]]:
+    """Items waiting on and capacity of the lanes of every routed queue name"""
+    depths = {}
+    for queue_name in _routes:
+        lanes = [get_shareable_queue(lane_name(queue_name, band)) for band in PRIORITY_BANDS]
+        depths[queue_name] = {
+            "depth": sum(lane.qsize() for lane in lanes),
+            "maxsize": sum(max(lane.maxsize, 0) for lane in lanes),
+        }
+    return depths
+
+
+def _group_by_lane(shareable_tasks: list[tuple]) -> Dict[Tuple[str, str], list[tuple]]:
+    lanes: Dict[Tuple[str, str], list[tuple]] = {}
+    for shareable_task in shareable_tasks:
+        queue_name = shareable_task[QUEUE_NAME_INDEX]
+        band = priority_band(shareable_task[PRIORITY_INDEX])
+        lanes.setdefault((queue_name, band), []).append(shareable_task)
+    return lanes
+
+
+def _put_lane(queue_name: str, band: str, tasks: list[tuple], timeout: Optional[float]) -> None:
+    lane = get_shareable_queue(lane_name(queue_name, band))
+    if lane is None:
+        raise UnknownQueue(f"No lanes for the task queue '{queue_name}'")
+    lane.put(tasks[0] if len(tasks) == 1 else tasks, timeout=timeout)
+    bells = _routes.get(queue_name, ())
+    if not bells:
+        logger.warning("No task workers subscribed to queue %s", queue_name)
+    for bell in bells:
+        get_shareable_queue(bell).put(BELL_TOKEN)
+
+
+def put_tasks(shareable_tasks: list[tuple], timeout: Optional[float] = None) -> None:
+    """
+    Put tasks on the lanes matching their queue name and priority, one queue
+    item per lane, and ring the doorbells of the groups serving them.
+
+    When a lane is bounded and full, wait up to ``timeout`` seconds for room
+    and raise QueueFull after that. Raises UnknownQueue for a queue name
+    without lanes.
+    """
+    for (queue_name, band), tasks in _group_by_lane(shareable_tasks).items():
+        _put_lane(queue_name, band, tasks, timeout)
+
+
+def put_tasks_with_room(shareable_tasks: list[tuple], timeout: Optional[float] = None) -> list[tuple]:
+    """
+    Like put_tasks(), but rather than raising QueueFull, carry on with the
+    other lanes and return the tasks of the lanes that stayed full.
+    """
+    full = []
+    for (queue_name, band), tasks in _group_by_lane(shareable_tasks).items():
+        try:
+            _put_lane(queue_name, band, tasks, timeout)
+        except QueueFull:
+            full += tasks
+    return full
+
+
+async def aput_tasks(shareable_tasks: list[tuple], timeout: Optional[float] = None) -> None:
+    """
+    Like put_tasks(), but wait for room on a full lane by polling with a
+    backoff on the event loop instead of blocking it. The lanes and doorbells
+    are only ever put on without blocking.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for (queue_name, band), tasks in _group_by_lane(shareable_tasks).items():
+        delay = MIN_PUT_DELAY
+        while True:
+            try:
+                _put_lane(queue_name, band, tasks, 0)
+                break
+            except QueueFull:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_PUT_DELAY)
+
+
+def weighted_order(weights: Iterable[Tuple[str, int]]) -> list[str]:
+    """Interleave the queue names by weight using smooth weighted round-robin"""
+    weights = list(weights)
+    total = sum(weight for _, weight in weights)
+    current = {queue_name: 0 for queue_name, _ in weights}
+    order = []
+    for _ in range(total):
+        for queue_name, weight in weights:
+            current[queue_name] += weight
+        chosen = max(current, key=current.get)
+        current[chosen] -= total
+        order.append(chosen)
+    return order
+
+
+class Subscription:
+    """
+    The lanes served by a task worker. Higher priority bands are always taken
+    first, and within a band the queues take turns according to their weight.
+    """
+
+    def __init__(self, group: str, weights: Iterable[Tuple[str, int]]):
+        weights = list(weights)
+        self.bell = get_shareable_queue(bell_name(group))
+        self.lanes = {
+            band: {queue_name: get_shareable_queue(lane_name(queue_name, band)) for queue_name, _ in weights}
+            for band in PRIORITY_BANDS
+        }
+        self.order = weighted_order(weights)
+        self._cursor = 0
+
+    def wait(self, timeout: Optional[float] = None, wake: Optional[threading.Event] = None) -> None:
+        """Block until an item may be waiting on one of the lanes, or until ``wake`` is set"""
+        if wake is None:
+            timed_get(self.bell, timeout)
+        else:
+            interruptible_get(self.bell, wake, timeout)
+
+    def take(self) -> Optional[tuple | list]:
+        """Take the next item without blocking, None if every lane is empty"""
+        start = self._cursor
+        self._cursor = (self._cursor + 1) % len(self.order)
+        for band in PRIORITY_BANDS:
+            tried = set()
+            for offset in range(len(self.order)):
+                queue_name = self.order[(start + offset) % len(self.order)]
+                if queue_name in tried:
+                    continue
+                tried.add(queue_name)
+                try:
+                    return self.lanes[band][queue_name].get_nowait()
+                except QueueEmpty:
+                    continue
+        return None
+
+    def depth(self) -> int:
+        return sum(lane.qsize() for lanes in self.lanes.values() for lane in lanes.values())
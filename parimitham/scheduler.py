@@ -0,0 +1,129 @@
+"""
+In-memory scheduler of delayed tasks.
+
+Lives in the main interpreter and is reached through the ``scheduler_queue``.
+Task workers hand it the tasks to retry later instead of sleeping, web workers
+the tasks enqueued with a ``run_after`` in the future, and it puts them back on
+their lanes once they are due. The pending tasks are kept in a heap ordered by
+due time, so the service only wakes up when the earliest one is due and a
+timer costs a heap entry and O(log n) to schedule.
+
+It also enqueues the periodic tasks of the ``TASK_PERIODIC`` setting.
+"""
+
+import heapq
+import logging
+import time
+from concurrent.interpreters import QueueFull
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Iterable, Optional
+
+from parimitham.routing import PRIORITY_INDEX, QUEUE_NAME_INDEX, UnknownQueue, put_tasks
+from parimitham.task_registry import resolve_task, task_ref
+from queue_bridge import QueueService, get_shareable_queue, notify
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_QUEUE_NAME = "scheduler_queue"
+
+# Seconds to wait before trying again to put due tasks on a full lane
+FULL_LANE_DELAY = 1.0
+
+# Due tasks are put on their lane in queue items of up to this many tasks, so
+# a burst of timers firing together is shared between the task workers
+RELEASE_BATCH = 32
+
+
+@dataclass(frozen=True)
+class PeriodicTask:
+    """A task enqueued every ``every`` seconds, the first time ``every`` seconds after startup"""
+
+    name: str
+    task: str
+    every: float
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+
+class TaskScheduler(QueueService):
+    """Puts the scheduled tasks on their lanes at their due time, a ``time.time()`` timestamp"""
+
+    name = "task-scheduler"
+
+    def __init__(self, queue, periodic_tasks: Iterable[PeriodicTask] = ()):
+        super().__init__(queue)
+        # (due_at, sequence, shareable task or periodic task)
+        self._due: list[tuple[float, int, tuple | PeriodicTask]] = []
+        self._sequence = count()
+        self.released = 0
+        now = time.time()
+        for periodic_task in periodic_tasks:
+            heapq.heappush(self._due, (now + periodic_task.every, next(self._sequence), periodic_task))
+            logger.info("Periodic task %s: %s every %ss", periodic_task.name, periodic_task.task, periodic_task.every)
+
+    def on_schedule(self, due_at: float, shareable_tasks: list[tuple]) -> None:
+        for shareable_task in shareable_tasks:
+            heapq.heappush(self._due, (due_at, next(self._sequence), shareable_task))
+
+    def timeout(self) -> Optional[float]:
+        if not self._due:
+            return None
+        return self._due[0][0] - time.time()
+
+    def on_timeout(self) -> None:
+        now = time.time()
+        # Tasks sharing a queue name and priority share a lane
+        due: dict[tuple[str, int], list[tuple]] = {}
+        while self._due and self._due[0][0] <= now:
+            due_at, _, item = heapq.heappop(self._due)
+            if isinstance(item, PeriodicTask):
+                self._enqueue_periodic(item, due_at, now)
+            else:
+                due.setdefault((item[QUEUE_NAME_INDEX], item[PRIORITY_INDEX]), []).append(item)
+
+        delayed = []
+        for (queue_name, _), tasks in due.items():
+            for start in range(0, len(tasks), RELEASE_BATCH):
+                try:
+                    put_tasks(tasks[start : start + RELEASE_BATCH], timeout=0)
+                except QueueFull:
+                    delayed += tasks[start:]
+                    break
+                except UnknownQueue:
+                    logger.error("Dropping %d due task(s) of the queue %s, it has no lanes", len(tasks), queue_name)
+                    break
+                self.released += len(tasks[start : start + RELEASE_BATCH])
+        if delayed:
+            logger.warning("Lanes full, delaying %d due task(s) by %ss", len(delayed), FULL_LANE_DELAY)
+            self.on_schedule(now + FULL_LANE_DELAY, delayed)
+
+    def _enqueue_periodic(self, periodic_task: PeriodicTask, due_at: float, now: float) -> None:
+        try:
+            task = resolve_task(task_ref(periodic_task.task))
+            backend = task.get_backend()
+            # Never waits for room on a full lane, which would hold up every other timer
+            if hasattr(backend, "enqueue_nowait"):
+                backend.enqueue_nowait(task, periodic_task.args, periodic_task.kwargs)
+            else:
+                task.enqueue(*periodic_task.args, **periodic_task.kwargs)
+        except Exception:
+            logger.exception("Failed to enqueue the periodic task %s", periodic_task.name)
+        # Runs missed while the lanes were full or the service was busy are skipped
+        next_due = due_at + periodic_task.every
+        if next_due <= now:
+            next_due = now + periodic_task.every
+        heapq.heappush(self._due, (next_due, next(self._sequence), periodic_task))
+
+    def on_stats(self) -> dict:
+        return {"scheduled": len(self._due), "released": self.released}
+
+
+def schedule_tasks(shareable_tasks: list[tuple], due_at: float) -> None:
+    """Put the tasks on their lanes at ``due_at``, a ``time.time()`` timestamp"""
+    notify(SCHEDULER_QUEUE_NAME, "schedule", due_at, shareable_tasks)
+
+
+def can_schedule() -> bool:
+    """Whether the scheduler is reachable, i.e. running under the pool manager"""
+    return get_shareable_queue(SCHEDULER_QUEUE_NAME) is not None
@@ -1,7 +1,9 @@
 import os
 from pathlib import Path
 
-from configurations.values import BooleanValue, PositiveIntegerValue, Value
+from configurations.values import BooleanValue, DictValue, FloatValue, ListValue, PositiveIntegerValue, Value
+
+from parimitham.pooling import MAIN, TASK, WEB, pool_options
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,6 +22,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "parimitham.core.middleware.metrics_middleware",
+    "parimitham.core.middleware.tracing_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -45,11 +49,132 @@ TEMPLATES = [
 ]
 
 ENABLE_DB_BACKED_TASK = BooleanValue(environ_prefix=None, environ_name="ENABLE_DB_BACKED_TASK", default=False)
+# On Postgres, the DB-backed task workers sleep until LISTEN/NOTIFY wakes them up, rather than
+# polling every second, and claim up to TASK_DB_CLAIM_BATCH tasks at a time
+TASK_DB_LISTEN = BooleanValue(environ_prefix=None, environ_name="TASK_DB_LISTEN", default=True)
+TASK_DB_CLAIM_BATCH = PositiveIntegerValue(environ_prefix=None, environ_name="TASK_DB_CLAIM_BATCH", default=10)
+
+# Dispatch through the interpreter queues and persist the tasks to the database in the
+# background, unfinished tasks are replayed when up.py starts again
+ENABLE_HYBRID_TASK = BooleanValue(environ_prefix=None, environ_name="ENABLE_HYBRID_TASK", default=False)
+
+# Opt-in batching for the interpreter queue. Web workers coalesce enqueues for up to
+# TASK_BATCH_WINDOW seconds or TASK_BATCH_SIZE tasks, task workers take up to
+# TASK_BATCH_SIZE tasks per wakeup.
+TASK_BATCH_SIZE = PositiveIntegerValue(environ_prefix=None, environ_name="TASK_BATCH_SIZE", default=1)
+TASK_BATCH_WINDOW = FloatValue(environ_prefix=None, environ_name="TASK_BATCH_WINDOW", default=0.005)
+
+# Number of tasks each task worker runs at once. Sync tasks run on a thread pool,
+# async tasks on an event loop inside the task worker.
+TASK_CONCURRENCY = PositiveIntegerValue(environ_prefix=None, environ_name="TASK_CONCURRENCY", default=1)
+
+# Seconds a view offloading its work to a task worker waits for the result, see offloaded_hello
+TASK_AWAIT_TIMEOUT = FloatValue(environ_prefix=None, environ_name="TASK_AWAIT_TIMEOUT", default=30.0)
+
+# What web workers do when a bounded task queue (--queue-maxsize of up.py) is full:
+# "block" for up to TASK_QUEUE_BLOCK_TIMEOUT seconds then reject, "reject" with a 503
+# straight away, or "spill" the task to the database backend.
+TASK_QUEUE_OVERFLOW = Value(environ_prefix=None, environ_name="TASK_QUEUE_OVERFLOW", default="block")
+TASK_QUEUE_BLOCK_TIMEOUT = FloatValue(environ_prefix=None, environ_name="TASK_QUEUE_BLOCK_TIMEOUT", default=5.0)
+
+# Task arguments of at least this many bytes go through the shared memory payload arena
+# (--payload-slots of up.py) instead of being pickled onto the queue, 0 to keep them inline
+TASK_PAYLOAD_THRESHOLD = PositiveIntegerValue(environ_prefix=None, environ_name="TASK_PAYLOAD_THRESHOLD", default=0)
+
+# Per task INFO logs (enqueued, executing) are only written for one in TASK_LOG_EVERY tasks,
+# failures are always logged
+TASK_LOG_EVERY = PositiveIntegerValue(environ_prefix=None, environ_name="TASK_LOG_EVERY", default=100)
+
+# Failed tasks run up to TASK_RETRY_MAX_ATTEMPTS times in total, waiting a random delay of up to
+# TASK_RETRY_BACKOFF * 2 ** (attempt - 1) seconds, capped at TASK_RETRY_MAX_BACKOFF, between attempts.
+# TASK_RETRY_POLICIES overrides these per task path, e.g. {"app.tasks.sync": {"max_attempts": 5}}.
+TASK_RETRY_MAX_ATTEMPTS = PositiveIntegerValue(environ_prefix=None, environ_name="TASK_RETRY_MAX_ATTEMPTS", default=1)
+TASK_RETRY_BACKOFF = FloatValue(environ_prefix=None, environ_name="TASK_RETRY_BACKOFF", default=1.0)
+TASK_RETRY_MAX_BACKOFF = FloatValue(environ_prefix=None, environ_name="TASK_RETRY_MAX_BACKOFF", default=300.0)
+TASK_RETRY_POLICIES = {}
+
+# Tasks enqueued periodically by the scheduler of the pool manager, by name, e.g.
+# {"cleanup": {"task": "parimitham.core.tasks.cleanup", "every": 3600, "kwargs": {"days": 7}}}
+TASK_PERIODIC = {}
+
+# Tasks that exhausted their attempts are kept there, see the dead_letters management command
+DEAD_LETTER_FILE = Value(
+    environ_prefix=None, environ_name="DEAD_LETTER_FILE", default=str(BASE_DIR / "dead_letters.jsonl")
+)
+
+# Share of the requests traced along with the tasks they enqueue, when up.py runs with --trace-sample,
+# requests with a traceparent header are always traced. The spans are appended to TRACE_FILE.
+TRACE_SAMPLE_RATE = FloatValue(environ_prefix=None, environ_name="TRACE_SAMPLE_RATE", default=0.0)
+TRACE_FILE = Value(environ_prefix=None, environ_name="TRACE_FILE", default=str(BASE_DIR / "traces.jsonl"))
+
+# Requests in flight per path prefix in each web worker, the longest matching prefix applying, e.g.
+# HTTP_CONCURRENCY_LIMITS="{'/hello/': 4, '/bench/': 64}". Requests over the limit are rejected with a 503
+# before reaching Django, see parimitham/admission.py.
+HTTP_CONCURRENCY_LIMITS = DictValue({"/hello/": 4}, environ_prefix=None, environ_name="HTTP_CONCURRENCY_LIMITS")
+
+# Serve the /bench/ endpoints driven by bench.py
+BENCHMARK_ENDPOINTS = BooleanValue(environ_prefix=None, environ_name="BENCHMARK_ENDPOINTS", default=False)
+
+# The default cache: "local", a LocMemCache in every interpreter, or "shared", kept once per process by the
+# pool manager (see cache_store.py) at the cost of a queue round trip per call. Both evict the least recently
+# used entries beyond CACHE_MAX_ENTRIES entries, the shared one also beyond CACHE_MAX_BYTES bytes.
+CACHE_BACKEND = Value(environ_prefix=None, environ_name="CACHE_BACKEND", default="local")
+CACHE_MAX_ENTRIES = PositiveIntegerValue(environ_prefix=None, environ_name="CACHE_MAX_ENTRIES", default=10_000)
+CACHE_MAX_BYTES = PositiveIntegerValue(environ_prefix=None, environ_name="CACHE_MAX_BYTES", default=64 * 1024 * 1024)
+CACHE_TIMEOUT = PositiveIntegerValue(environ_prefix=None, environ_name="CACHE_TIMEOUT", default=300)
+CACHE_BACKENDS = {
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "TIMEOUT": CACHE_TIMEOUT,
+        "OPTIONS": {"MAX_ENTRIES": CACHE_MAX_ENTRIES},
+    },
+    "shared": {
+        "BACKEND": "parimitham.core.shared_cache.SharedCache",
+        "TIMEOUT": CACHE_TIMEOUT,
+        "OPTIONS": {"MAX_ENTRIES": CACHE_MAX_ENTRIES, "MAX_BYTES": CACHE_MAX_BYTES},
+    },
+}
+CACHES = {"default": CACHE_BACKENDS[CACHE_BACKEND]}
+if BENCHMARK_ENDPOINTS:
+    # Both, under their names, for bench.py to compare them
+    CACHES.update(CACHE_BACKENDS)
+
+# Task queue names the task workers are started for, see the --queue option of up.py
+TASK_QUEUES = ListValue(environ_prefix=None, environ_name="TASK_QUEUES", default=["default"])
 
 if ENABLE_DB_BACKED_TASK:
-    TASKS = {"default": {"BACKEND": "django_tasks_db.DatabaseBackend"}}
+    TASKS = {"default": {"BACKEND": "django_tasks_db.DatabaseBackend", "QUEUES": TASK_QUEUES}}
 else:
-    TASKS = {"default": {"BACKEND": "parimitham.core.interpreter_queue_backend.InterpreterQueueBackend"}}
+    TASKS = {
+        "default": {
+            "BACKEND": (
+                "parimitham.core.hybrid_backend.HybridBackend"
+                if ENABLE_HYBRID_TASK
+                else "parimitham.core.interpreter_queue_backend.InterpreterQueueBackend"
+            ),
+            "QUEUES": TASK_QUEUES,
+            "OPTIONS": {
+                "batch_size": TASK_BATCH_SIZE,
+                "batch_window": TASK_BATCH_WINDOW,
+                "concurrency": TASK_CONCURRENCY,
+                "overflow": TASK_QUEUE_OVERFLOW,
+                "overflow_timeout": TASK_QUEUE_BLOCK_TIMEOUT,
+                "spill_backend": "spill",
+                "payload_threshold": TASK_PAYLOAD_THRESHOLD,
+                "log_every": TASK_LOG_EVERY,
+                "retry": {
+                    "default": {
+                        "max_attempts": TASK_RETRY_MAX_ATTEMPTS,
+                        "backoff": TASK_RETRY_BACKOFF,
+                        "max_backoff": TASK_RETRY_MAX_BACKOFF,
+                    },
+                    "tasks": TASK_RETRY_POLICIES,
+                },
+            },
+        }
+    }
+    if TASK_QUEUE_OVERFLOW == "spill":
+        TASKS["spill"] = {"BACKEND": "django_tasks_db.DatabaseBackend", "QUEUES": TASK_QUEUES}
 
 DB_HOST = Value(environ_prefix=None, environ_name="DB_HOST", default="localhost")
 DB_NAME = Value(environ_prefix=None, environ_name="DB_NAME", default="parimitham")
@@ -58,24 +183,51 @@ DB_USER = Value(environ_prefix=None, environ_name="DB_USER", default="postgres")
 DB_PASS = Value(environ_prefix=None, environ_name="DB_PASS", default="postgres")
 
 DB_PORT = PositiveIntegerValue(environ_prefix=None, environ_name="DB_PORT", default=5432)
+# "postgresql", or "sqlite3" to run without a database server, e.g. for bench.py, DB_NAME then being the file
+DB_ENGINE = Value(environ_prefix=None, environ_name="DB_ENGINE", default="postgresql")
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "CONN_MAX_AGE": 60,
-        "OPTIONS": {
-            "options": "-c search_path=" + DB_SCHEMA,
-        },
-        "NAME": DB_NAME,
-        "USER": DB_USER,
-        "PASSWORD": DB_PASS,
-        "HOST": DB_HOST,
-        "PORT": DB_PORT,
-        "TEST": {
-            "NAME": "test_" + DB_NAME,
-        },
+# Postgres only, a psycopg connection pool (psycopg[pool]) in every interpreter rather than a persistent
+# connection per thread, of up to DB_POOL_WEB_SIZE connections in a web worker, DB_POOL_TASK_SIZE in a task
+# worker and DB_POOL_MAIN_SIZE in the pool manager. Getting a connection fails after DB_POOL_TIMEOUT seconds.
+DB_POOL = BooleanValue(environ_prefix=None, environ_name="DB_POOL", default=False)
+DB_POOL_WEB_SIZE = PositiveIntegerValue(environ_prefix=None, environ_name="DB_POOL_WEB_SIZE", default=4)
+# One per task running at once, plus the run loop of the worker
+DB_POOL_TASK_SIZE = PositiveIntegerValue(
+    environ_prefix=None, environ_name="DB_POOL_TASK_SIZE", default=TASK_CONCURRENCY + 1
+)
+DB_POOL_MAIN_SIZE = PositiveIntegerValue(environ_prefix=None, environ_name="DB_POOL_MAIN_SIZE", default=2)
+DB_POOL_TIMEOUT = FloatValue(environ_prefix=None, environ_name="DB_POOL_TIMEOUT", default=10.0)
+DB_POOL_SIZES = {WEB: DB_POOL_WEB_SIZE, TASK: DB_POOL_TASK_SIZE, MAIN: DB_POOL_MAIN_SIZE}
+
+if DB_ENGINE == "sqlite3":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": DB_NAME if DB_NAME.endswith(".sqlite3") else str(BASE_DIR / f"{DB_NAME}.sqlite3"),
+            # Concurrent writers from every interpreter wait for the lock rather than fail
+            "OPTIONS": {"timeout": 20, "transaction_mode": "IMMEDIATE"},
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            # Connections go back to the pool at the end of each request instead
+            "CONN_MAX_AGE": 0 if DB_POOL else 60,
+            "OPTIONS": {
+                "options": "-c search_path=" + DB_SCHEMA,
+                **({"pool": pool_options(DB_POOL_SIZES, DB_POOL_TIMEOUT)} if DB_POOL else {}),
+            },
+            "NAME": DB_NAME,
+            "USER": DB_USER,
+            "PASSWORD": DB_PASS,
+            "HOST": DB_HOST,
+            "PORT": DB_PORT,
+            "TEST": {
+                "NAME": "test_" + DB_NAME,
+            },
+        }
     }
-}
 
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "UTC"
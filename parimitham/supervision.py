@@ -0,0 +1,105 @@
+"""
+Supervision of the worker interpreters.
+
+The pool manager watches the future of every worker. A worker that dies is
+finalized with its interpreter and started again in a fresh one, without
+touching the other workers, and the tasks it left RUNNING are put back on
+their queues. A task worker may also stop on its own to be recycled, after
+``max_tasks`` tasks or once its interpreter holds ``max_blocks`` memory blocks.
+"""
+
+import logging
+import pickle
+from typing import Optional
+
+from django.utils import timezone
+
+from parimitham.dead_letters import dead_letter
+from parimitham.payloads import PayloadRef, free_payloads
+from parimitham.result_store import FAILED, READY, fetch_in_flight, report_results, result_update
+from parimitham.routing import ATTEMPT_INDEX, put_tasks
+from parimitham.task_registry import task_ref
+
+logger = logging.getLogger(__name__)
+
+# Returned by a task worker that stopped on its own to be recycled
+RECYCLE = "recycle"
+
+# A worker dying sooner than this many seconds after its start is restarted
+# after a delay doubling from RESTART_BACKOFF up to MAX_RESTART_BACKOFF seconds
+MIN_UPTIME = 10.0
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 30.0
+
+# A task running in that many dying workers is failed rather than requeued again
+MAX_CRASHES_PER_TASK = 3
+
+
+class WorkerCrashed(Exception):
+    """The worker running the task died"""
+
+
+CRASH_ERROR_PATH = f"{WorkerCrashed.__module__}.{WorkerCrashed.__qualname__}"
+
+
+def restart_delay(quick_crashes: int) -> float:
+    """Seconds to wait before restarting a worker that died young ``quick_crashes`` times in a row"""
+    if not quick_crashes:
+        return 0.0
+    return min(MAX_RESTART_BACKOFF, RESTART_BACKOFF * 2 ** (quick_crashes - 1))
+
+
+def _payload_refs(args: tuple, kwargs: Optional[dict]) -> list[PayloadRef]:
+    return [value for value in [*args, *(kwargs or {}).values()] if isinstance(value, PayloadRef)]
+
+
+def _has_payload_ref(args: tuple, kwargs: dict) -> bool:
+    return bool(_payload_refs(args, kwargs))
+
+
+def requeue_in_flight(worker_id: str, worker_name: str) -> tuple[int, int]:
+    """
+    Put the tasks a dead worker left RUNNING back on their queues. A task whose
+    payload was in the arena, whose slots the worker may have written to, or
+    that was already running in ``MAX_CRASHES_PER_TASK`` dead workers is
+    failed, giving its slots back.
+    Returns the number of requeued and failed tasks.
+    """
+    try:
+        records = fetch_in_flight(worker_id)
+    except Exception:
+        logger.exception("Cannot look up the tasks in flight of %s", worker_name)
+        return 0, 0
+
+    now = timezone.now()
+    shareable_tasks, updates, failed = [], [], []
+    for record in records:
+        args, kwargs = pickle.loads(record.payload) if record.payload else ((), {})
+        error = (CRASH_ERROR_PATH, f"{worker_name} died while running the task")
+        crashes = 1 + sum(1 for exception_class_path, _ in record.errors if exception_class_path == CRASH_ERROR_PATH)
+        shareable_task = (
+            record.id,
+            task_ref(record.module_path),
+            args,
+            kwargs or None,
+            record.queue_name,
+            record.priority,
+            len(record.errors) + 1,
+            None,
+        )
+        if crashes >= MAX_CRASHES_PER_TASK or _has_payload_ref(args, kwargs):
+            failed.append((record, shareable_task, error))
+            continue
+        shareable_tasks.append(shareable_task)
+        updates.append(result_update(record.id, record.module_path, READY, error=error))
+
+    if updates:
+        report_results(updates)
+        put_tasks(shareable_tasks)
+        logger.warning("Requeued %d task(s) left running by %s", len(shareable_tasks), worker_name)
+    for record, shareable_task, error in failed:
+        logger.error("Task %s (%s) failed, its worker died", record.id, record.module_path)
+        report_results([result_update(record.id, record.module_path, FAILED, finished_at=now, error=error)])
+        dead_letter(shareable_task, record.module_path, shareable_task[ATTEMPT_INDEX], *error)
+        free_payloads(_payload_refs(*shareable_task[2:4]))
+    return len(shareable_tasks), len(failed)
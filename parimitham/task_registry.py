@@ -0,0 +1,71 @@
+"""
+Registry of the tasks, shared by all the interpreters.
+
+The pool manager discovers the tasks of the installed apps once on startup
+and hands the sorted table of their paths to every interpreter, so a task is
+addressed on the queues by its index in the table rather than by its dotted
+path. A task missing from the table, e.g. defined outside a ``tasks`` module,
+is still addressed by its dotted path. Either way a task is only imported
+once per interpreter.
+"""
+
+import sys
+from itertools import count
+from typing import Tuple
+
+from django.apps import apps
+from django.tasks import Task
+from django.utils.module_loading import autodiscover_modules, import_string
+
+TaskRef = int | str
+
+_paths: Tuple[str, ...] = ()
+_ids: dict[str, int] = {}
+_resolved: dict[TaskRef, Task] = {}
+
+
+def discover_task_paths() -> Tuple[str, ...]:
+    """Dotted paths of the tasks defined in the ``tasks`` module of the installed apps"""
+    autodiscover_modules("tasks")
+    paths = set()
+    for app_config in apps.get_app_configs():
+        module = sys.modules.get(f"{app_config.name}.tasks")
+        if module is None:
+            continue
+        paths.update(value.module_path for value in vars(module).values() if isinstance(value, Task))
+    return tuple(sorted(paths))
+
+
+def set_task_table(paths: Tuple[str, ...]) -> None:
+    """Set the task table handed over by the pool manager"""
+    global _paths, _ids
+    _paths = tuple(paths)
+    _ids = {path: task_id for task_id, path in enumerate(_paths)}
+    _resolved.clear()
+
+
+def task_ref(module_path: str) -> TaskRef:
+    return _ids.get(module_path, module_path)
+
+
+def task_path(ref: TaskRef) -> str:
+    return _paths[ref] if isinstance(ref, int) else ref
+
+
+def resolve_task(ref: TaskRef) -> Task:
+    task = _resolved.get(ref)
+    if task is None:
+        task = _resolved[ref] = import_string(task_path(ref))
+    return task
+
+
+class LogSampler:
+    """Lets one in ``every`` calls through, so per task logging stays cheap on short tasks"""
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        # next() on a count is atomic, no lock needed
+        self._counter = count()
+
+    def __call__(self) -> bool:
+        return next(self._counter) % self.every == 0
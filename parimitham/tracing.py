@@ -0,0 +1,234 @@
+"""
+Tracing of the requests and of the tasks they enqueue, across the interpreters.
+
+A sampled request gets a trace id, the one of its ``traceparent`` header or a
+fresh one, and every task it enqueues carries the trace id, the request span
+id and its enqueue time in the task tuple. The task worker then records a
+``queue`` span from the enqueue to the dequeue of the task and a ``task`` span
+from its start to its finish.
+
+Spans are buffered per interpreter and pushed in batches over the
+``trace_queue`` to the writer in the main interpreter, which appends them to a
+JSON lines file. The spans use the field names of the OTLP JSON encoding, with
+the attributes as a plain object, so they can be forwarded to an OTLP collector.
+"""
+
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from parimitham.lazy_thread import LazyThread
+from queue_bridge import QueueService, get_shareable_queue, notify
+
+logger = logging.getLogger(__name__)
+
+TRACE_QUEUE_NAME = "trace_queue"
+
+# Seconds between two pushes of an interpreter's spans, a full batch is pushed straight away
+FLUSH_INTERVAL = 1.0
+MAX_BATCH = 512
+
+# (trace_id, parent_span_id, enqueued_at in ns), carried by the task tuples of sampled requests
+TraceContext = Tuple[str, str, int]
+
+_current: ContextVar[Optional[Tuple[str, str]]] = ContextVar("trace", default=None)
+
+
+def tracing_enabled() -> bool:
+    """Whether the spans are collected, i.e. running under the pool manager with tracing on"""
+    return get_shareable_queue(TRACE_QUEUE_NAME) is not None
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[str]:
+    """The trace id of a W3C ``traceparent`` header, None when missing or malformed"""
+    if not header:
+        return None
+    parts = header.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or parts[1] == "0" * 32:
+        return None
+    return parts[1]
+
+
+def start_trace(sample_rate: float, traceparent: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    Start tracing the current request, or not if it is not sampled. A request
+    with a ``traceparent`` is always sampled. Returns the trace and span ids.
+    """
+    trace_id = parse_traceparent(traceparent)
+    if trace_id is None:
+        if not sample_rate or random.random() >= sample_rate:
+            _current.set(None)
+            return None
+        trace_id = new_trace_id()
+    trace = (trace_id, new_span_id())
+    _current.set(trace)
+    return trace
+
+
+def end_trace() -> None:
+    _current.set(None)
+
+
+def task_trace() -> Optional[TraceContext]:
+    """The trace context of a task enqueued now, None outside of a sampled request"""
+    trace = _current.get()
+    if trace is None:
+        return None
+    return (*trace, time.time_ns())
+
+
+def requeued_trace(trace: Optional[TraceContext], enqueued_at: float) -> Optional[TraceContext]:
+    """The trace context of a task put back on its queue at ``enqueued_at``, a ``time.time()`` timestamp"""
+    if trace is None:
+        return None
+    return (trace[0], trace[1], int(enqueued_at * 1e9))
+
+
+def span(
+    name: str,
+    trace_id: str,
+    start_ns: int,
+    end_ns: int,
+    parent_span_id: Optional[str] = None,
+    span_id: Optional[str] = None,
+    **attributes,
+) -> dict:
+    return {
+        "traceId": trace_id,
+        "spanId": span_id or new_span_id(),
+        "parentSpanId": parent_span_id or "",
+        "name": name,
+        "startTimeUnixNano": start_ns,
+        "endTimeUnixNano": end_ns,
+        "attributes": attributes,
+    }
+
+
+class SpanBuffer:
+    """The spans recorded in one interpreter since they were last pushed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: list[dict] = []
+        self._flusher = LazyThread(
+            "span-flusher", self._lock, lambda: time.sleep(FLUSH_INTERVAL), self._take, self._push
+        )
+
+    def add(self, span: dict) -> None:
+        with self._lock:
+            self._spans.append(span)
+            if len(self._spans) >= MAX_BATCH:
+                spans, self._spans = self._spans, []
+            else:
+                spans = None
+                self._flusher.start()
+        if spans:
+            self._push(spans)
+
+    def _take(self, _) -> Optional[list[dict]]:
+        spans, self._spans = self._spans, []
+        return spans or None
+
+    def _push(self, spans: list[dict]) -> None:
+        if tracing_enabled():
+            notify(TRACE_QUEUE_NAME, "spans", spans)
+
+
+_buffer = SpanBuffer()
+
+
+def record_span(span: dict) -> None:
+    """Record a span of this interpreter"""
+    _buffer.add(span)
+
+
+def record_task_spans(
+    trace: TraceContext,
+    result_id: str,
+    module_path: str,
+    queue_name: str,
+    dequeued_at: int,
+    started_at: Optional[int],
+    finished_at: int,
+    status: str,
+) -> None:
+    """Record the queue and run spans of a task, the timestamps being in ns"""
+    trace_id, parent_span_id, enqueued_at = trace
+    record_span(
+        span(
+            f"queue {queue_name}",
+            trace_id,
+            enqueued_at,
+            dequeued_at,
+            parent_span_id,
+            kind="queue",
+            queue=queue_name,
+            task=module_path,
+            result_id=result_id,
+        )
+    )
+    if started_at is not None:
+        record_span(
+            span(
+                f"task {module_path}",
+                trace_id,
+                started_at,
+                finished_at,
+                parent_span_id,
+                kind="task",
+                queue=queue_name,
+                task=module_path,
+                result_id=result_id,
+                status=status,
+            )
+        )
+
+
+class TraceWriter(QueueService):
+    """Appends the spans pushed by the interpreters to a JSON lines file"""
+
+    name = "trace-writer"
+
+    def __init__(self, queue, path: Path):
+        super().__init__(queue)
+        self.path = path
+        self.written = 0
+        self._file = path.open("a", encoding="utf-8")
+
+    def on_spans(self, spans: list[dict]) -> None:
+        self._file.write("".join(json.dumps(span, separators=(",", ":")) + "\n" for span in spans))
+        self._file.flush()
+        self.written += len(spans)
+
+    def on_stop(self) -> None:
+        self._file.close()
+
+    def on_stats(self) -> dict:
+        return {"written": self.written}
+
+
+def read_spans(path: Path) -> Iterable[dict]:
+    with path.open(encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
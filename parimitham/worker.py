@@ -1,10 +1,17 @@
 import logging
 import os
+from importlib import import_module
+from typing import Optional
 from uuid import uuid7
 
 import django
 from django.core.management import call_command
-from django.tasks import DEFAULT_TASK_BACKEND_ALIAS, DEFAULT_TASK_QUEUE_NAME
+from django.tasks import DEFAULT_TASK_BACKEND_ALIAS, DEFAULT_TASK_QUEUE_NAME, task_backends
+from django.urls import get_resolver
+from django.utils.module_loading import autodiscover_modules
+
+from parimitham.metrics import StartupTimer
+from parimitham.routing import QueueGroup
 
 logger = logging.getLogger(__name__)
 
@@ -14,45 +21,105 @@ def migrate():
     call_command("migrate", interactive=False)
 
 
-def configure_worker():
-    # Import Django setup
+def setup_django():
+    """Configure Django in the current interpreter"""
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "parimitham.settings")
     django.setup(set_prefix=False)
-    # Run migrations first
-    migrate()
+
+
+def warm_up(startup: Optional[StartupTimer] = None, application_path: Optional[str] = None):
+    """
+    Do the imports and the lazy setup of Django up front, so the first request
+    or task served by this interpreter does not pay for them. With an
+    ``application_path``, the URL resolver and the application are loaded too.
+    """
+
+    def mark(phase: str):
+        if startup:
+            startup.mark(phase)
+
+    setup_django()
+    mark("django")
+
+    autodiscover_modules("tasks")
+    task_backends.all()
+    mark("tasks")
+
+    if application_path:
+        # Imports the views and builds the lookup tables the first resolve() would
+        get_resolver().reverse_dict
+        mark("urls")
+        import_module(application_path.partition(":")[0])
+        mark("application")
+
+
+def configure_worker(
+    group: QueueGroup,
+    worker_id: Optional[str] = None,
+    max_tasks: Optional[int] = None,
+    max_blocks: Optional[int] = None,
+):
+    # Django is set up by the caller, and the migrations ran once in the pool manager
     from parimitham.core.management.commands.execute_task_from_interpreter_queue import (
         InterpreterWorker,
     )
 
+    backend = task_backends[DEFAULT_TASK_BACKEND_ALIAS]
+    spill_worker = None
+    if backend.overflow == "spill":
+        from django_tasks_db.management.commands import db_worker
+
+        spill_worker = db_worker.Worker(
+            queue_names=group.queue_names,
+            interval=0,
+            batch=True,
+            backend_name=backend.spill_backend,
+            startup_delay=False,
+            max_tasks=None,
+            worker_id=str(uuid7()),
+        )
+
     logger.info("Starting task execution using Interpreter Queue Worker...")
     worker = InterpreterWorker(
-        queue_names=[DEFAULT_TASK_QUEUE_NAME],
+        queue_names=group.queue_names,
+        queue_weights=dict(group.weights),
+        group=group.name,
         interval=1,
-        batch=False,
+        batch=backend.batch_size > 1,
+        batch_size=backend.batch_size,
+        concurrency=backend.concurrency,
+        spill_worker=spill_worker,
+        log_every=backend.log_every,
+        retry_policy=backend.get_retry_policy,
         backend_name=DEFAULT_TASK_BACKEND_ALIAS,
         startup_delay=True,
-        max_tasks=None,
-        worker_id=str(uuid7()),
+        max_tasks=max_tasks,
+        max_blocks=max_blocks,
+        worker_id=worker_id or str(uuid7()),
     )
     return worker
 
 
-def configure_db_worker():
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "parimitham.settings")
-    django.setup(set_prefix=False)
-    # Run migrations first
-    migrate()
-
+def configure_db_worker(
+    queue_names: Optional[list[str]] = None, worker_id: Optional[str] = None, max_tasks: Optional[int] = None
+):
+    # Django is set up by the caller, and the migrations ran once in the pool manager
+    from django.conf import settings
+    from django.db import connections
     from django_tasks_db.management.commands import db_worker
 
-    logger.info("Starting task execution using DB Worker...")
+    options = {
+        "queue_names": queue_names or [DEFAULT_TASK_QUEUE_NAME],
+        "batch": False,
+        "backend_name": DEFAULT_TASK_BACKEND_ALIAS,
+        "max_tasks": max_tasks,
+        "worker_id": worker_id or str(uuid7()),
+    }
+    if settings.TASK_DB_LISTEN and connections["default"].vendor == "postgresql":
+        from parimitham.core.pg_worker import PostgresWorker
 
-    return db_worker.Worker(
-        queue_names=[DEFAULT_TASK_QUEUE_NAME],
-        interval=1,
-        batch=False,
-        backend_name=DEFAULT_TASK_BACKEND_ALIAS,
-        startup_delay=True,
-        max_tasks=None,
-        worker_id=str(uuid7()),
-    )
+        logger.info("Starting task execution using Postgres Worker...")
+        return PostgresWorker(claim_batch=settings.TASK_DB_CLAIM_BATCH, interval=0, startup_delay=False, **options)
+
+    logger.info("Starting task execution using DB Worker...")
+    return db_worker.Worker(interval=1, startup_delay=True, **options)
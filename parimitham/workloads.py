@@ -0,0 +1,41 @@
+"""
+Workloads of the benchmark endpoints and tasks, see bench.py.
+
+Free of Django, so the baselines of bench.py run the very same functions in
+plain thread, process and interpreter pools.
+"""
+
+import random
+import time
+import zlib
+from functools import lru_cache
+
+
+def cpu_work(n: int) -> int:
+    """Pure Python CPU-bound work holding the GIL: count the primes below ``n``"""
+    count = 0
+    for candidate in range(2, n):
+        divisor = 2
+        while divisor * divisor <= candidate:
+            if candidate % divisor == 0:
+                break
+            divisor += 1
+        else:
+            count += 1
+    return count
+
+
+def io_work(ms: float) -> None:
+    """I/O-bound work releasing the GIL, a blocking wait of ``ms`` milliseconds"""
+    time.sleep(ms / 1000)
+
+
+@lru_cache(maxsize=8)
+def make_payload(size: int, seed: int = 0) -> bytes:
+    """Incompressible bytes, the same for a given size and seed"""
+    return random.Random(seed).randbytes(size)
+
+
+def payload_work(payload: bytes | memoryview) -> int:
+    """Read the whole payload once, e.g. a view of a payload arena slot"""
+    return zlib.crc32(payload)
@@ -1,7 +1,11 @@
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
+from parimitham.admission import WSGIAdmissionControl
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "parimitham.settings")
 
-application = get_wsgi_application()
+# Sets Django up, which the settings read below need
+application = WSGIAdmissionControl(get_wsgi_application(), settings.HTTP_CONCURRENCY_LIMITS)
@@ -1,11 +1,28 @@
 """Bridge module to share queues between subinterpreter workers and Django"""
 
-from concurrent.interpreters import Queue
+import logging
+import threading
+import time
+from concurrent.interpreters import Queue, QueueEmpty, create_queue
 from functools import cache
-from typing import Dict, Optional
+from typing import Any, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
 
 # Global storage for worker queues
-_worker_queues: Dict[int, Queue] = {}
+_worker_queues: Dict[str, Queue] = {}
+
+# Per-thread reply queues used by request()
+_local = threading.local()
+
+# Seconds between two polls of an empty queue, the same as a blocking Queue.get()
+POLL_INTERVAL = 0.01
+
+# Never set, for the waits only their timeout ends
+_no_wake = threading.Event()
+
+# Seconds before a service retries its time based work after it failed, unless a message comes first
+TIMEOUT_RETRY_DELAY = 1.0
 
 
 def set_shareable_queue(name: str, queue: Queue) -> None:
@@ -14,8 +31,188 @@ def set_shareable_queue(name: str, queue: Queue) -> None:
     _worker_queues[name] = queue
 
 
+def set_shareable_queues(queues: Mapping[str, Queue]) -> None:
+    """Set all the shareable queues handed over by the pool manager"""
+    for name, queue in queues.items():
+        set_shareable_queue(name, queue)
+
+
 @cache
 def get_shareable_queue(name: str) -> Optional[Queue]:
     """Get the shareable queue for the given name"""
     global _worker_queues
     return _worker_queues.get(name)
+
+
+def notify(name: str, op: str, *args: Any) -> None:
+    """Send a fire-and-forget message to the service reading the named queue"""
+    notify_queue(get_shareable_queue(name), op, *args)
+
+
+def notify_queue(queue: Queue, op: str, *args: Any) -> None:
+    """Send a fire-and-forget message to the service reading the queue"""
+    queue.put((op, args, None))
+
+
+def request(name: str, op: str, *args: Any, timeout: Optional[float] = None) -> Any:
+    """Send a request to the service reading the named queue and wait for its reply"""
+    return request_queue(get_shareable_queue(name), op, *args, timeout=timeout)
+
+
+def _reply_queue() -> Queue:
+    reply_queue = getattr(_local, "reply_queue", None)
+    if reply_queue is None:
+        reply_queue = _local.reply_queue = create_queue()
+    return reply_queue
+
+
+def _next_sequence() -> int:
+    _local.sequence = sequence = getattr(_local, "sequence", 0) + 1
+    return sequence
+
+
+def request_queue(queue: Queue, op: str, *args: Any, timeout: Optional[float] = None) -> Any:
+    """Send a request to the service reading the queue and wait for its reply, TimeoutError after ``timeout``"""
+    reply_queue = _reply_queue()
+    sequence = _next_sequence()
+
+    queue.put((op, args, (reply_queue, sequence)))
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            reply_sequence, ok, value = timed_get(reply_queue, remaining)
+        except QueueEmpty:
+            raise TimeoutError(f"No reply to {op} within {timeout}s") from None
+        # Replies to earlier requests that timed out are dropped here
+        if reply_sequence != sequence:
+            continue
+        if not ok:
+            raise value
+        return value
+
+
+def request_queues(queues: Mapping[str, Queue], op: str, *args: Any, timeout: float) -> Dict[str, Any]:
+    """
+    Send the same request to the services reading the queues at once and
+    collect their replies for up to ``timeout`` seconds in all. The replies
+    by name, leaving out the services which failed or did not reply in time.
+    """
+    reply_queue = _reply_queue()
+    pending = {}
+    for name, queue in queues.items():
+        sequence = _next_sequence()
+        pending[sequence] = name
+        queue.put((op, args, (reply_queue, sequence)))
+
+    replies = {}
+    deadline = time.monotonic() + timeout
+    while pending:
+        try:
+            sequence, ok, value = timed_get(reply_queue, max(0, deadline - time.monotonic()))
+        except QueueEmpty:
+            break
+        # Replies to earlier requests that timed out are dropped here
+        name = pending.pop(sequence, None)
+        if name is None:
+            continue
+        if ok:
+            replies[name] = value
+        else:
+            logger.debug("No %s from %s: %s", op, name, value)
+    if pending:
+        logger.debug("No %s from %s within %ss", op, ", ".join(pending.values()), timeout)
+    return replies
+
+
+def interruptible_get(queue: Queue, wake: threading.Event, timeout: Optional[float] = None) -> Any:
+    """
+    Like ``queue.get(timeout=timeout)``, which polls the queue every
+    POLL_INTERVAL, but waiting on ``wake`` between two polls, so setting it
+    interrupts the wait straight away. Raises QueueEmpty on timeout or once woken.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            return queue.get_nowait()
+        except QueueEmpty:
+            if wake.is_set() or (deadline is not None and time.monotonic() >= deadline):
+                raise
+        wake.wait(POLL_INTERVAL)
+
+
+def timed_get(queue: Queue, timeout: Optional[float] = None) -> Any:
+    """
+    Like ``queue.get(timeout=timeout)``, which truncates the timeout to whole
+    seconds and so returns straight away below one second. Raises QueueEmpty
+    on timeout.
+    """
+    if timeout is None:
+        return queue.get()
+    return interruptible_get(queue, _no_wake, timeout)
+
+
+class QueueService:
+    """
+    A service living in the main interpreter that serves the messages put on
+    a queue by notify() and request(). Each message ``(op, args, reply)`` is
+    dispatched to the ``on_<op>`` method of the subclass, but ``stop`` which
+    calls on_stop() and ends the service. A subclass doing time based work
+    overrides timeout() and on_timeout().
+    """
+
+    name = "service"
+    # Services of the main interpreter do not hold up the exit, subinterpreters do not allow daemon threads
+    daemon = True
+
+    def __init__(self, queue: Queue):
+        self.queue = queue
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve, name=self.name, daemon=self.daemon)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self.queue.put(("stop", (), None))
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def on_stop(self) -> None:
+        """Called when the service is asked to stop"""
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until on_timeout() is due, None when nothing is due"""
+        return None
+
+    def on_timeout(self) -> None:
+        """Called when timeout() runs out, e.g. for the time based work of the service"""
+
+    def serve(self) -> None:
+        logger.debug("Starting %s", self.name)
+        while True:
+            timeout = self.timeout()
+            if timeout is not None and timeout <= 0:
+                try:
+                    self.on_timeout()
+                    continue
+                except Exception:
+                    logger.exception("%s failed its time based work", self.name)
+                    # Still due, so it would fail straight away again
+                    timeout = TIMEOUT_RETRY_DELAY
+            try:
+                op, args, reply = timed_get(self.queue, timeout)
+            except QueueEmpty:
+                continue
+            try:
+                value, ok = getattr(self, f"on_{op}")(*args), True
+            except Exception as e:
+                logger.exception("%s failed to handle %s", self.name, op)
+                value, ok = e, False
+            if reply is not None:
+                reply_queue, sequence = reply
+                reply_queue.put((sequence, ok, value))
+            if op == "stop":
+                break
+        logger.debug("Stopped %s", self.name)
@@ -4,41 +4,268 @@ This replaces the manual subinterpreter management with the new Python 3.14+ Int
 """
 
 import logging
+import os
+import queue
+import signal
+import threading
 import time
 from concurrent.futures import Future
 from concurrent.futures.interpreter import InterpreterPoolExecutor
-from concurrent.interpreters import Queue, QueueEmpty, create_queue
+from concurrent.interpreters import Queue, create_queue
+from dataclasses import dataclass, field
+from pathlib import Path
 from socket import dup
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid7
 
-from hypercorn.config import Config
+from hypercorn.config import Config, Sockets
 from rich.logging import RichHandler
 
-from worker_task import task_worker_task, web_worker_task
+from parimitham.cache_store import CACHE_QUEUE_NAME, CacheStore
+from parimitham.control import DRAIN, RELOAD, STATS, STOP
+from parimitham.dead_letters import DEAD_LETTER_QUEUE_NAME, DeadLetterQueue
+from parimitham.metrics import METRICS_QUEUE_NAME, MetricsAggregator, observe
+from parimitham.payloads import ARENA_NAME_ENV, PAYLOAD_QUEUE_NAME, SLOT_SIZE_ENV, PayloadArena
+from parimitham.pooling import MAIN, TASK, WEB, pool_connections, pool_stats
+from parimitham.readiness import READY_QUEUE_NAME, signal_ready
+from parimitham.result_store import RESULT_QUEUE_NAME, ResultStore
+from parimitham.routing import (
+    QueueGroup,
+    build_routes,
+    create_routing_queues,
+    parse_queue_group,
+    queue_depth,
+    set_routes,
+)
+from parimitham.scheduler import SCHEDULER_QUEUE_NAME, PeriodicTask, TaskScheduler
+from parimitham.supervision import MIN_UPTIME, RECYCLE, requeue_in_flight, restart_delay
+from parimitham.task_registry import discover_task_paths, set_task_table
+from parimitham.tracing import TRACE_QUEUE_NAME, TraceWriter
+from parimitham.worker import migrate, setup_django
+from queue_bridge import notify_queue, request_queues, set_shareable_queue, set_shareable_queues
+from worker_task import task_worker_task, warm_up_task, web_worker_task
 
 logging.basicConfig(level=logging.INFO, format="[pool_manager] %(message)s", handlers=[RichHandler()])
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class TaskWorker:
+    """A running task worker and its control queue"""
+
+    group: QueueGroup
+    worker_number: int
+    future: Future
+    control_queue: Queue
+    # Every worker runs in its own executor, so stopping it finalizes its
+    # interpreter and gives its memory back
+    executor: InterpreterPoolExecutor
+    worker_id: str
+    started_at: float = field(default_factory=time.monotonic)
+    # Started by the autoscaler, only those are retired
+    autoscaled: bool = False
+    # The last control message sent to the worker, and when
+    control_op: Optional[str] = None
+    control_sent_at: float = 0.0
+    # Times in a row the worker died soon after starting
+    quick_crashes: int = 0
+    # Set once the worker reported its startup
+    warm: threading.Event = field(default_factory=threading.Event)
+    # The worker it takes over from in a rolling reload, until it is warm
+    replaces: Optional["TaskWorker"] = None
+
+    @property
+    def name(self) -> str:
+        return f"Task-{self.worker_number}"
+
+    @property
+    def stopping(self) -> bool:
+        """Asked to stop, so not restarted when it exits"""
+        return self.control_op in (STOP, DRAIN)
+
+
+@dataclass
+class WebWorker:
+    """A running web worker and its control queue"""
+
+    worker_number: int
+    future: Future
+    control_queue: Queue
+    executor: InterpreterPoolExecutor
+    started_at: float = field(default_factory=time.monotonic)
+    control_op: Optional[str] = None
+    control_sent_at: float = 0.0
+    quick_crashes: int = 0
+    warm: threading.Event = field(default_factory=threading.Event)
+    replaces: Optional["WebWorker"] = None
+
+    @property
+    def name(self) -> str:
+        return f"Web-{self.worker_number}"
+
+    @property
+    def stopping(self) -> bool:
+        return self.control_op in (STOP, DRAIN)
+
+
+# Seconds a worker started by a rolling reload has to get warm, after which the reload is aborted
+RELOAD_WARM_TIMEOUT = 60.0
+# Seconds given to the task workers still draining at shutdown once told to stop
+STOP_TIMEOUT = 5.0
+# Seconds /metrics waits in all for the stats of the services, then of the workers, well within its render timeout
+SERVICE_STATS_TIMEOUT = 0.25
+WORKER_STATS_TIMEOUT = 0.5
+
+
+@dataclass
+class AutoscalePolicy:
+    """When the autoscaler starts or retires task workers of an elastic group"""
+
+    interval: float = 2.0
+    # Scale up when there are more waiting tasks than this per worker...
+    backlog_per_worker: float = 4.0
+    # ... or when tasks wait longer than this many seconds before starting
+    max_queue_wait: float = 1.0
+    # Retire a worker once the group's queues have been empty this long
+    idle_period: float = 30.0
+    # Minimum seconds between two scaling decisions of a group
+    cooldown: float = 10.0
+
+
+@dataclass
+class SupervisionStats:
+    # (kind, reason) -> restarts, the reason being "crash", "recycle" or "reload"
+    restarts: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    # kind -> crashes, and seconds run by the workers of that kind that exited
+    crashes: Dict[str, int] = field(default_factory=dict)
+    uptime: Dict[str, float] = field(default_factory=dict)
+    requeued: int = 0
+    failed: int = 0
+
+
+@dataclass
+class ScalingStats:
+    scale_ups: int = 0
+    scale_downs: int = 0
+    workers: Dict[str, int] = field(default_factory=dict)
+    depth: Dict[str, int] = field(default_factory=dict)
+    queue_wait: float = 0.0
+
+
 class InterpreterPoolManager:
     """
     Manages worker processes using InterpreterPoolExecutor.
     """
 
-    def __init__(self, max_workers: int):
+    def __init__(
+        self,
+        max_workers: int,
+        max_tasks: Optional[int] = None,
+        max_blocks: Optional[int] = None,
+        graceful_timeout: float = 30.0,
+    ):
         self.max_workers = max_workers
-        self.futures: List[Future] = []
-        self.shutdown_queues = []  # List of Queue objects
+        self.web_workers: List[WebWorker] = []
+        self.task_workers: Dict[str, List[TaskWorker]] = {}
+        self.scaling_stats = ScalingStats()
+        self._task_worker_count = 0
         self._shutdown_requested = False
         self._parent_shutdown_queue: Optional[Queue] = None
-        self.executor = InterpreterPoolExecutor(max_workers=self.max_workers)
+        self._autoscaler: Optional[threading.Thread] = None
+        self._autoscaler_stop = threading.Event()
+        # Task workers stop to be recycled after max_tasks tasks or max_blocks memory blocks
+        self.max_tasks = max_tasks
+        self.max_blocks = max_blocks
+        # Supervision: the workers that exited, in the order their future completed
+        self.supervision_stats = SupervisionStats()
+        self._exits: queue.SimpleQueue = queue.SimpleQueue()
+        self._supervisor = threading.Thread(target=self._supervise, name="supervisor", daemon=True)
+        self._supervisor.start()
+        # Held open for the lifetime of the pool, so restarted web workers get the same listening sockets
+        self._sockets: Optional[Sockets] = None
+        self._web_config: Dict[str, Any] = {}
+        self._queues: Dict[str, Queue] = {}
+        self._routes: Dict[str, Tuple[str, ...]] = {}
+        # A warmed up interpreter kept aside for the next worker the autoscaler starts
+        self._standby: Optional[InterpreterPoolExecutor] = None
+        # Readiness: workers still warming up (name -> submit time), and their time to ready
+        self.ready = threading.Event()
+        self.time_to_ready: Dict[str, float] = {}
+        self._warming: Dict[str, float] = {}
+        # Workers that did not report their startup yet, in the order they were started. A worker
+        # replacing another in a rolling reload has the same name, so they are told apart by object
+        self._cold: List[WebWorker | TaskWorker] = []
+        self._warming_lock = threading.Lock()
+        self._readiness_armed = False
+        self._ready_queue: Optional[Queue] = None
+        self._started_at = time.monotonic()
+        # Table of the tasks handed to every worker, see parimitham.task_registry
+        self.task_paths: Tuple[str, ...] = ()
+        # Whether the tasks left on the queues at shutdown are persisted, and so replayed on the next start
+        self.write_behind = False
+        # Seconds given to the requests in flight and to draining the task queues on shutdown
+        self.graceful_timeout = graceful_timeout
+        self._groups: List[QueueGroup] = []
+        self._reloading = threading.Lock()
 
     def set_parent_shutdown_queue(self, queue: Queue):
         """Set the queue for parent communication."""
         self._parent_shutdown_queue = queue
 
-    def start_web_workers(self, app_path: str, workers: int, worker_queue: Queue, bind: str = "127.0.0.1:8000"):
-        """Start web workers using the pool executor."""
+    def set_ready_queue(self, queue: Queue):
+        """Set the queue flagging the readiness to the web workers."""
+        self._ready_queue = queue
+
+    def _expect_warm_up(self, name: str):
+        with self._warming_lock:
+            if not self._readiness_armed:
+                self._warming[name] = time.monotonic()
+
+    def worker_started(self, name: str, phases: Dict[str, float]):
+        """Called by the metrics aggregator when a worker interpreter reports its startup."""
+        with self._warming_lock:
+            self.time_to_ready[name] = sum(phases.values())
+            self._warming.pop(name, None)
+            worker = next((worker for worker in self._cold if worker.name == name), None)
+            if worker is not None:
+                self._cold.remove(worker)
+        if worker is not None:
+            worker.warm.set()
+        self._check_ready()
+
+    def _workers(self) -> List[WebWorker | TaskWorker]:
+        """The running workers, web workers first"""
+        return [*self.web_workers, *(worker for group in self.task_workers.values() for worker in group)]
+
+    def arm_readiness(self):
+        """Signal readiness as soon as every worker started so far is warm."""
+        with self._warming_lock:
+            self._readiness_armed = True
+        self._check_ready()
+
+    def _check_ready(self):
+        with self._warming_lock:
+            if not self._readiness_armed or self._warming or self.ready.is_set():
+                return
+            self.ready.set()
+        if self._ready_queue is not None:
+            signal_ready(self._ready_queue)
+        logger.info(
+            "All %d workers warm, ready %.2fs after startup (slowest worker: %.2fs)",
+            len(self.time_to_ready),
+            time.monotonic() - self._started_at,
+            max(self.time_to_ready.values(), default=0.0),
+        )
+
+    def start_web_workers(
+        self,
+        app_path: str,
+        workers: int,
+        queues: Dict[str, Queue],
+        routes: Dict[str, Tuple[str, ...]],
+        bind: str = "127.0.0.1:8000",
+    ):
+        """Start web workers, each in its own interpreter."""
 
         logger.info("Starting web workers with InterpreterPoolExecutor")
 
@@ -46,104 +273,457 @@ class InterpreterPoolManager:
         config = Config()
         config.bind = bind
         config.workers = workers
-        sockets = config.create_sockets()
-
-        # Store socket metadata (not the actual duplicated FDs yet)
-        socket_metadata = tuple([(int(s.family), int(s.type), s.proto) for s in sockets.insecure_sockets])
+        self._sockets = config.create_sockets()
+        self._web_config = {
+            "application_path": app_path,
+            "workers": workers,
+            "bind": bind,
+            "graceful_timeout": self.graceful_timeout,
+        }
+        self._queues, self._routes = queues, routes
 
         for i in range(workers):
-            # Duplicate sockets for EACH worker to avoid sharing file descriptors
-            insecure_sockets = tuple(
-                [
-                    (family, sock_type, proto, dup(s.fileno()))
-                    for (family, sock_type, proto), s in zip(socket_metadata, sockets.insecure_sockets)
-                ]
-            )
+            self.web_workers.append(self._start_web_worker(i + 1))
+
+        logger.debug("Web workers submitted to pool executor")
 
-            # Submit web worker task
-            # Create shutdown queue for each web worker
-            shutdown_queue = create_queue()
-            self.shutdown_queues.append(shutdown_queue)
-            future = self.executor.submit(
+    def _start_web_worker(self, worker_number: int, replaces: Optional[WebWorker] = None) -> WebWorker:
+        # Duplicate sockets for EACH worker to avoid sharing file descriptors
+        insecure_sockets = tuple(
+            (int(s.family), int(s.type), s.proto, dup(s.fileno())) for s in self._sockets.insecure_sockets
+        )
+
+        # Create control queue for each web worker
+        control_queue = create_queue()
+        self._expect_warm_up(f"Web-{worker_number}")
+        executor = InterpreterPoolExecutor(max_workers=1)
+        # Held until the worker is tracked, its startup report waits for it
+        with self._warming_lock:
+            future = executor.submit(
                 web_worker_task,
-                worker_number=i + 1,
+                worker_number=worker_number,
                 log_level=logger.level,
-                application_path=app_path,
-                workers=workers,
-                bind=bind,
                 insecure_sockets=insecure_sockets,
-                shutdown_queue=shutdown_queue,
-                worker_queue=worker_queue,
-                parent_shutdown_queue=self._parent_shutdown_queue,
+                control_queue=control_queue,
+                queues=self._queues,
+                routes=self._routes,
+                submitted_at=time.monotonic(),
+                task_paths=self.task_paths,
+                **self._web_config,
+            )
+            web_worker = WebWorker(
+                worker_number=worker_number,
+                future=future,
+                control_queue=control_queue,
+                executor=executor,
+                replaces=replaces,
             )
-            self.futures.append(future)
+            self._cold.append(web_worker)
+        self._watch(web_worker)
+        return web_worker
 
-        # Close the original sockets in the parent process after duplication
-        for s in sockets.insecure_sockets:
-            try:
-                s.close()
-            except Exception as e:
-                logger.warning("Failed to close original socket: %s", e)
+    def start_task_workers(
+        self, groups: List[QueueGroup], queues: Dict[str, Queue], routes: Dict[str, Tuple[str, ...]]
+    ):
+        """Start task workers, each in its own interpreter."""
+        self._queues, self._routes = queues, routes
+        self._groups = groups
 
-        logger.debug("Web workers submitted to pool executor")
-
-    def start_task_workers(self, num_workers: int, worker_queue: Queue):
-        """Start task workers using the pool executor."""
+        for group in groups:
+            logger.info(
+                "Starting %d task workers for queues %s with InterpreterPoolExecutor", group.workers, group.name
+            )
+            self.task_workers.setdefault(group.name, [])
+            for _ in range(group.workers):
+                self._start_task_worker(group, InterpreterPoolExecutor(max_workers=1))
 
-        logger.info("Starting %d task workers with InterpreterPoolExecutor", num_workers)
+        logger.debug("Task workers submitted to pool executor")
 
-        for i in range(num_workers):
-            # Create shutdown queue for each task worker
-            shutdown_queue = create_queue()
-            self.shutdown_queues.append(shutdown_queue)
+    def _start_task_worker(
+        self,
+        group: QueueGroup,
+        executor: InterpreterPoolExecutor,
+        worker_number: Optional[int] = None,
+        autoscaled: bool = False,
+        replaces: Optional[TaskWorker] = None,
+    ) -> TaskWorker:
+        if worker_number is None:
+            self._task_worker_count += 1
+            worker_number = self._task_worker_count
+        # Create control queue for each task worker
+        control_queue = create_queue()
+        self._expect_warm_up(f"Task-{worker_number}")
+        # Set here so the tasks it leaves RUNNING can be found if it dies
+        worker_id = str(uuid7())
 
-            # Submit task worker
-            future = self.executor.submit(
+        # Submit task worker, tracked before its startup report can come in
+        with self._warming_lock:
+            future = executor.submit(
                 task_worker_task,
-                worker_number=i + 1,
+                worker_number=worker_number,
                 log_level=logger.level,
-                shutdown_queue=shutdown_queue,
-                worker_queue=worker_queue,
-                parent_shutdown_queue=self._parent_shutdown_queue,
+                group=group,
+                control_queue=control_queue,
+                queues=self._queues,
+                routes=self._routes,
+                submitted_at=time.monotonic(),
+                task_paths=self.task_paths,
+                worker_id=worker_id,
+                max_tasks=self.max_tasks,
+                max_blocks=self.max_blocks,
             )
-            self.futures.append(future)
 
-        logger.debug("Task workers submitted to pool executor")
+            task_worker = TaskWorker(
+                group=group,
+                worker_number=worker_number,
+                future=future,
+                control_queue=control_queue,
+                executor=executor,
+                worker_id=worker_id,
+                autoscaled=autoscaled,
+                replaces=replaces,
+            )
+            self._cold.append(task_worker)
+        self.task_workers[group.name].append(task_worker)
+        self._watch(task_worker)
+        return task_worker
+
+    def _retire_task_worker(self, task_worker: TaskWorker):
+        """Stop a task worker, the supervisor finalizes its interpreter once it exits."""
+        self.task_workers[task_worker.group.name].remove(task_worker)
+        self.control(task_worker, STOP)
+
+    def control(self, worker: WebWorker | TaskWorker, op: str):
+        """Send a control message to a worker: STOP, DRAIN or RELOAD."""
+        worker.control_op, worker.control_sent_at = op, time.monotonic()
+        notify_queue(worker.control_queue, op)
+
+    def worker_stats(self, timeout: float = WORKER_STATS_TIMEOUT) -> Dict[str, dict]:
+        """Stats of the workers that are warm, read over their control channel within ``timeout`` in all."""
+        control_queues = {
+            worker.name: worker.control_queue
+            for worker in self._workers()
+            if worker.name in self.time_to_ready and not worker.control_op
+        }
+        return request_queues(control_queues, STATS, timeout=timeout)
+
+    def _watch(self, worker: WebWorker | TaskWorker):
+        worker.future.add_done_callback(lambda _: self._exits.put(worker))
+
+    def _supervise(self):
+        """Finalize the workers that exit, and restart those that were not asked to stop."""
+        while True:
+            worker = self._exits.get()
+            if worker is None:
+                return
+            try:
+                self._worker_exited(worker)
+            except Exception:
+                logger.exception("Failed to supervise %s", worker.name)
 
-    def shutdown(self, timeout: float = 5.0):
-        """Shutdown all workers gracefully."""
+    def _worker_exited(self, worker: WebWorker | TaskWorker):
+        kind = "web" if isinstance(worker, WebWorker) else "task"
+        uptime = time.monotonic() - worker.started_at
+        if isinstance(worker, TaskWorker) and worker in self.task_workers[worker.group.name]:
+            self.task_workers[worker.group.name].remove(worker)
+        with self._warming_lock:
+            if worker in self._cold:
+                self._cold.remove(worker)
+        stats = self.supervision_stats
+        stats.uptime[kind] = stats.uptime.get(kind, 0.0) + uptime
+        if worker.control_op:
+            latency = time.monotonic() - worker.control_sent_at
+            observe("worker_stop_seconds", latency, kind=kind, op=worker.control_op)
+            logger.debug("%s exited %.3fs after %s", worker.name, latency, worker.control_op)
+        # Finalizes the interpreter of the worker
+        worker.executor.shutdown(wait=True)
+        if worker.stopping or self._shutdown_requested:
+            logger.debug("%s interpreter finalized", worker.name)
+            return
+        if worker.replaces is not None and not worker.warm.is_set():
+            # The rolling reload gives up, the worker it was replacing keeps running
+            logger.error(
+                "%s died before taking over from %s: %s", worker.name, worker.replaces.name, worker.future.exception()
+            )
+            return
+
+        error = worker.future.exception()
+        result = worker.future.result() if error is None else None
+        if result in (RECYCLE, RELOAD):
+            reason = result
+            logger.info("Restarting %s after %.0fs (%s)", worker.name, uptime, reason)
+        else:
+            reason = "crash"
+            stats.crashes[kind] = stats.crashes.get(kind, 0) + 1
+            logger.error("%s died after %.0fs: %s", worker.name, uptime, error or "exited on its own")
+            if isinstance(worker, TaskWorker):
+                requeued, failed = requeue_in_flight(worker.worker_id, worker.name)
+                stats.requeued += requeued
+                stats.failed += failed
+        stats.restarts[(kind, reason)] = stats.restarts.get((kind, reason), 0) + 1
+
+        quick_crashes = worker.quick_crashes + 1 if reason == "crash" and uptime < MIN_UPTIME else 0
+        delay = restart_delay(quick_crashes)
+        if delay:
+            logger.warning("%s keeps dying, restarting it in %.0fs", worker.name, delay)
+        restart = threading.Timer(delay, self._restart, (worker, quick_crashes))
+        restart.daemon = True
+        restart.start()
+
+    def _restart(self, worker: WebWorker | TaskWorker, quick_crashes: int):
+        if self._shutdown_requested:
+            return
+        try:
+            if isinstance(worker, WebWorker):
+                restarted = self._start_web_worker(worker.worker_number)
+                if worker in self.web_workers:
+                    self.web_workers[self.web_workers.index(worker)] = restarted
+                else:
+                    # Died while taking over from another worker in a rolling reload
+                    self.web_workers.append(restarted)
+            else:
+                restarted = self._start_task_worker(
+                    worker.group,
+                    InterpreterPoolExecutor(max_workers=1),
+                    worker_number=worker.worker_number,
+                    autoscaled=worker.autoscaled,
+                )
+        except Exception:
+            logger.exception("Cannot restart %s, shutting down", worker.name)
+            if self._parent_shutdown_queue is not None:
+                self._parent_shutdown_queue.put("shutdown")
+            return
+        restarted.quick_crashes = quick_crashes
+
+    def start_reload(self):
+        """Run a rolling reload in the background, see reload()."""
+        threading.Thread(target=self.reload, name="reloader", daemon=True).start()
+
+    def reload(self) -> bool:
+        """
+        Replace every worker by one running in a fresh interpreter, one at a time.
+        The new web worker accepts on the listening sockets held by the pool and
+        the new task worker reads the shared queues, and only once it is warm is
+        the old one stopped, finishing the requests and tasks in flight. The tasks
+        waiting on the queues are left there for the new workers.
+        """
+        if not self._reloading.acquire(blocking=False):
+            logger.warning("A reload is already running")
+            return False
+        try:
+            started_at = time.monotonic()
+            logger.info("Reloading %d workers", len(self._workers()))
+            for old in list(self.web_workers):
+                if old not in self.web_workers or old.stopping:
+                    continue
+                new = self._start_web_worker(old.worker_number, replaces=old)
+                if not self._take_over(new, old):
+                    return False
+                self.web_workers[self.web_workers.index(old)] = new
+                self.control(old, STOP)
+            for group in self._groups:
+                for old in list(self.task_workers.get(group.name, ())):
+                    if old not in self.task_workers[group.name] or old.stopping:
+                        continue
+                    new = self._start_task_worker(
+                        group,
+                        InterpreterPoolExecutor(max_workers=1),
+                        worker_number=old.worker_number,
+                        autoscaled=old.autoscaled,
+                        replaces=old,
+                    )
+                    if not self._take_over(new, old):
+                        return False
+                    self._retire_task_worker(old)
+            logger.info("Reload complete in %.2fs", time.monotonic() - started_at)
+            return True
+        finally:
+            self._reloading.release()
+
+    def _take_over(self, new: WebWorker | TaskWorker, old: WebWorker | TaskWorker) -> bool:
+        """Wait for a worker started by a rolling reload to be warm, False if it died or took too long"""
+        kind = "web" if isinstance(new, WebWorker) else "task"
+        deadline = time.monotonic() + RELOAD_WARM_TIMEOUT
+        while not new.warm.wait(0.1):
+            if new.future.done() or self._shutdown_requested or time.monotonic() > deadline:
+                if not new.future.done():
+                    self.control(new, STOP)
+                logger.error("%s did not get warm, reload aborted, %s keeps running", new.name, old.name)
+                return False
+        new.replaces = None
+        stats = self.supervision_stats
+        stats.restarts[(kind, RELOAD)] = stats.restarts.get((kind, RELOAD), 0) + 1
+        return True
+
+    def start_autoscaler(
+        self,
+        groups: List[QueueGroup],
+        queues: Dict[str, Queue],
+        routes: Dict[str, Tuple[str, ...]],
+        result_store: ResultStore,
+        policy: AutoscalePolicy,
+    ):
+        """Start the supervisor loop scaling the elastic task worker groups."""
+        elastic_groups = [group for group in groups if group.elastic]
+        if not elastic_groups:
+            return
+
+        logger.info(
+            "Autoscaling task workers for %s",
+            ", ".join(f"{group.name} ({group.workers}-{group.max_workers})" for group in elastic_groups),
+        )
+        self._autoscaler = threading.Thread(
+            target=self._autoscale,
+            args=(elastic_groups, queues, routes, result_store, policy),
+            name="autoscaler",
+            daemon=True,
+        )
+        self._autoscaler.start()
+        self._warm_standby()
+
+    def _warm_standby(self):
+        """Warm up an interpreter in the background for the next scale up."""
+        self._standby = InterpreterPoolExecutor(max_workers=1)
+        self._standby.submit(warm_up_task)
+
+    def _take_standby(self) -> InterpreterPoolExecutor:
+        executor = self._standby or InterpreterPoolExecutor(max_workers=1)
+        self._warm_standby()
+        return executor
+
+    def _autoscale(
+        self,
+        groups: List[QueueGroup],
+        queues: Dict[str, Queue],
+        routes: Dict[str, Tuple[str, ...]],
+        result_store: ResultStore,
+        policy: AutoscalePolicy,
+    ):
+        now = time.monotonic()
+        idle_since = dict.fromkeys((group.name for group in groups), now)
+        last_scaled = dict.fromkeys((group.name for group in groups), 0.0)
+
+        while not self._autoscaler_stop.wait(policy.interval):
+            now = time.monotonic()
+            queue_wait = result_store.queue_wait
+            self.scaling_stats.queue_wait = queue_wait
+
+            for group in groups:
+                workers = self.task_workers[group.name]
+                depth = queue_depth(queues, group.queue_names)
+                self.scaling_stats.workers[group.name] = len(workers)
+                self.scaling_stats.depth[group.name] = depth
+
+                if depth:
+                    idle_since[group.name] = now
+                if now - last_scaled[group.name] < policy.cooldown:
+                    continue
+
+                backlogged = depth > policy.backlog_per_worker * max(len(workers), 1)
+                waiting = depth > 0 and queue_wait > policy.max_queue_wait
+                if (backlogged or waiting) and len(workers) < group.max_workers:
+                    logger.info(
+                        "Scaling up %s to %d task workers (depth: %d, queue wait: %.2fs)",
+                        group.name,
+                        len(workers) + 1,
+                        depth,
+                        queue_wait,
+                    )
+                    self._start_task_worker(group, self._take_standby(), autoscaled=True)
+                    self.scaling_stats.scale_ups += 1
+                    last_scaled[group.name] = now
+                elif now - idle_since[group.name] >= policy.idle_period and len(workers) > group.workers:
+                    # Only the workers started by the autoscaler are retired
+                    task_worker = next((worker for worker in reversed(workers) if worker.autoscaled), None)
+                    if task_worker is None:
+                        continue
+                    logger.info(
+                        "Scaling down %s to %d task workers (idle for %.0fs)",
+                        group.name,
+                        len(workers) - 1,
+                        now - idle_since[group.name],
+                    )
+                    self._retire_task_worker(task_worker)
+                    self.scaling_stats.scale_downs += 1
+                    last_scaled[group.name] = now
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        Shutdown all workers gracefully: the web workers finish their requests, then
+        the task workers run the tasks left on the queues, within ``timeout`` seconds
+        (default: the graceful timeout of the pool).
+        """
+        timeout = self.graceful_timeout if timeout is None else timeout
         if self._shutdown_requested:
             return
 
         self._shutdown_requested = True
         logger.info("Shutting down worker pool...")
 
-        # Send stop signals to all workers
-        for queue in self.shutdown_queues:
-            try:
-                queue.put("stop")
-            except Exception as e:
-                logger.warning("Failed to send stop signal: %s", e)
+        self._autoscaler_stop.set()
+        if self._autoscaler:
+            self._autoscaler.join()
+
+        workers = self._workers()
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+        # Web workers stop accepting and finish their requests first, so the tasks they
+        # enqueue are still there when the task workers run what is left on the queues
+        for worker in self.web_workers:
+            self._send_stop(worker, STOP)
+        self._wait_for(self.web_workers, deadline)
+        task_workers = [worker for worker in workers if isinstance(worker, TaskWorker)]
+        for worker in task_workers:
+            self._send_stop(worker, DRAIN)
+        self._wait_for(task_workers, deadline)
+
+        draining = [worker for worker in task_workers if not worker.future.done()]
+        if draining:
+            logger.warning("%d task worker(s) still draining after %.0fs, stopping them", len(draining), timeout)
+            for worker in draining:
+                self._send_stop(worker, STOP)
+            self._wait_for(draining, time.monotonic() + STOP_TIMEOUT)
+        queue_names = {queue_name for group in self._groups for queue_name in group.queue_names}
+        left = queue_depth(self._queues, queue_names) if queue_names else 0
+        if left and self.write_behind:
+            logger.warning("%d queued task item(s) left, to be replayed on the next start", left)
+        elif left:
+            logger.warning("%d queued task item(s) left, dropped without write-behind (--hybrid)", left)
+        logger.info("Workers stopped in %.2fs", time.monotonic() - started_at)
+
+        self._exits.put(None)
+        self._supervisor.join()
+
+        # Shutdown the executors, finalizing the interpreters
+        if self._standby:
+            self._standby.shutdown(wait=True, cancel_futures=True)
+        for worker in workers:
+            worker.executor.shutdown(wait=True, cancel_futures=True)
+        if self._sockets:
+            for s in self._sockets.insecure_sockets:
+                s.close()
+        logger.info("Pool executor shutdown complete")
+
+    def _send_stop(self, worker: WebWorker | TaskWorker, op: str):
+        try:
+            self.control(worker, op)
+        except Exception as e:
+            logger.warning("Failed to send %s to %s: %s", op, worker.name, e)
 
-        # Wait for futures to complete
-        start_time = time.time()
-        for future in self.futures:
-            remaining_timeout = max(0, timeout - (time.time() - start_time))
+    def _wait_for(self, workers: List[WebWorker | TaskWorker], deadline: float):
+        for worker in workers:
             try:
-                future.result(timeout=remaining_timeout)
+                worker.future.result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                return
             except Exception as e:
                 logger.warning(f"Worker task completed with error: {e}")
 
-        # Shutdown the executor
-        if self.executor:
-            self.executor.shutdown(wait=True, cancel_futures=True)
-            logger.info("Pool executor shutdown complete")
-
     def join(self):
         """Wait for all workers to complete."""
-        for future in self.futures:
+        for worker in self.web_workers:
             try:
-                future.result()
+                worker.future.result()
             except Exception as e:
                 logger.error("Worker task failed: %s", e)
                 raise
@@ -155,6 +735,209 @@ class InterpreterPoolManager:
         self.shutdown()
 
 
+def pool_metrics(
+    pool: InterpreterPoolManager,
+    queues: Dict[str, Queue],
+    groups: List[QueueGroup],
+    result_store: ResultStore,
+    scheduler: TaskScheduler,
+    dead_letters: DeadLetterQueue,
+    cache_store: CacheStore,
+):
+    """Gauges of the main interpreter, read when the metrics are rendered"""
+    # Asked over their queues, their state is only touched by their own threads
+    services = {
+        "scheduler": scheduler.queue,
+        "dead_letters": dead_letters.queue,
+        "result_store": result_store.queue,
+        "cache_store": cache_store.queue,
+    }
+    service_stats = request_queues(services, "stats", timeout=SERVICE_STATS_TIMEOUT)
+    queue_names = dict.fromkeys(queue_name for group in groups for queue_name in group.queue_names)
+    for queue_name in queue_names:
+        yield (
+            "task_queue_depth",
+            "gauge",
+            "Items waiting on a task queue",
+            {"queue": queue_name},
+            queue_depth(queues, [queue_name]),
+        )
+    for group in groups:
+        yield (
+            "task_workers",
+            "gauge",
+            "Running task workers",
+            {"group": group.name},
+            len(pool.task_workers.get(group.name, ())),
+        )
+    yield "pool_ready", "gauge", "Whether every worker started with the pool is warm", {}, int(pool.ready.is_set())
+    for name, seconds in pool.time_to_ready.items():
+        yield (
+            "interpreter_time_to_ready_seconds",
+            "gauge",
+            "Seconds from submitting a worker to it being warm",
+            {"interpreter": name},
+            seconds,
+        )
+    if PAYLOAD_QUEUE_NAME in queues:
+        free_slots = queues[PAYLOAD_QUEUE_NAME].qsize()
+        yield "payload_arena_free_slots", "gauge", "Free slots of the payload arena", {}, free_slots
+    if "scheduler" in service_stats:
+        yield (
+            "scheduled_tasks",
+            "gauge",
+            "Tasks waiting for their run_after or retry",
+            {},
+            service_stats["scheduler"]["scheduled"],
+        )
+    if "dead_letters" in service_stats:
+        yield (
+            "tasks_dead_lettered_total",
+            "counter",
+            "Tasks moved to the dead-letter queue",
+            {},
+            service_stats["dead_letters"]["added"],
+        )
+    result_stats = service_stats.get("result_store")
+    if result_stats:
+        yield "result_store_entries", "gauge", "Task results kept in the result store", {}, result_stats["entries"]
+        yield "result_store_bytes", "gauge", "Bytes accounted for by the result store", {}, result_stats["bytes"]
+        yield (
+            "result_store_watchers",
+            "gauge",
+            "Requests waiting for a task of the result store to finish",
+            {},
+            result_stats["watched"],
+        )
+        yield (
+            "result_store_evicted_total",
+            "counter",
+            "Task results evicted from the result store",
+            {},
+            result_stats["evicted"],
+        )
+    cache_stats = service_stats.get("cache_store")
+    if cache_stats:
+        yield "shared_cache_entries", "gauge", "Entries of the shared cache", {}, cache_stats["entries"]
+        yield "shared_cache_bytes", "gauge", "Bytes accounted for by the shared cache", {}, cache_stats["bytes"]
+        for result, stat in (("hit", "hits"), ("miss", "misses")):
+            yield (
+                "shared_cache_lookups_total",
+                "counter",
+                "Lookups of the shared cache, by hit or miss",
+                {"result": result},
+                cache_stats[stat],
+            )
+        for reason in ("evicted", "expired"):
+            yield (
+                "shared_cache_removed_total",
+                "counter",
+                "Entries removed from the shared cache, evicted over its budget or expired",
+                {"reason": reason},
+                cache_stats[reason],
+            )
+    yield (
+        "autoscaler_scale_ups_total",
+        "counter",
+        "Task workers started by the autoscaler",
+        {},
+        pool.scaling_stats.scale_ups,
+    )
+    yield (
+        "autoscaler_scale_downs_total",
+        "counter",
+        "Task workers retired by the autoscaler",
+        {},
+        pool.scaling_stats.scale_downs,
+    )
+    supervision = pool.supervision_stats
+    for (kind, reason), restarts in sorted(supervision.restarts.items()):
+        yield (
+            "worker_restarts_total",
+            "counter",
+            "Workers restarted after a crash, to be recycled or reloaded",
+            {"kind": kind, "reason": reason},
+            restarts,
+        )
+    now = time.monotonic()
+    running = {"web": pool.web_workers, "task": [worker for group in pool.task_workers.values() for worker in group]}
+    for kind, crashes in sorted(supervision.crashes.items()):
+        # Seconds run by all the workers of that kind, per crash
+        uptime = supervision.uptime.get(kind, 0.0) + sum(now - worker.started_at for worker in running[kind])
+        yield (
+            "worker_mtbf_seconds",
+            "gauge",
+            "Mean time between worker crashes, in seconds of worker uptime",
+            {"kind": kind},
+            uptime / crashes,
+        )
+    main_pool = pool_stats()
+    if main_pool:
+        yield from db_pool_metrics("Main", main_pool)
+    for name, worker_stats in sorted(pool.worker_stats().items()):
+        if "db_pool" in worker_stats:
+            yield from db_pool_metrics(name, worker_stats["db_pool"])
+        yield (
+            "interpreter_allocated_blocks",
+            "gauge",
+            "Memory blocks allocated by a worker interpreter",
+            {"interpreter": name},
+            worker_stats["allocated_blocks"],
+        )
+        if "in_flight" in worker_stats:
+            yield (
+                "task_worker_in_flight",
+                "gauge",
+                "Tasks running in a task worker",
+                {"interpreter": name},
+                worker_stats["in_flight"],
+            )
+    yield (
+        "tasks_requeued_total",
+        "counter",
+        "Tasks put back on their queue after their worker died",
+        {},
+        supervision.requeued,
+    )
+
+
+def db_pool_metrics(name: str, stats: dict):
+    """Saturation and wait time of the database connection pool of an interpreter"""
+    labels = {"interpreter": name}
+    yield "db_pool_connections", "gauge", "Connections opened by a database connection pool", labels, stats["size"]
+    yield "db_pool_max_connections", "gauge", "Size limit of a database connection pool", labels, stats["max_size"]
+    yield "db_pool_available", "gauge", "Idle connections of a database connection pool", labels, stats["available"]
+    yield "db_pool_waiting", "gauge", "Threads waiting for a pooled database connection", labels, stats["waiting"]
+    yield (
+        "db_pool_requests_total",
+        "counter",
+        "Connections taken from a database connection pool",
+        labels,
+        stats["requests"],
+    )
+    yield (
+        "db_pool_queued_total",
+        "counter",
+        "Connections waited for, the pool having none available",
+        labels,
+        stats["queued"],
+    )
+    yield (
+        "db_pool_wait_seconds_total",
+        "counter",
+        "Seconds spent waiting for a pooled database connection",
+        labels,
+        stats["wait_seconds"],
+    )
+    yield (
+        "db_pool_timeouts_total",
+        "counter",
+        "Connections given up on after the pool timeout",
+        labels,
+        stats["timeouts"],
+    )
+
+
 class ErrorRaisedFromPoolException(Exception):
     pass
 
@@ -164,8 +947,25 @@ def run_application(
     workers: int,
     task_workers: int,
     bind: str = "127.0.0.1:8000",
+    queue_groups: Optional[List[QueueGroup]] = None,
+    queue_maxsize: int = 0,
+    autoscale_policy: Optional[AutoscalePolicy] = None,
+    result_ttl: float = 3600,
+    result_max_entries: int = 10_000,
+    result_max_bytes: int = 32 * 1024 * 1024,
+    write_behind: bool = False,
+    run_migrations: bool = True,
+    payload_slots: int = 0,
+    payload_slot_size: int = 1024 * 1024,
+    max_tasks: Optional[int] = None,
+    max_blocks: Optional[int] = None,
+    graceful_timeout: float = 30.0,
+    trace: bool = False,
 ):
     logger.info("Starting Django application and task workers with InterpreterPoolExecutor")
+    if not queue_groups:
+        queue_groups = [QueueGroup(name="default", weights=(("default", 1),), workers=task_workers)]
+    task_workers = sum(group.workers for group in queue_groups)
     logger.info("Web workers: %d, Task workers: %d, Bind: %s", workers, task_workers, bind)
 
     # Create parent shutdown queue
@@ -173,37 +973,153 @@ def run_application(
 
     # Calculate total workers needed
     total_workers = workers + task_workers  # N web workers + M task workers
-    worker_queue = create_queue()
+    queues = {
+        RESULT_QUEUE_NAME: create_queue(),
+        METRICS_QUEUE_NAME: create_queue(),
+        READY_QUEUE_NAME: create_queue(),
+        SCHEDULER_QUEUE_NAME: create_queue(),
+        DEAD_LETTER_QUEUE_NAME: create_queue(),
+        CACHE_QUEUE_NAME: create_queue(),
+        **create_routing_queues(queue_groups, maxsize=queue_maxsize),
+    }
+    if trace:
+        # Only shared when tracing, the interpreters skip the spans without it
+        queues[TRACE_QUEUE_NAME] = create_queue()
+    routes = build_routes(queue_groups)
+
+    arena = None
+    if payload_slots:
+        arena = PayloadArena.create(payload_slots, payload_slot_size)
+        queues[PAYLOAD_QUEUE_NAME] = arena.free_slots
+        # Read by the interpreters to attach to the arena
+        os.environ[ARENA_NAME_ENV] = arena.name
+        os.environ[SLOT_SIZE_ENV] = str(payload_slot_size)
+        logger.info("Payload arena: %d slots of %d bytes", payload_slots, payload_slot_size)
+
+    # Migrations run once here rather than in every task worker
+    started_at = time.monotonic()
+    setup_django()
+    if run_migrations:
+        migrate()
+    logger.info("Django set up in %.2fs", time.monotonic() - started_at)
+    task_paths = discover_task_paths()
+    set_task_table(task_paths)
+    logger.info("Task table: %s", ", ".join(f"{task_id}={path}" for task_id, path in enumerate(task_paths)))
+
+    # The main interpreter puts tasks on the lanes too: retries, dead letter and write-behind replays
+    set_shareable_queues(queues)
+    set_routes(routes)
+
+    writer = None
+    if write_behind:
+        # The write-behind writer persists the result store to the database from the main interpreter
+        from django.tasks import DEFAULT_TASK_BACKEND_ALIAS
 
-    with InterpreterPoolManager(max_workers=total_workers) as pool:
+        from parimitham.core.write_behind import WriteBehindWriter
+
+        writer = WriteBehindWriter(DEFAULT_TASK_BACKEND_ALIAS)
+        writer.start()
+
+    # The result store is shared by all the interpreters and lives in the main one
+    result_store = ResultStore(
+        queues[RESULT_QUEUE_NAME],
+        ttl=result_ttl,
+        max_entries=result_max_entries,
+        max_bytes=result_max_bytes,
+        listener=writer,
+    )
+    result_store.start()
+
+    from django.conf import settings
+
+    if settings.DATABASES["default"]["OPTIONS"].get("pool"):
+        # Each interpreter has its own pool, their sizes add up against the max_connections of Postgres
+        max_task_workers = sum(max(group.workers, group.max_workers) for group in queue_groups)
+        logger.info(
+            "Database connection pools: up to %d connections (web %d, task %d, main %d per interpreter)",
+            pool_connections(workers, max_task_workers, settings.DB_POOL_SIZES),
+            settings.DB_POOL_SIZES[WEB],
+            settings.DB_POOL_SIZES[TASK],
+            settings.DB_POOL_SIZES[MAIN],
+        )
+
+    scheduler = TaskScheduler(
+        queues[SCHEDULER_QUEUE_NAME],
+        periodic_tasks=[PeriodicTask(name, **spec) for name, spec in settings.TASK_PERIODIC.items()],
+    )
+    scheduler.start()
+    dead_letters = DeadLetterQueue(queues[DEAD_LETTER_QUEUE_NAME], Path(settings.DEAD_LETTER_FILE))
+    dead_letters.start()
+    cache_store = CacheStore(
+        queues[CACHE_QUEUE_NAME], max_entries=settings.CACHE_MAX_ENTRIES, max_bytes=settings.CACHE_MAX_BYTES
+    )
+    cache_store.start()
+    trace_writer = None
+    if trace:
+        trace_writer = TraceWriter(queues[TRACE_QUEUE_NAME], Path(settings.TRACE_FILE))
+        trace_writer.start()
+        logger.info("Tracing %s of the requests to %s", settings.TRACE_SAMPLE_RATE, settings.TRACE_FILE)
+
+    with InterpreterPoolManager(
+        max_workers=total_workers, max_tasks=max_tasks, max_blocks=max_blocks, graceful_timeout=graceful_timeout
+    ) as pool:
         # Set parent shutdown queue
         pool.set_parent_shutdown_queue(parent_shutdown_queue)
+        pool.set_ready_queue(queues[READY_QUEUE_NAME])
+        pool.task_paths = task_paths
+        pool.write_behind = writer is not None
+
+        # Metrics recorded in the main interpreter, e.g. by the result store, are pushed there too
+        set_shareable_queue(METRICS_QUEUE_NAME, queues[METRICS_QUEUE_NAME])
+        metrics = MetricsAggregator(
+            queues[METRICS_QUEUE_NAME],
+            collectors=[
+                lambda: pool_metrics(pool, queues, queue_groups, result_store, scheduler, dead_letters, cache_store)
+            ],
+            startup_listener=pool.worker_started,
+        )
+        metrics.start()
 
         try:
             # Start workers
-            pool.start_web_workers(app_path, workers, worker_queue, bind)
-            pool.start_task_workers(task_workers, worker_queue)
+            pool.start_web_workers(app_path, workers, queues, routes, bind)
+            pool.start_task_workers(queue_groups, queues, routes)
+            pool.arm_readiness()
+            if writer:
+                from parimitham.core.write_behind import replay_unfinished_tasks
 
-            logger.info("All workers started. Press Ctrl+C to stop.")
+                replay_unfinished_tasks(writer.backend_name)
+            pool.start_autoscaler(queue_groups, queues, routes, result_store, autoscale_policy or AutoscalePolicy())
 
-            # Wait for shutdown signal from parent queue or completion
-            while True:
-                # Check for shutdown message with a small timeout
-                try:
-                    message = parent_shutdown_queue.get(timeout=2)
-                    if message == "shutdown":
-                        logger.info("Received shutdown request from worker")
-                        raise ErrorRaisedFromPoolException()
-                except QueueEmpty:
-                    continue
+            # SIGHUP reloads the workers one at a time, without closing the listening sockets
+            signal.signal(signal.SIGHUP, lambda signum, frame: parent_shutdown_queue.put("reload"))
+            logger.info("All workers started. Press Ctrl+C to stop, send SIGHUP to reload.")
 
-            # Wait for completion
-            pool.join()
+            # Block until the supervisor asks for a shutdown, Ctrl+C interrupts the wait
+            while True:
+                message = parent_shutdown_queue.get()
+                if message == "shutdown":
+                    logger.info("Received shutdown request from the supervisor")
+                    raise ErrorRaisedFromPoolException()
+                if message == "reload":
+                    pool.start_reload()
         except ErrorRaisedFromPoolException:
             logger.error("Error Raised from pool exception")
         except KeyboardInterrupt:
             logger.info("Received keyboard interrupt, shutting down...")
         finally:
+            pool.shutdown()
+            metrics.stop()
+            scheduler.stop()
+            dead_letters.stop()
+            cache_store.stop()
+            if trace_writer:
+                trace_writer.stop()
+            result_store.stop()
+            if writer:
+                writer.stop()
+            if arena:
+                arena.close(unlink=True)
             logger.info("Application shutdown complete")
 
 
@@ -241,6 +1157,167 @@ if __name__ == "__main__":
         type=int,
     )
 
+    parser.add_argument(
+        "-q",
+        "--queue",
+        dest="queue_groups",
+        help=(
+            "A group of task workers as QUEUES=COUNT, QUEUES being comma separated queue names with an optional "
+            ":WEIGHT, e.g. fast:3,default:1=2. COUNT may be a MIN-MAX range to autoscale the group. "
+            "May be repeated, replaces --task-workers"
+        ),
+        action="append",
+        default=[],
+        type=parse_queue_group,
+    )
+    parser.add_argument(
+        "--queue-maxsize",
+        help="Bound every task queue to this many items, 0 for unbounded",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--queue-overflow",
+        help="What web workers do when a bounded task queue is full",
+        choices=["block", "reject", "spill"],
+        default=None,
+    )
+    parser.add_argument(
+        "--queue-block-timeout",
+        help="Seconds the block overflow policy waits for room before rejecting the task",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--autoscale-interval",
+        help="Seconds between two samples of the autoscaler",
+        default=2.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--autoscale-backlog",
+        help="Start a task worker when more tasks than this are waiting per worker",
+        default=4.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--autoscale-queue-wait",
+        help="Start a task worker when tasks wait longer than this many seconds",
+        default=1.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--autoscale-idle",
+        help="Retire a task worker once its queues have been empty for this many seconds",
+        default=30.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--task-concurrency",
+        help="Number of tasks each task worker runs at once",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="Coalesce up to this many enqueues per queue item and run up to this many tasks per wakeup",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--batch-window",
+        help="Seconds a web worker waits to fill a batch of enqueues before flushing it",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--result-ttl",
+        help="Seconds an idle task result is kept in the result store",
+        default=3600,
+        type=float,
+    )
+    parser.add_argument(
+        "--result-max-entries",
+        help="Maximum number of task results kept in the result store",
+        default=10_000,
+        type=int,
+    )
+    parser.add_argument(
+        "--result-max-bytes",
+        help="Memory budget in bytes for the payloads kept in the result store",
+        default=32 * 1024 * 1024,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--trace-sample",
+        help="Share of the requests to trace along with their tasks, 0 to turn tracing off, see trace_summary",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="JSON lines file the spans are appended to (default: TRACE_FILE setting)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--payload-slots",
+        help="Number of slots of the shared memory arena for large task payloads, 0 to keep them inline",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--payload-slot-size",
+        help="Size in bytes of a payload arena slot, larger payloads stay inline",
+        default=1024 * 1024,
+        type=int,
+    )
+    parser.add_argument(
+        "--payload-threshold",
+        help="Task arguments of at least this many bytes go through the payload arena",
+        default=64 * 1024,
+        type=int,
+    )
+    parser.add_argument(
+        "--interface",
+        help="Serve the application through ASGI on the event loop of each web worker, or through WSGI on a thread pool",
+        choices=["asgi", "wsgi"],
+        default="asgi",
+    )
+    parser.add_argument(
+        "--no-migrate",
+        dest="run_migrations",
+        help="Do not run the migrations on startup, e.g. when the deployment already ran them",
+        action="store_false",
+        default=True,
+    )
+    parser.add_argument(
+        "--hybrid",
+        help="Persist the interpreter queue tasks to the database in the background and replay them on restart",
+        action="store_true",
+        default=os.environ.get("ENABLE_HYBRID_TASK", "").lower() in ("1", "true", "yes", "on"),
+    )
+
+    parser.add_argument(
+        "--max-tasks",
+        help="Recycle a task worker, in a fresh interpreter, after it ran this many tasks",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--max-blocks",
+        help="Recycle a task worker once its interpreter holds this many memory blocks (sys.getallocatedblocks)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        help="Seconds given on shutdown to the requests in flight and to the task workers to drain the queues",
+        type=float,
+        default=30.0,
+    )
+
     args = parser.parse_args()
 
     # Set up logging
@@ -249,7 +1326,30 @@ if __name__ == "__main__":
     else:
         logger.setLevel(logging.INFO)
 
-    application_path = "parimitham.wsgi:application"
+    # Subinterpreters read the Django settings from the environment inherited from here
+    if args.queue_groups:
+        queue_names = dict.fromkeys(queue_name for group in args.queue_groups for queue_name in group.queue_names)
+        os.environ["TASK_QUEUES"] = ",".join(queue_names)
+    if args.queue_overflow is not None:
+        os.environ["TASK_QUEUE_OVERFLOW"] = args.queue_overflow
+    if args.queue_block_timeout is not None:
+        os.environ["TASK_QUEUE_BLOCK_TIMEOUT"] = str(args.queue_block_timeout)
+    if args.task_concurrency is not None:
+        os.environ["TASK_CONCURRENCY"] = str(args.task_concurrency)
+    if args.batch_size is not None:
+        os.environ["TASK_BATCH_SIZE"] = str(args.batch_size)
+    if args.batch_window is not None:
+        os.environ["TASK_BATCH_WINDOW"] = str(args.batch_window)
+    if args.hybrid:
+        os.environ["ENABLE_HYBRID_TASK"] = "true"
+    if args.trace_sample:
+        os.environ["TRACE_SAMPLE_RATE"] = str(args.trace_sample)
+    if args.trace_file:
+        os.environ["TRACE_FILE"] = args.trace_file
+    if args.payload_slots:
+        os.environ["TASK_PAYLOAD_THRESHOLD"] = str(args.payload_threshold)
+
+    application_path = f"parimitham.{args.interface}:application"
 
     # Run the application
     run_application(
@@ -257,4 +1357,23 @@ if __name__ == "__main__":
         workers=args.workers,
         task_workers=args.task_workers,
         bind=args.bind,
+        queue_groups=args.queue_groups,
+        queue_maxsize=args.queue_maxsize,
+        autoscale_policy=AutoscalePolicy(
+            interval=args.autoscale_interval,
+            backlog_per_worker=args.autoscale_backlog,
+            max_queue_wait=args.autoscale_queue_wait,
+            idle_period=args.autoscale_idle,
+        ),
+        result_ttl=args.result_ttl,
+        result_max_entries=args.result_max_entries,
+        result_max_bytes=args.result_max_bytes,
+        write_behind=args.hybrid,
+        run_migrations=args.run_migrations,
+        payload_slots=args.payload_slots,
+        payload_slot_size=args.payload_slot_size,
+        max_tasks=args.max_tasks,
+        max_blocks=args.max_blocks,
+        graceful_timeout=args.graceful_timeout,
+        trace=args.trace_sample > 0,
     )
@@ -1,53 +1,26 @@
-import asyncio
 import logging
 import os
 import signal
 import threading
-import time
-from concurrent.interpreters import Queue, QueueEmpty
+from concurrent.interpreters import Queue
 from socket import socket
-from typing import Any, Callable, Optional
+from typing import Dict, Optional, Tuple
 
 from hypercorn.asyncio.run import asyncio_worker
 from hypercorn.config import Config, Sockets
 
-from parimitham.worker import configure_db_worker, configure_worker
-from queue_bridge import set_shareable_queue
+from parimitham.control import RELOAD, WorkerControl
+from parimitham.metrics import StartupTimer
+from parimitham.pooling import TASK, WEB, set_interpreter_role
+from parimitham.routing import QueueGroup, set_routes
+from parimitham.supervision import RECYCLE
+from parimitham.task_registry import set_task_table
+from parimitham.worker import configure_db_worker, configure_worker, warm_up
+from queue_bridge import set_shareable_queues
 
 ENABLE_DB_BACKED_TASK = os.getenv("ENABLE_DB_BACKED_TASK", "False").lower() in ("true", "1", "t")
 
 
-def shutdown_monitor_task(
-    shutdown_queue: Queue,
-    worker_number: int,
-    shutdown_callback: Callable[[Any], None],
-    worker_instance: Optional[Any] = None,
-    worker_type: str = "worker",
-    shutdown_event: Optional[threading.Event] = None,
-) -> None:
-    """
-    Common shutdown monitoring task that waits for shutdown signals.
-    """
-    while True:
-        try:
-            msg = shutdown_queue.get(timeout=1.0)
-            if msg == "stop":
-                logging.info("Received stop signal - %s %d shutting down", worker_type, worker_number)
-                if worker_instance:
-                    shutdown_callback(worker_instance)
-                else:
-                    shutdown_callback()
-                break
-        except QueueEmpty:
-            # Check if we should exit via shutdown event
-            if shutdown_event and shutdown_event.is_set():
-                break
-            continue
-        except (OSError, RuntimeError):
-            # Handle queue operation errors gracefully
-            time.sleep(0.1)
-
-
 def web_worker_task(
     worker_number: int,
     log_level: int,
@@ -55,33 +28,30 @@ def web_worker_task(
     workers: int,
     bind: str,
     insecure_sockets: tuple,
-    shutdown_queue: Queue,
-    worker_queue: Queue,
-    parent_shutdown_queue: Optional[Queue] = None,
-) -> None:
+    control_queue: Queue,
+    queues: Dict[str, Queue],
+    routes: Dict[str, Tuple[str, ...]],
+    submitted_at: Optional[float] = None,
+    task_paths: Tuple[str, ...] = (),
+    graceful_timeout: float = 3.0,
+) -> Optional[str]:
     """
     Web worker task to be executed in a subinterpreter using InterpreterPoolExecutor.
+    Returns RELOAD when asked to reload, and raises errors to the pool manager,
+    which restarts the worker either way.
     """
+    startup = StartupTimer(f"Web-{worker_number}", submitted_at)
+    # Creating the interpreter and importing this module and its dependencies
+    startup.mark("interpreter")
     logging.basicConfig(
         level=log_level, format=f"%(asctime)s Web-[{worker_number}] %(message)s", handlers=[logging.StreamHandler()]
     )
 
     logger = logging.getLogger(__name__)
     logger.info("Starting web worker: %d", worker_number)
-    worker_shutdown_event = asyncio.Event()
-    worker_shutdown_event.clear()
-    thread_shutdown_event = threading.Event()
-    signal_thread = None
-
-    # In worker_task.py
-    def web_worker_shutdown_callback():
-        """Callback to handle web worker shutdown."""
-        logger.info("Shutdown signal received")
-        worker_shutdown_event.set()
-        thread_shutdown_event.set()
-        # Also put a message in the parent queue if available
-        if parent_shutdown_queue:
-            parent_shutdown_queue.put("shutdown")
+    # Polled by hypercorn, which then stops accepting and lets the requests in flight finish
+    worker_shutdown_event = threading.Event()
+    control = WorkerControl(control_queue, stop=worker_shutdown_event.set)
 
     logger.info("Starting hypercorn worker")
     _insecure_sockets = []
@@ -90,54 +60,36 @@ def web_worker_task(
         for sock_data in insecure_sockets:
             _insecure_sockets.append(socket(*sock_data))
         worker_hypercorn_sockets = Sockets([], _insecure_sockets, [])
-        set_shareable_queue("worker_queue", worker_queue)
+        set_shareable_queues(queues)
+        set_routes(routes)
+        set_task_table(task_paths)
+        set_interpreter_role(WEB)
+        # Warm up before accepting connections, hypercorn then finds the application imported
+        warm_up(startup, application_path)
         worker_config = Config()
         worker_config.application_path = application_path
         worker_config.workers = workers
         worker_config.debug = log_level == logging.DEBUG
         worker_config.accesslog = logger
         worker_config.bind = bind
+        # Seconds given to the requests in flight once stopped
+        worker_config.graceful_timeout = graceful_timeout
 
-        # Start signal monitoring thread
-        signal_thread = threading.Thread(
-            target=shutdown_monitor_task,
-            args=(
-                shutdown_queue,
-                worker_number,
-                web_worker_shutdown_callback,
-                None,
-                "Web App worker",
-                thread_shutdown_event,
-            ),
-        )
-        signal_thread.start()
-
+        control.start()
+        startup.report()
         logger.debug("Starting asyncio worker")
         asyncio_worker(worker_config, worker_hypercorn_sockets, shutdown_event=worker_shutdown_event)
+        logger.info("Web worker stopped (%s)", control.exit_reason)
+        return RELOAD if control.exit_reason == RELOAD else None
 
-    except (OSError, RuntimeError) as e:
-        logger.exception("Error in web worker: %s", e)
-        if parent_shutdown_queue:
-            try:
-                parent_shutdown_queue.put("shutdown")
-            except Exception:
-                pass
     except Exception as e:
-        logger.exception("Unexpected error in web worker: %s", e)
-        if parent_shutdown_queue:
-            parent_shutdown_queue.put("shutdown")
+        logger.exception("Error in web worker: %s", e)
+        raise
     finally:
         logging.debug("Starting worker cleanup")
-        # Signal the shutdown event to unblock asyncio and threads
         worker_shutdown_event.set()
-        thread_shutdown_event.set()
-
-        # Wait for signal thread to finish
-        if signal_thread and signal_thread.is_alive():
-            try:
-                signal_thread.join(timeout=2.0)
-            except Exception as e:
-                logger.debug("Error joining signal thread: %s", e)
+        # Ends the control thread, which the interpreter waits for
+        control.stop()
 
         # Close all sockets explicitly
         for sock in _insecure_sockets:
@@ -146,72 +98,84 @@ def web_worker_task(
             except Exception as e:
                 logger.debug("Error closing socket: %s", e)
 
-        # Give some time for asyncio to shut down gracefully
-        time.sleep(0.5)
-
         logging.debug("Worker cleanup complete")
 
 
+def warm_up_task() -> None:
+    """
+    Warm up the idle interpreter of a standby executor. Importing this module
+    also imports the worker dependencies, so a task worker submitted to the
+    same executor later on only has to configure itself.
+    """
+    set_interpreter_role(TASK)
+    warm_up()
+
+
 def task_worker_task(
     worker_number: int,
     log_level: int,
-    shutdown_queue: Queue,
-    worker_queue: Queue,
-    parent_shutdown_queue: Optional[Queue] = None,
-) -> None:
+    group: QueueGroup,
+    control_queue: Queue,
+    queues: Dict[str, Queue],
+    routes: Dict[str, Tuple[str, ...]],
+    submitted_at: Optional[float] = None,
+    task_paths: Tuple[str, ...] = (),
+    worker_id: Optional[str] = None,
+    max_tasks: Optional[int] = None,
+    max_blocks: Optional[int] = None,
+) -> Optional[str]:
     """
     Task worker task to be executed in a subinterpreter using InterpreterPoolExecutor.
+    Returns RECYCLE when the worker stopped on its own after ``max_tasks`` tasks or
+    ``max_blocks`` memory blocks, RELOAD when asked to reload, and raises errors to
+    the pool manager, which restarts the worker in all these cases.
     """
+    startup = StartupTimer(f"Task-{worker_number}", submitted_at)
+    # Creating the interpreter and importing this module and its dependencies
+    startup.mark("interpreter")
     logging.basicConfig(
         level=log_level, format=f"%(asctime)s Task-[{worker_number}] %(message)s", handlers=[logging.StreamHandler()]
     )
     logger = logging.getLogger(__name__)
     logger.info("Starting task worker: %d", worker_number)
-    thread_shutdown_event = threading.Event()
-    signal_thread = None
-
-    def task_worker_shutdown_callback(worker):
-        """Callback to handle task worker shutdown."""
-        worker.shutdown(signal.SIGINT, None)
-        thread_shutdown_event.set()
+    control = None
 
     try:
-        set_shareable_queue("worker_queue", worker_queue)
+        set_shareable_queues(queues)
+        set_routes(routes)
+        set_task_table(task_paths)
+        set_interpreter_role(TASK)
+        warm_up(startup)
 
         if ENABLE_DB_BACKED_TASK:
-            worker = configure_db_worker()
+            worker = configure_db_worker(group.queue_names, worker_id, max_tasks)
+
+            def stop():
+                if worker.running:
+                    worker.shutdown(signal.SIGINT, None)
+
+            # The Postgres worker wakes up from its wait for a notification to stop
+            control = WorkerControl(control_queue, stop=getattr(worker, "stop", stop))
         else:
-            worker = configure_worker()
-        logger.info("Task worker configured with queue: %s", worker_queue)
-        # Start signal monitoring thread
-        signal_thread = threading.Thread(
-            target=shutdown_monitor_task,
-            args=(
-                shutdown_queue,
-                worker_number,
-                task_worker_shutdown_callback,
-                worker,
-                "Task worker",
-                thread_shutdown_event,
-            ),
-        )
-        signal_thread.start()
+            worker = configure_worker(group, worker_id, max_tasks, max_blocks)
+            control = WorkerControl(control_queue, stop=worker.stop, drain=worker.drain, stats=worker.stats)
+        startup.mark("worker")
+        logger.info("Task worker configured with queues: %s", group.name)
 
+        control.start()
+        startup.report()
         worker.run()
+        logger.info("Task worker stopped (%s)", control.exit_reason or "on its own")
+        if control.exit_reason == RELOAD:
+            return RELOAD
+        # Not stopped by the pool manager
+        return RECYCLE if control.exit_reason is None else None
 
-    except (OSError, RuntimeError) as e:
-        logging.exception("Error in task worker: %s", e)
     except Exception as exc:
         logging.exception(f"Task worker errored: {exc}")
-        if parent_shutdown_queue:
-            parent_shutdown_queue.put("shutdown")
+        raise
     finally:
         logging.info("Task worker finished")
-
-        # Signal thread shutdown and wait for it to finish
-        thread_shutdown_event.set()
-        if signal_thread and signal_thread.is_alive():
-            try:
-                signal_thread.join(timeout=2.0)
-            except Exception as e:
-                logging.debug("Error joining signal thread: %s", e)
+        # Ends the control thread, which the interpreter waits for
+        if control:
+            control.stop()